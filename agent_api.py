@@ -1,10 +1,35 @@
-import json
+import atexit
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from azure.identity import DefaultAzureCredential, ClientSecretCredential
-from azure.ai.projects import AIProjectClient
-from azure.ai.agents.models import BingGroundingTool
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import config
+import metrics
+from agent_registry import METADATA_KEY, AgentRegistry, definition_key, instructions_hash, matches_definition
+from agent_threads import AgentThreadPool, current_pool
+from catalog_index import CatalogIndex
+from provider_context import (
+    GroupStats,
+    ProviderContextCache,
+    interleave,
+    provider_key,
+    summary_prompt,
+    with_context,
+)
+from rate_limiter import AdaptiveConcurrencyLimiter, run_throttle_error, throttle_retry_after
+from response_schema import BATCH_REPLY, ROW_REPLY, ReplyStats, repair_prompt, reply_stats, validate_result
+from result_cache import ResultCache, agent_answer, normalize_value, row_key
+from retry_policy import (
+    RunCancelled,
+    RunControl,
+    RunDeadlineExceeded,
+    RunFailedError,
+    call_with_retries,
+    current_control,
+)
 
 project_endpoint = config.PROJECT_ENDPOINT
 conn_id = config.BING_CONNECTION_NAME
@@ -28,105 +53,1270 @@ client_id = os.getenv('AZURE_CLIENT_ID')
 client_secret = os.getenv('AZURE_CLIENT_SECRET') 
 tenant_id = os.getenv('AZURE_TENANT_ID')
 
-# Fallback to DefaultAzureCredential
-credential = ClientSecretCredential(
-    tenant_id=tenant_id,
-    client_id=client_id,
-    client_secret=client_secret
-)
+# The project client and agent are created on first use (see get_project_client
+# and get_agent) so importing this module stays cheap
+project_client = None
+credential = None
+_client_lock = threading.Lock()
 
-project_client = AIProjectClient(
-    endpoint=project_endpoint,
-    credential=credential,
-)
 
-bing = BingGroundingTool(connection_id=conn_id)
+def create_project_client():
+    """
+    Build the project client for the configured AGENT_BACKEND.
+
+    The Azure clients send every request through the shared connection pool
+    (http_transport.py) and sign in through the shared token cache
+    (token_cache.py).
+
+    Returns:
+        Tuple of (client, credential); credential is None for the fake backend
+    """
+    if config.AGENT_BACKEND == "fake":
+        # Offline stand-in for benchmarks and local development; see fake_backend.py
+        from fake_backend import FakeProjectClient
+        print("Using fake agent backend")
+        return FakeProjectClient.from_config(), None
+
+    from azure.ai.projects import AIProjectClient
+    from http_transport import get_transport
+    from token_cache import CachedCredential
+
+    if config.AGENT_BACKEND == "http":
+        # The real SDK against the local HTTP stand-in; see agent_stand_in.py
+        from agent_stand_in import StandInCredential, local_authentication_policy
+        print(f"Using HTTP stand-in agent backend at {project_endpoint}")
+        stand_in_credential = CachedCredential(StandInCredential(project_endpoint), f"stand-in|{project_endpoint}")
+        client = AIProjectClient(endpoint=project_endpoint, credential=stand_in_credential,
+                                 transport=get_transport(),
+                                 authentication_policy=local_authentication_policy(stand_in_credential))
+        return client, stand_in_credential
+
+    from azure.identity import ClientSecretCredential
+
+    # Fallback to DefaultAzureCredential
+    sp_credential = CachedCredential(
+        ClientSecretCredential(tenant_id=tenant_id, client_id=client_id, client_secret=client_secret),
+        f"{tenant_id}|{client_id}",
+    )
+    return AIProjectClient(endpoint=project_endpoint, credential=sp_credential,
+                           transport=get_transport()), sp_credential
+
+
+def connection_stats(max_workers=None):
+    """
+    Counters of the shared connection pool and token cache (empty for the fake backend).
+
+    Args:
+        max_workers: Grow the connection pool to fit this many concurrent calls first
+    """
+    if config.AGENT_BACKEND == "fake":
+        return {}
+    from http_transport import get_session, stats as transport_stats
+    from token_cache import get_token_cache
+
+    if max_workers:
+        get_session(max_workers)
+    return dict(transport_stats(), **get_token_cache().stats())
+
+
+def get_project_client():
+    """Get the shared project client, creating it on first use."""
+    global project_client, credential
+    client = project_client
+    if client is None:
+        with _client_lock:
+            if project_client is None:
+                project_client, credential = create_project_client()
+            client = project_client
+    return client
+
+
+AGENT_NAME = "my-agent-certificate-mapper"
+INSTRUCTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_instruction.md")
 
 # Singleton pattern for agent creation
 _agent_instance = None
+_agent_lock = threading.Lock()
+_agent_registry = AgentRegistry()
+
+
+BATCH_HEADER = (
+    "Verify each certificate below. Reply with a JSON array containing one object per "
+    "line, each with the line's \"id\" plus \"newCertificateName\" and \"remark\"."
+)
+
+
+def load_instructions():
+    """Read the agent instructions shipped with the app."""
+    with open(INSTRUCTIONS_PATH, "r") as f:
+        return f.read()
+
+
+def compact_value(value, limit=None):
+    """Collapse whitespace in a cell value and cut it to config.PROMPT_MAX_VALUE_CHARS."""
+    limit = config.PROMPT_MAX_VALUE_CHARS if limit is None else limit
+    text = "" if value is None else " ".join(str(value).split())
+    if limit and len(text) > limit:
+        text = text[:limit - 1].rstrip() + "…"
+    return text
+
+
+def prompt_fields(row_dict):
+    """The (column, value) pairs of a row sent to the agent: config.PROMPT_FIELDS, or every column if none match."""
+    wanted = {normalize_value(field) for field in config.PROMPT_FIELDS}
+    fields = [(k, v) for k, v in row_dict.items() if normalize_value(k) in wanted]
+    return fields or list(row_dict.items())
+
+
+def format_row(row_dict):
+    """Serialize a row dict into the user message sent to the agent."""
+    return ", ".join(f"{k}: {compact_value(v)}" for k, v in prompt_fields(row_dict))
+
+
+def run_usage(run):
+    """Tuple of (prompt_tokens, completion_tokens) reported for a run; zeros when it carries no usage."""
+    usage = getattr(run, "usage", None)
+    if usage is None:
+        return 0, 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+# Tool call types of the web search the agent is grounded with
+GROUNDING_TOOL_TYPES = ("bing_grounding", "bing_custom_search")
+
+
+def step_grounding_calls(step):
+    """Number of web-grounding tool calls in one run step."""
+    calls = getattr(getattr(step, "step_details", None), "tool_calls", None) or []
+    return sum(1 for call in calls if getattr(call, "type", None) in GROUNDING_TOOL_TYPES)
+
+
+def token_cost(prompt_tokens, completion_tokens):
+    """Estimated cost of a token count at the configured per-1K token prices."""
+    return round((prompt_tokens * config.PROMPT_TOKEN_PRICE_PER_1K
+                  + completion_tokens * config.COMPLETION_TOKEN_PRICE_PER_1K) / 1000, 6)
+
+
+def parse_agent_reply(message_text, row_dict):
+    """Validate an assistant reply against the row schema, or mark every column as a parse error."""
+    result, error = ROW_REPLY.parse(message_text)
+    if error is not None:
+        return {col: "Parse error" for col in row_dict.keys()}
+    return agent_answer(result)
+
+
+def use_backend(client):
+    """
+    Route every agent call through ``client``.
+
+    Any object exposing the ``agents`` operations used here (threads, messages,
+    runs, create_agent) works, e.g. fake_backend.FakeProjectClient.
+    """
+    global project_client, _agent_instance, _streaming_unavailable, _thread_pool
+    if _thread_pool is not None:
+        _thread_pool.close()
+    project_client = client
+    _agent_instance = None
+    _streaming_unavailable = False
+    _thread_pool = None
 
 
 def get_agent():
-    """Get or create the singleton agent instance."""
+    """Get the agent for this process, resolving it once even when called from many threads."""
     global _agent_instance
-    if _agent_instance is None:
-        with open("agent_instruction.md", "r") as f:
-            instructions = f.read()
-        _agent_instance = project_client.agents.create_agent(
-            model=model_deployment,
-            name="my-agent-certificate-mapper",
-            instructions=instructions,
-            tools=bing.definitions,
-        )
-        print(f"Created new agent with ID: {_agent_instance.id}")
-    else:
-        print(f"Reusing existing agent with ID: {_agent_instance.id}")
-    return _agent_instance
-
-
-def call_agent(row_dict):
+    agent = _agent_instance
+    if agent is None:
+        with _agent_lock:
+            if _agent_instance is None:
+                _agent_instance = _resolve_agent(get_project_client())
+            agent = _agent_instance
+    return agent
+
+
+def get_agent_registry():
+    """The registry of agent IDs shared by the sync and async engines."""
+    return _agent_registry
+
+
+def agent_definition_key(instructions):
+    """Registry key of the agent this process needs."""
+    endpoint = "fake" if config.AGENT_BACKEND == "fake" else project_endpoint
+    return definition_key(endpoint, AGENT_NAME, model_deployment, instructions)
+
+
+def _find_agent(client, instructions):
+    """Look for an agent on the service created from the current name, model and instructions."""
+    for agent in client.agents.list_agents():
+        if matches_definition(agent, AGENT_NAME, model_deployment, instructions):
+            return agent
+    return None
+
+
+def _resolve_agent(client):
+    """
+    Reuse the agent registered for the current definition, or one found on the
+    service by name and instruction hash, and only create one when neither
+    exists. The registry lock keeps parallel processes from creating duplicates.
+    """
+    from azure.ai.agents.models import BingGroundingTool
+
+    instructions = load_instructions()
+    key = agent_definition_key(instructions)
+    with _agent_registry.locked():
+        agent_id = _agent_registry.lookup(key)
+        if agent_id:
+            try:
+                agent = client.agents.get_agent(agent_id)
+                print(f"Reusing agent with ID: {agent.id}")
+                return agent
+            except Exception as e:
+                print(f"Registered agent {agent_id} is unavailable ({e}); resolving again")
+                _agent_registry.forget(key)
+        agent = _find_agent(client, instructions)
+        if agent is not None:
+            print(f"Reusing agent with ID: {agent.id}")
+        else:
+            bing = BingGroundingTool(connection_id=conn_id)
+            agent = client.agents.create_agent(
+                model=model_deployment,
+                name=AGENT_NAME,
+                instructions=instructions,
+                tools=bing.definitions,
+                metadata={METADATA_KEY: instructions_hash(instructions)},
+            )
+            print(f"Created new agent with ID: {agent.id}")
+        _agent_registry.save(key, agent.id)
+        return agent
+
+
+def cleanup_orphaned_agents(min_age_hours=None, dry_run=False):
+    """
+    Delete mapper agents other than the one in use and those in the agent registry.
+
+    Before agents were reused every process created its own, so a project can
+    hold many agents named AGENT_NAME. Agents registered for any definition
+    (e.g. another endpoint's or an earlier instructions version still run by
+    other processes) are kept, as are agents younger than ``min_age_hours``
+    because another machine may still be using them.
+
+    Returns:
+        List of the IDs deleted (or that would be deleted with dry_run)
+    """
+    min_age_hours = config.AGENT_ORPHAN_MIN_AGE_HOURS if min_age_hours is None else min_age_hours
+    client = get_project_client()
+    keep = {get_agent().id} | _agent_registry.agent_ids()
+    cutoff = time.time() - min_age_hours * 3600
+    orphans = []
+    for agent in client.agents.list_agents():
+        if getattr(agent, "name", None) != AGENT_NAME or agent.id in keep:
+            continue
+        created_at = getattr(agent, "created_at", None)
+        if hasattr(created_at, "timestamp"):
+            created_at = created_at.timestamp()
+        if created_at is not None and created_at > cutoff:
+            continue
+        orphans.append(agent.id)
+    for agent_id in orphans:
+        if dry_run:
+            print(f"Would delete orphaned agent {agent_id}")
+            continue
+        try:
+            client.agents.delete_agent(agent_id)
+            print(f"Deleted orphaned agent {agent_id}")
+        except Exception as e:
+            print(f"Could not delete agent {agent_id}: {e}")
+            continue
+        with _agent_registry.locked():
+            _agent_registry.forget(agent_id=agent_id)
+    return orphans
+
+
+# Lazily opened persistent result cache shared by all worker threads
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Get the shared verification result cache, or None when caching is disabled."""
+    global _result_cache
+    if not config.CACHE_ENABLED:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            # Scoped to the backend and agent definition, so stand-in answers never reach real runs
+            _result_cache = ResultCache(
+                namespace=f"{config.AGENT_BACKEND}|{agent_definition_key(load_instructions())}")
+    return _result_cache
+
+
+# Catalog index of certificates verified in earlier runs, loaded on first use
+_catalog_index = None
+_catalog_index_loaded = False
+_catalog_index_lock = threading.Lock()
+
+
+def get_catalog_index():
+    """Get the local certificate catalog, or None when it is disabled or has not been built."""
+    global _catalog_index, _catalog_index_loaded
+    if not config.CATALOG_ENABLED:
+        return None
+    with _catalog_index_lock:
+        if not _catalog_index_loaded:
+            _catalog_index_loaded = True
+            if os.path.exists(config.CATALOG_PATH):
+                try:
+                    _catalog_index = CatalogIndex.load(config.CATALOG_PATH)
+                    print(f"Loaded catalog index with {len(_catalog_index)} certificates")
+                except Exception as e:
+                    print(f"Could not load catalog index {config.CATALOG_PATH}: {e}")
+    return _catalog_index
+
+
+def lookup_local(row_dict, cache=None):
+    """Answer a row without the agent, from the result cache or a confident catalog match."""
+    if cache is not None:
+        cached = cache.get(row_dict)
+        if cached is not None:
+            return cached
+    catalog = get_catalog_index()
+    if catalog is not None:
+        return catalog.resolve(row_dict)
+    return None
+
+
+# Agent threads for calls made outside process_rows_with_progress (which uses its own pool)
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+
+
+def get_thread_pool():
+    """Get the process-wide agent thread pool, creating it on first use."""
+    global _thread_pool
+    with _thread_pool_lock:
+        if _thread_pool is None:
+            _thread_pool = AgentThreadPool(get_project_client, prefetch=0)
+            atexit.register(_thread_pool.close)
+    return _thread_pool
+
+
+# Provider summaries shared by every batch of this process (see provider_context.py)
+_provider_contexts = ProviderContextCache()
+
+
+def get_provider_contexts():
+    """The process-wide cache of provider summaries used by affinity scheduling."""
+    return _provider_contexts
+
+
+def provider_summary(row_dict):
+    """
+    Have the agent summarize the certificate listing of a row's provider in one web-grounded run.
+
+    Returns:
+        The summary text, or None when the run produced none
+    """
+    try:
+        run, reply = call_with_retries(_ask_agent, summary_prompt(row_dict))
+    except (RunFailedError, RunDeadlineExceeded) as e:
+        print(f"Could not summarize provider {provider_key(row_dict)} ({e}); its rows run without context")
+        return None
+    if run.status != "completed":
+        return None
+    return reply
+
+
+def call_agent(row_dict, use_cache=True, context=None):
+    """
+    Verify one row, answering from the result cache or the catalog index when possible.
+
+    Args:
+        row_dict: Dictionary representing the row
+        use_cache: Whether to consult the result cache and catalog
+        context: Optional function returning a provider summary to prefix to the
+            prompt; only called when the row goes to the agent
+    """
+    cache = get_result_cache() if use_cache else None
+    if use_cache:
+        local = lookup_local(row_dict, cache)
+        if local is not None:
+            return local
+    result = _run_agent(row_dict, context)
+    if cache is not None:
+        cache.put(row_dict, result)
+    return result
+
+
+ACTIVE_RUN_STATUSES = ("queued", "in_progress", "cancelling")
+
+# Set once the backend has refused the streaming API; later runs poll directly
+_streaming_unavailable = False
+
+
+def _cancel_run(thread_id, run_id):
+    try:
+        get_project_client().agents.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        print(f"Could not cancel run {run_id}: {e}")
+
+
+def poll_schedule(initial=None, maximum=None, factor=None):
+    """
+    Yield the delays between run status polls.
+
+    Runs that finish quickly are picked up after RUN_POLL_INITIAL_SECONDS;
+    the delay then grows by RUN_POLL_BACKOFF_FACTOR up to
+    RUN_POLL_INTERVAL_SECONDS so long runs don't flood the service with
+    status requests. A factor of 1 gives a fixed cadence.
+    """
+    maximum = config.RUN_POLL_INTERVAL_SECONDS if maximum is None else maximum
+    delay = min(maximum, config.RUN_POLL_INITIAL_SECONDS if initial is None else initial)
+    factor = config.RUN_POLL_BACKOFF_FACTOR if factor is None else factor
+    while True:
+        yield delay
+        delay = min(maximum, delay * factor)
+
+
+def _grounding_calls(thread_id, run):
+    """Web-grounding tool calls a finished run made, counted from its run steps."""
+    try:
+        with metrics.span("run_steps.list"):
+            steps = get_project_client().agents.run_steps.list(thread_id=thread_id, run_id=run.id)
+            return sum(step_grounding_calls(step) for step in steps)
+    except Exception as e:
+        print(f"Could not list the steps of run {run.id}: {e}")
+        return 0
+
+
+def _wait_for_run(thread_id, agent_id, **run_options):
+    """
+    Start a run and poll it to a terminal status on the adaptive poll schedule.
+
+    Unlike runs.create_and_process, the loop honours the RunControl bound to
+    this thread: it cancels the run and raises when the row deadline passes or
+    when another attempt for the same row has already won.
+    """
+    control = current_control()
+    run = get_project_client().agents.runs.create(thread_id=thread_id, agent_id=agent_id, **run_options)
+    delays = poll_schedule()
+    while run.status in ACTIVE_RUN_STATUSES or run.status == "requires_action":
+        if run.status == "requires_action":
+            # The agent only uses server-side tools; nothing can satisfy a client tool call
+            _cancel_run(thread_id, run.id)
+            raise RunFailedError(run)
+        try:
+            control.check()
+        except Exception:
+            _cancel_run(thread_id, run.id)
+            raise
+        wait = next(delays)
+        remaining = control.remaining()
+        if remaining is not None:
+            wait = max(0.0, min(wait, remaining))
+        control.cancel_event.wait(wait)
+        run = get_project_client().agents.runs.get(thread_id=thread_id, run_id=run.id)
+    return run
+
+
+def message_text(message):
+    """Text of the first content part of a thread message ('' if it has none)."""
+    try:
+        return message.content[0].text.value
+    except Exception:
+        return ""
+
+
+def read_run_event(event_type, data):
+    """
+    Pick the useful parts out of one run stream event.
+
+    Returns:
+        Tuple of (run, reply_text): the run snapshot carried by ``thread.run.*``
+        events and the text of a completed assistant message; either is None
+        when the event carries neither
+    """
+    event_type = str(event_type)
+    # Run step events (thread.run.step.*) carry a status too, but describe a step, not the run
+    if (event_type.startswith("thread.run.") and not event_type.startswith("thread.run.step.")
+            and getattr(data, "status", None)):
+        return data, None
+    if event_type == "thread.message.completed" and getattr(data, "role", None) == "assistant":
+        return None, message_text(data)
+    return None, None
+
+
+def _stream_run(thread_id, agent_id, **run_options):
+    """
+    Start a run on the run event stream and follow it to a terminal status.
+
+    The assistant reply is taken from the ``thread.message.completed`` event,
+    so no status polls or messages.list call are needed, and web-grounding
+    calls are counted from ``thread.run.step.completed`` events. The
+    RunControl is checked after every event.
+
+    Returns:
+        Tuple of (run, reply_text); reply_text is None when the stream carried
+        no completed assistant message
+    """
+    control = current_control()
+    run = None
+    reply = None
+    grounding_calls = 0
+    with get_project_client().agents.runs.stream(thread_id=thread_id, agent_id=agent_id,
+                                                 **run_options) as stream:
+        for event_type, data, _ in stream:
+            if event_type == "thread.run.step.completed":
+                grounding_calls += step_grounding_calls(data)
+            event_run, event_reply = read_run_event(event_type, data)
+            run = event_run or run
+            reply = reply if event_reply is None else event_reply
+            if run is not None and run.status == "requires_action":
+                # The agent only uses server-side tools; nothing can satisfy a client tool call
+                _cancel_run(thread_id, run.id)
+                raise RunFailedError(run)
+            try:
+                control.check()
+            except Exception:
+                if run is not None:
+                    _cancel_run(thread_id, run.id)
+                raise
+    if run is None:
+        raise RuntimeError("Run stream ended without a run")
+    if config.COUNT_GROUNDING_CALLS:
+        control.record_grounding(grounding_calls)
+    return run, reply
+
+
+def _complete_run(thread_id, agent_id, **run_options):
+    """
+    Run the agent on a thread per RUN_COMPLETION_MODE.
+
+    Returns:
+        Tuple of (run, reply_text); reply_text is None when the reply still has
+        to be fetched with messages.list
+    """
+    global _streaming_unavailable
+    if config.RUN_COMPLETION_MODE == "stream" and not _streaming_unavailable:
+        try:
+            if not hasattr(get_project_client().agents.runs, "stream"):
+                raise NotImplementedError("backend has no runs.stream")
+            return _stream_run(thread_id, agent_id, **run_options)
+        except NotImplementedError as e:
+            _streaming_unavailable = True
+            print(f"Run streaming unavailable ({e}); polling run status instead")
+    run = _wait_for_run(thread_id, agent_id, **run_options)
+    if config.COUNT_GROUNDING_CALLS:
+        current_control().record_grounding(_grounding_calls(thread_id, run))
+    return run, None
+
+
+def _fetch_reply(thread_id, run):
+    """Text of the assistant message a completed run produced, or None."""
+    with metrics.span("messages.list"):
+        # Only this run's messages; a reused thread also holds earlier rows
+        messages = get_project_client().agents.messages.list(thread_id=thread_id, run_id=run.id)
+        assistant_messages = [m for m in messages if m.role == "assistant"]
+    # Messages are listed newest first
+    return message_text(assistant_messages[0]) if assistant_messages else None
+
+
+def _repair_reply(thread_id, agent_id, reply, reply_schema, run_options):
+    """
+    Validate a reply and, when it is malformed, re-ask for it on the same thread.
+
+    The repair run gets a short follow-up message naming the problem and runs
+    with tool_choice "none", so the agent restates its answer without
+    repeating the web-grounded search. Up to config.REPLY_REPAIR_ATTEMPTS
+    repairs are made.
+
+    Returns:
+        The first reply that passes validation, or the original reply
+    """
+    reply_stats.record("replies")
+    _, error = reply_schema.parse(reply)
+    if error is None:
+        return reply
+    reply_stats.record("parse_failures")
+    repair_options = dict(run_options, tool_choice="none")
+    for attempt in range(1, config.REPLY_REPAIR_ATTEMPTS + 1):
+        if "truncation_strategy" in repair_options:
+            # The row message plus every answer and repair request since
+            repair_options["truncation_strategy"] = {"type": "last_messages", "last_messages": 1 + 2 * attempt}
+        reply_stats.record("repairs")
+        with metrics.span("runs.repair"):
+            get_project_client().agents.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=repair_prompt(error, reply_schema),
+            )
+            run, repaired = _complete_run(thread_id, agent_id, **repair_options)
+            current_control().record_usage(*run_usage(run))
+            if run.status != "completed":
+                print(f"Reply repair run {run.status}: {getattr(run, 'last_error', None)}")
+                return reply
+            if repaired is None:
+                repaired = _fetch_reply(thread_id, run)
+        _, error = reply_schema.parse(repaired)
+        if error is None:
+            reply_stats.record("repaired")
+            return repaired
+    return reply
+
+
+def _ask_agent(content, reply_schema=None):
+    """
+    Post one user message on a pooled agent thread and run the agent on it.
+
+    With a reply_schema, the run requests it as structured output when
+    config.STRUCTURED_OUTPUT is set, and a malformed reply is repaired on the
+    same thread (see _repair_reply).
+
+    Returns:
+        Tuple of (run, reply_text); reply_text is None when the run produced
+        no assistant message
+
+    Raises:
+        ThrottledError for rate-limited runs, RunFailedError for other failed
+        runs, RunDeadlineExceeded/RunCancelled when the RunControl stops it
+    """
     agent = get_agent()  # Get the singleton agent instance
-    user_input_string = ", ".join(f"{k}: {v}" for k, v in row_dict.items())
-    thread = project_client.agents.threads.create()
-    project_client.agents.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=user_input_string,
-    )
-    run = project_client.agents.runs.create_and_process(
-        thread_id=thread.id,
-        agent_id=agent.id,
-    )
-    if run.status == "failed":
+    pool = current_pool() or get_thread_pool()
+    with metrics.span("threads.acquire"):
+        thread_id = pool.acquire()
+    run_options = dict(pool.run_options)
+    if reply_schema is not None and config.STRUCTURED_OUTPUT:
+        run_options["response_format"] = reply_schema.response_format()
+    reusable = False
+    try:
+        with metrics.span("messages.create"):
+            get_project_client().agents.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=content,
+            )
+        with metrics.span("runs.complete"):
+            run, reply = _complete_run(thread_id, agent.id, **run_options)
+        current_control().record_usage(*run_usage(run))
+        reusable = run.status == "completed"
+        if run.status == "failed":
+            throttled = run_throttle_error(run)
+            if throttled is not None:
+                raise throttled
+            raise RunFailedError(run)
+        if run.status != "completed":
+            return run, reply
+        if reply is None:
+            reply = _fetch_reply(thread_id, run)
+        if reply is not None and reply_schema is not None:
+            # Not reusable while a repair run may still be active
+            reusable = False
+            reply = _repair_reply(thread_id, agent.id, reply, reply_schema, run_options)
+            reusable = True
+        return run, reply
+    finally:
+        pool.release(thread_id, reusable)
+
+
+def timed_out_result(row_dict):
+    """Error result for a row whose deadline passed before the agent answered it."""
+    return {col: "Run timed out" for col in row_dict.keys()}
+
+
+def _run_agent(row_dict, context=None):
+    """Run the agent on a single row, retrying transient failures, and parse its JSON answer."""
+    content = with_context(format_row(row_dict), context() if context else None)
+    try:
+        run, message_formatted = call_with_retries(_ask_agent, content, ROW_REPLY)
+    except RunFailedError:
         return {col: "Run failed" for col in row_dict.keys()}
-    messages = project_client.agents.messages.list(thread_id=thread.id)
-    assistant_messages = [m for m in messages if m.role == "assistant"]
-    if assistant_messages:
+    except RunDeadlineExceeded:
+        return timed_out_result(row_dict)
+    if run.status != "completed":
+        return {col: f"Run {run.status}" for col in row_dict.keys()}
+    if message_formatted is None:
+        return {col: "No response" for col in row_dict.keys()}
+    with metrics.span("parse"):
+        return parse_agent_reply(message_formatted, row_dict)
+
+
+def format_batch(row_dicts):
+    """Serialize several rows into one user message, one line per row with a stable ID."""
+    lines = [BATCH_HEADER]
+    lines.extend(f"id={row_id}; {format_row(row_dict)}" for row_id, row_dict in enumerate(row_dicts))
+    return "\n".join(lines)
+
+
+def parse_batch_reply(message_text, count):
+    """
+    Extract per-row results from a batched reply.
+
+    Returns:
+        List of length ``count`` holding a result dict per row ID, or None for
+        rows that are missing or malformed in the reply
+    """
+    results = [None] * count
+    items, error = BATCH_REPLY.parse(message_text)
+    if error is not None:
+        return results
+    for item in items:
         try:
-            message_formatted = assistant_messages[-1].content[0].text.value
-            start = message_formatted.find('{')
-            end = message_formatted.rfind('}') + 1
-            json_str = message_formatted[start:end]
-            return json.loads(json_str)
-        except Exception:
-            return {col: "Parse error" for col in row_dict.keys()}
-    return {col: "No response" for col in row_dict.keys()}
+            row_id = int(item.get("id"))
+            result = agent_answer(validate_result(item))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if 0 <= row_id < count and results[row_id] is None:
+            results[row_id] = result
+    return results
+
+
+def call_agent_batch(row_dicts, context=None):
+    """
+    Verify several rows in a single agent run.
+
+    Args:
+        row_dicts: List of dictionaries, each representing a row
+        context: Optional function returning a provider summary to prefix to the prompt
+
+    Returns:
+        List of results in input order; None marks rows the agent skipped or
+        answered with malformed JSON
+
+    Raises:
+        RunDeadlineExceeded when the row deadline passes, since retrying the
+        rows in smaller batches cannot succeed either
+    """
+    try:
+        content = with_context(format_batch(row_dicts), context() if context else None)
+        run, message_formatted = call_with_retries(_ask_agent, content, BATCH_REPLY)
+    except RunFailedError as e:
+        print(f"Batch of {len(row_dicts)} rows failed: {e}")
+        return [None] * len(row_dicts)
+    if not message_formatted:
+        return [None] * len(row_dicts)
+    with metrics.span("parse"):
+        return parse_batch_reply(message_formatted, len(row_dicts))
+
+
+def verify_rows_batched(row_dicts, use_cache=True, context=None):
+    """
+    Verify rows with one agent run per batch, retrying only the rows that failed.
+
+    Cached and catalogued rows are answered locally. Rows missing or malformed in a batched
+    reply are split in half and retried, down to the one-row-per-run path. Once the row
+    deadline has passed no further runs are started and the rows still unanswered are
+    marked as timed out. ``context`` is passed on to every agent call (see call_agent).
+
+    Returns:
+        List of results in the same order as input rows
+    """
+    if len(row_dicts) == 1:
+        return [call_agent(row_dicts[0], use_cache=use_cache, context=context)]
+    cache = get_result_cache() if use_cache else None
+    results = [None] * len(row_dicts)
+    if use_cache:
+        for i, row_dict in enumerate(row_dicts):
+            results[i] = lookup_local(row_dict, cache)
+    todo = [i for i, result in enumerate(results) if result is None]
+    if not todo:
+        return results
+
+    deadline_passed = False
+    try:
+        answers = call_agent_batch([row_dicts[i] for i in todo], context) if len(todo) > 1 else [None]
+    except RunDeadlineExceeded:
+        answers = [None] * len(todo)
+        deadline_passed = True
+    missing = []
+    for i, answer in zip(todo, answers):
+        if answer is None:
+            missing.append(i)
+            continue
+        results[i] = answer
+        if cache is not None:
+            cache.put(row_dicts[i], answer)
+
+    if missing and (deadline_passed or current_control().expired()):
+        print(f"Row deadline passed with {len(missing)} of {len(todo)} batched rows unanswered")
+        for i in missing:
+            results[i] = timed_out_result(row_dicts[i])
+    elif len(missing) == 1:
+        results[missing[0]] = call_agent(row_dicts[missing[0]], use_cache=False, context=context)
+        if cache is not None:
+            cache.put(row_dicts[missing[0]], results[missing[0]])
+    elif missing:
+        print(f"Batch reply missing {len(missing)} of {len(todo)} rows; retrying them in smaller batches")
+        half = (len(missing) + 1) // 2
+        for part in (missing[:half], missing[half:]):
+            if current_control().expired():
+                # The first half used up the deadline; don't start runs that are cancelled at once
+                retried = [timed_out_result(row_dicts[i]) for i in part]
+            else:
+                retried = verify_rows_batched([row_dicts[i] for i in part], use_cache=False, context=context)
+            for i, result in zip(part, retried):
+                results[i] = result
+                if cache is not None:
+                    cache.put(row_dicts[i], result)
+    return results
 
 
-def process_rows_with_progress(row_dicts, max_workers=5, progress_callback=None):
+def group_duplicate_rows(row_dicts):
+    """
+    Group row indices whose contents are identical after normalization.
+
+    Returns:
+        Dict mapping a row key to the list of indices sharing it, in first-seen order
+    """
+    groups = {}
+    for idx, row_dict in enumerate(row_dicts):
+        groups.setdefault(row_key(row_dict), []).append(idx)
+    return groups
+
+
+def plan_units(row_dicts, groups, batch_size, schedule=None, min_group_rows=None):
+    """
+    Split duplicate-row groups into units of work (lists of groups verified in one run).
+
+    In "sheet" order units follow the sheet. In "affinity" order each
+    provider's groups are batched together and providers are interleaved,
+    largest first; providers with at least ``min_group_rows`` distinct rows,
+    spread over more than one unit, share one provider summary.
+
+    Returns:
+        List of (unit, provider_key, context_key) tuples; provider_key is that
+        of the unit's first row and context_key the provider whose summary the
+        unit's prompts carry, or None
+    """
+    schedule = (schedule or config.SCHEDULING_MODE).lower()
+    min_group_rows = config.PROVIDER_MIN_GROUP_ROWS if min_group_rows is None else min_group_rows
+    keys = [provider_key(row_dicts[indices[0]]) for indices in groups]
+    if schedule != "affinity":
+        return [(groups[i:i + batch_size], keys[i], None) for i in range(0, len(groups), batch_size)]
+    by_provider = {}
+    for key, indices in zip(keys, groups):
+        by_provider.setdefault(key, []).append(indices)
+    buckets = []
+    for key, provider_groups in by_provider.items():
+        units = [provider_groups[i:i + batch_size] for i in range(0, len(provider_groups), batch_size)]
+        # A provider answered in a single run gains nothing from a separate summary run
+        shared = key and len(units) > 1 and len(provider_groups) >= min_group_rows
+        buckets.append([(unit, key, key if shared else None) for unit in units])
+    buckets.sort(key=len, reverse=True)
+    return interleave(buckets)
+
+
+def _latency_percentile(latencies, pct):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+def process_rows_with_progress(row_dicts, max_workers=None, progress_callback=None, stats=None,
+                               limiter=None, batch_size=None, result_callback=None, run_id=None,
+                               hedge=None, token_budget=None, schedule=None, cancel_event=None):
     """
     Process rows in parallel with progress tracking.
+
+    Rows that are identical after whitespace/case normalization are sent to the
+    agent once and the result is fanned out to every matching row. Concurrency
+    adapts between 1 and max_workers: it grows while the agent service is
+    healthy and backs off on throttling, and throttled rows are re-queued
+    instead of being recorded as errors. With batch_size > 1, up to that many
+    distinct rows are verified per agent run.
+
+    Every row runs under a deadline (config.ROW_DEADLINE_SECONDS) with
+    transient failures retried with jittered backoff. With hedging enabled, a
+    row still running past the observed latency percentile gets a duplicate
+    run; the first to finish wins and the other is cancelled. Results carry
+    "_retries" and "_hedged" entries.
+
+    Token usage reported by each run is added up per unit of work and shared
+    out over its rows as "_prompt_tokens", "_completion_tokens" and "_cost"
+    entries. Once a token budget is spent, the rows not yet started are
+    recorded as errors (config.TOKEN_BUDGET_ACTION "stop", so a resumed run
+    retries them) or the batch continues one run at a time ("slow").
+
+    With affinity scheduling, rows are grouped by provider (certifier and URL
+    host) and each provider's certificate listing is summarized by one
+    web-grounded run and shared with the rest of its rows (see
+    provider_context.py). Rows, runs, latency and web-grounding calls are
+    reported per provider group in either mode.
+
+    Agent threads come from a pool for the batch: they are created ahead of
+    demand, reused for up to config.THREAD_MAX_RUNS runs and deleted in the
+    background once retired or when the batch ends. Requests go through the
+    process's shared connection pool, grown to fit max_workers calls, and its
+    token cache (http_transport.py, token_cache.py).
     
     Args:
         row_dicts: List of dictionaries, each representing a row
-        max_workers: Maximum number of concurrent threads
+        max_workers: Maximum number of concurrent threads (defaults to config.MAX_WORKERS)
         progress_callback: Function to call with progress updates (completed_count, total_count)
+        stats: Optional dict filled in with batch statistics (agent calls saved, throttling, retries,
+            hedges, agent thread lifecycle, malformed replies and repairs, token usage and cost,
+            web-grounding calls and per-provider groups, HTTP connection reuse and sign-ins)
+        limiter: Optional AdaptiveConcurrencyLimiter shared across batches
+        batch_size: Rows per agent run (defaults to config.BATCH_SIZE; 1 means one row per run)
+        result_callback: Function called with (index, result) as soon as each row completes
+        run_id: Identifier attached to timing spans (defaults to a random ID)
+        hedge: Launch duplicate runs for stragglers (defaults to config.HEDGE_ENABLED)
+        token_budget: Total tokens the batch may use (defaults to config.TOKEN_BUDGET; 0 means no limit)
+        schedule: "sheet" or "affinity" row order (defaults to config.SCHEDULING_MODE)
+        cancel_event: Optional threading.Event; once set, the runs in flight are cancelled and
+            RunCancelled is raised
     
     Returns:
         List of results in the same order as input rows
+
+    Raises:
+        RunCancelled when cancel_event is set; runs in flight are also cancelled when
+        result_callback or progress_callback raises
     """
+    max_workers = max_workers or config.MAX_WORKERS
+    batch_size = max(1, batch_size or config.BATCH_SIZE)
+    run_id = run_id or uuid.uuid4().hex[:12]
+    hedge = config.HEDGE_ENABLED if hedge is None else hedge
+    token_budget = config.TOKEN_BUDGET if token_budget is None else token_budget
+    schedule = (schedule or config.SCHEDULING_MODE).lower()
+    limiter = limiter or AdaptiveConcurrencyLimiter(max_limit=max_workers)
     results = [None] * len(row_dicts)
     completed = 0
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_index = {
-            executor.submit(call_agent, row_dict): idx 
-            for idx, row_dict in enumerate(row_dicts)
-        }
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_index):
-            idx = future_to_index[future]
-            try:
-                results[idx] = future.result()
-            except Exception as e:
-                print(f"Error processing row {idx}: {e}")
-                row_dict = row_dicts[idx]
-                results[idx] = {col: f"Error: {str(e)}" for col in row_dict.keys()}
-            
+    groups = list(group_duplicate_rows(row_dicts).values())
+    saved = len(row_dicts) - len(groups)
+    if saved:
+        print(f"Deduplicated {len(row_dicts)} rows into {len(groups)} agent calls ({saved} saved)")
+
+    # Each unit of work is a list of duplicate-row groups verified together
+    planned = plan_units(row_dicts, groups, batch_size, schedule)
+    units = [unit for unit, _, _ in planned]
+    unit_providers = [key for _, key, _ in planned]
+    unit_contexts = [context_key for _, _, context_key in planned]
+    group_stats = GroupStats()
+    contexts_before = _provider_contexts.stats()
+    # One pooled connection per concurrent call, so workers never wait on a connect or TLS handshake
+    connections_before = connection_stats(max_workers)
+    unit_state = [{"done": False, "running": 0, "controls": [], "hedged": False} for _ in units]
+    pending = deque(range(len(units)))
+    requeues = {}
+    requeued_total = 0
+    hedges_launched = 0
+    hedges_won = 0
+    max_hedges = int(len(units) * config.HEDGE_MAX_FRACTION)
+    latencies = deque(maxlen=500)
+    tokens_used = 0
+    budget_reached = False
+    in_flight = {}
+    thread_pool = AgentThreadPool(get_project_client,
+                                  prefetch=min(config.THREAD_PREFETCH, max_workers, len(units)))
+    replies_before = reply_stats.snapshot()
+
+    def launch(executor, unit_id, hedged=False):
+        unit = units[unit_id]
+        unit_rows = [row_dicts[indices[0]] for indices in unit]
+        control = RunControl()
+        state = unit_state[unit_id]
+        state["controls"].append(control)
+        state["running"] += 1
+        if unit_contexts[unit_id] is not None:
+            def unit_context(key=unit_contexts[unit_id], row_dict=unit_rows[0]):
+                return _provider_contexts.get(key, lambda: provider_summary(row_dict))
+            context = unit_context
+        else:
+            context = None
+        if len(unit_rows) == 1:
+            task = lambda rows: [call_agent(rows[0], context=context)]
+        else:
+            task = lambda rows: verify_rows_batched(rows, context=context)
+        task = metrics.bound(thread_pool.bind(control.bind(task)), row=unit[0][0], run_id=run_id)
+        in_flight[executor.submit(task, unit_rows)] = (unit_id, time.monotonic(), hedged, control)
+
+    def hedge_threshold():
+        if not hedge or len(latencies) < config.HEDGE_MIN_SAMPLES:
+            return None
+        return _latency_percentile(latencies, config.HEDGE_PERCENTILE)
+
+    def finish(indices, result=None, error=None, meta=None):
+        nonlocal completed
+        for idx in indices:
+            if error is None:
+                results[idx] = dict(result)
+                results[idx].update(meta or {})
+            else:
+                results[idx] = {col: f"Error: {str(error)}" for col in row_dicts[idx].keys()}
             completed += 1
+            if result_callback:
+                result_callback(idx, results[idx])
             if progress_callback:
                 progress_callback(completed, len(row_dicts))
-    
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                while pending or in_flight:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise RunCancelled("Batch cancelled")
+                    # Start as many units as the limiter currently allows
+                    while pending and limiter.try_acquire():
+                        launch(executor, pending.popleft())
+                    # Threads are only created ahead for units that have yet to start
+                    thread_pool.set_waiting(len(pending))
+
+                    # Hedge stragglers running longer than the observed latency percentile
+                    threshold = hedge_threshold()
+                    if threshold is not None and hedges_launched < max_hedges:
+                        now = time.monotonic()
+                        for unit_id, started, is_hedge, _ in list(in_flight.values()):
+                            state = unit_state[unit_id]
+                            if state["hedged"] or state["done"] or now - started < threshold:
+                                continue
+                            if hedges_launched >= max_hedges or not limiter.try_acquire():
+                                break
+                            state["hedged"] = True
+                            hedges_launched += 1
+                            launch(executor, unit_id, hedged=True)
+
+                    if not in_flight:
+                        time.sleep(min(max(limiter.wait_time(), 0.05), 1.0))
+                        continue
+
+                    timeout = min(max(limiter.wait_time(), 0.05), 1.0) if pending or threshold is not None else None
+                    if cancel_event is not None:
+                        timeout = min(timeout or 1.0, 1.0)
+                    done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                    # Collect results as they complete and fan them out to duplicate rows
+                    for future in done:
+                        unit_id, started, is_hedge, control = in_flight.pop(future)
+                        run_tokens = control.prompt_tokens + control.completion_tokens
+                        if run_tokens:
+                            # Replace the limiter's per-request estimate with the reported usage
+                            tokens_used += run_tokens
+                            limiter.record_tokens(run_tokens)
+                        state = unit_state[unit_id]
+                        state["running"] -= 1
+                        unit = units[unit_id]
+                        unit_key = unit[0][0]
+                        if state["done"]:
+                            # Losing attempt of a hedged unit; its run was cancelled
+                            limiter.release_error()
+                            continue
+                        try:
+                            unit_results = future.result()
+                        except Exception as e:
+                            retry_after = throttle_retry_after(e)
+                            if state["running"]:
+                                # Another attempt for this unit is still running and may succeed
+                                if retry_after is not None:
+                                    limiter.release_throttled(retry_after)
+                                else:
+                                    limiter.release_error()
+                                continue
+                            attempts = requeues.get(unit_key, 0)
+                            if retry_after is not None and attempts < config.THROTTLE_MAX_REQUEUES:
+                                limiter.release_throttled(retry_after)
+                                requeues[unit_key] = attempts + 1
+                                requeued_total += 1
+                                pending.append(unit_id)
+                                continue
+                            if retry_after is not None:
+                                limiter.release_throttled(retry_after)
+                            else:
+                                limiter.release_error()
+                            print(f"Error processing row {unit_key}: {e}")
+                            state["done"] = True
+                            for indices in unit:
+                                finish(indices, error=e)
+                            continue
+                        limiter.release_success()
+                        latencies.append(time.monotonic() - started)
+                        row_count = sum(len(indices) for indices in unit)
+                        group_stats.record(unit_providers[unit_id], row_count, started, time.monotonic(),
+                                           sum(c.grounding_calls for c in state["controls"]))
+                        state["done"] = True
+                        for control in state["controls"]:
+                            control.cancel()
+                        if is_hedge:
+                            hedges_won += 1
+                        # Every attempt's tokens, losing hedges included, shared over the unit's rows
+                        prompt_tokens = sum(c.prompt_tokens for c in state["controls"]) / row_count
+                        completion_tokens = sum(c.completion_tokens for c in state["controls"]) / row_count
+                        meta = {
+                            "_retries": sum(control.retries for control in state["controls"]),
+                            "_hedged": state["hedged"],
+                            "_prompt_tokens": round(prompt_tokens, 1),
+                            "_completion_tokens": round(completion_tokens, 1),
+                            "_cost": token_cost(prompt_tokens, completion_tokens),
+                        }
+                        for indices, result in zip(unit, unit_results):
+                            finish(indices, result=result, meta=meta)
+
+                    if token_budget and not budget_reached and tokens_used >= token_budget:
+                        budget_reached = True
+                        if config.TOKEN_BUDGET_ACTION == "slow":
+                            print(f"Token budget of {token_budget} reached; continuing one run at a time")
+                            limiter.cap(1)
+                        else:
+                            print(f"Token budget of {token_budget} reached; skipping {len(pending)} pending units")
+                            while pending:
+                                unit_id = pending.popleft()
+                                unit_state[unit_id]["done"] = True
+                                for indices in units[unit_id]:
+                                    finish(indices, error=f"Token budget of {token_budget} tokens reached")
+            except BaseException:
+                # Stop the runs still in flight instead of waiting for them on executor shutdown
+                for state in unit_state:
+                    for control in state["controls"]:
+                        control.cancel()
+                raise
+    finally:
+        thread_pool.close()
+    thread_stats = thread_pool.stats()
+    if thread_stats["threads_created"]:
+        print(f"Agent threads: {thread_stats['threads_created']} created, "
+              f"{thread_stats['threads_reused']} reuses, {thread_stats['threads_deleted']} deleted, "
+              f"{thread_stats['thread_seconds_saved']}s creation time saved")
+    prompt_tokens = sum(c.prompt_tokens for state in unit_state for c in state["controls"])
+    completion_tokens = sum(c.completion_tokens for state in unit_state for c in state["controls"])
+    if prompt_tokens or completion_tokens:
+        print(f"Tokens: {prompt_tokens} prompt, {completion_tokens} completion "
+              f"(estimated cost {token_cost(prompt_tokens, completion_tokens)})")
+    grounding_calls = sum(c.grounding_calls for state in unit_state for c in state["controls"])
+    provider_groups = group_stats.summary()
+    contexts_after = _provider_contexts.stats()
+    context_stats = {k: round(contexts_after[k] - contexts_before[k], 3) for k in contexts_after}
+    if grounding_calls or schedule == "affinity":
+        print(f"Web-grounding calls: {grounding_calls} for {len(groups)} agent rows in "
+              f"{len(provider_groups)} provider groups ({schedule} scheduling, "
+              f"{context_stats['provider_contexts_built']} provider summaries built)")
+    connections_after = connection_stats()
+    connection_summary = {k: v if k == "http_pool_size" else round(v - connections_before[k], 3)
+                          for k, v in connections_after.items()}
+    if connection_summary.get("http_requests"):
+        print(f"HTTP: {connection_summary['http_requests']} requests over "
+              f"{connection_summary['http_connections_opened']} new connections (pool of "
+              f"{connection_summary['http_pool_size']}), {connection_summary['token_fetches']} sign-ins "
+              f"taking {connection_summary['token_fetch_seconds']}s")
+    replies_after = reply_stats.snapshot()
+    reply_summary = ReplyStats.summary({k: replies_after[k] - replies_before[k] for k in replies_after})
+    if reply_summary["parse_failures"]:
+        print(f"Malformed replies: {reply_summary['parse_failures']} of {reply_summary['replies']} "
+              f"({reply_summary['parse_failure_rate']:.1%}), {reply_summary['repaired']} of "
+              f"{reply_summary['repairs']} repair runs succeeded")
+
+    if stats is not None:
+        stats.update(rows=len(row_dicts), agent_calls=len(groups), agent_calls_saved=saved,
+                     batch_size=batch_size, agent_runs_planned=len(units),
+                     throttled_requeues=requeued_total,
+                     retries=sum(c.retries for state in unit_state for c in state["controls"]),
+                     hedges_launched=hedges_launched, hedges_won=hedges_won,
+                     prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                     total_tokens=prompt_tokens + completion_tokens,
+                     cost=token_cost(prompt_tokens, completion_tokens), token_budget_reached=budget_reached,
+                     schedule=schedule, grounding_calls=grounding_calls,
+                     provider_groups=len(provider_groups), provider_group_stats=provider_groups,
+                     **context_stats, **connection_summary, **thread_stats, **reply_summary,
+                     **limiter.stats())
     return results
+
+
+_RESULTS_DONE = object()
+
+
+def iter_results(process, row_dicts, *args, **kwargs):
+    """
+    Run a row processor in a background thread and yield results as rows complete.
+
+    Args:
+        process: process_rows_with_progress, or any function taking row_dicts
+            and a result_callback(index, result) keyword (process_rows_resumable,
+            process_rows_async_sync)
+        row_dicts: List of dictionaries, each representing a row
+        *args, **kwargs: Passed through to ``process``
+
+    Yields:
+        Tuples of (row_index, result) in completion order; exceptions raised by
+        ``process`` are re-raised once the rows completed before them are yielded
+    """
+    completed = queue.Queue()
+
+    def run():
+        try:
+            process(row_dicts, *args, result_callback=lambda i, result: completed.put((i, result)), **kwargs)
+        except BaseException as e:
+            completed.put((_RESULTS_DONE, e))
+        else:
+            completed.put((_RESULTS_DONE, None))
+
+    threading.Thread(target=run, name="row-results", daemon=True).start()
+    while True:
+        i, result = completed.get()
+        if i is _RESULTS_DONE:
+            if result is not None:
+                raise result
+            return
+        yield i, result
+
+
+def iter_rows_with_progress(row_dicts, **kwargs):
+    """Generator form of process_rows_with_progress yielding (row_index, result) as each row completes."""
+    return iter_results(process_rows_with_progress, row_dicts, **kwargs)
+
+
+class BackgroundRun:
+    """
+    A row processor running in a background thread, independent of its caller.
+
+    Interactive front ends start one per run and poll it, so the caller (e.g.
+    a Streamlit script that is re-executed on every widget change) can come
+    and go while the rows keep being processed.
+    """
+
+    def __init__(self, process, row_dicts, row_numbers, *args, **kwargs):
+        """
+        Start processing.
+
+        Args:
+            process: Row processor accepting a result_callback(index, result) keyword
+            row_dicts: List of dictionaries, each representing a row
+            row_numbers: Sheet row number of each row dict, used to key the results
+            *args, **kwargs: Passed through to ``process``; a ``stats`` dict is
+                filled in when the run finishes
+        """
+        self.row_numbers = list(row_numbers)
+        self.total = len(row_dicts)
+        self.stats = kwargs.setdefault("stats", {})
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._results = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, args=(process, row_dicts, args, kwargs),
+                                        name="background-run", daemon=True)
+        self._thread.start()
+
+    def _run(self, process, row_dicts, args, kwargs):
+        def collect(i, result):
+            with self._lock:
+                self._results[self.row_numbers[i]] = result
+        try:
+            process(row_dicts, *args, result_callback=collect, **kwargs)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.time()
+
+    @property
+    def done(self):
+        return not self._thread.is_alive()
+
+    @property
+    def completed(self):
+        with self._lock:
+            return len(self._results)
+
+    def results(self):
+        """Snapshot of {row_number: result} for the rows completed so far, in completion order."""
+        with self._lock:
+            return dict(self._results)
+
+    def wait(self, timeout=None):
+        """Block until the run finishes (or ``timeout`` seconds pass); True if it finished."""
+        self._thread.join(timeout)
+        return self.done
@@ -0,0 +1,394 @@
+"""
+Asyncio execution engine for agent calls.
+
+Runs many rows on a single event loop with the async Azure AI Projects client,
+bounded by a semaphore, instead of blocking one OS thread per in-flight row.
+``process_rows_async_sync`` wraps it for synchronous callers such as the
+Streamlit UI. Each row runs on its own agent thread, deleted in the background
+once the row is done.
+"""
+
+import asyncio
+import os
+
+import config
+from agent_api import (
+    AGENT_NAME,
+    agent_definition_key,
+    format_row,
+    get_agent_registry,
+    get_result_cache,
+    group_duplicate_rows,
+    load_instructions,
+    lookup_local,
+    message_text,
+    parse_agent_reply,
+    read_run_event,
+    run_usage,
+    token_cost,
+)
+from agent_registry import METADATA_KEY, instructions_hash, matches_definition
+from rate_limiter import run_throttle_error, throttle_retry_after
+from response_schema import ROW_REPLY, ReplyStats, repair_prompt, reply_stats
+
+
+def create_async_client(max_concurrency=None):
+    """
+    Build an async project client for the configured AGENT_BACKEND, and its credential.
+
+    Call it with the event loop running: its connection pool is sized to
+    ``max_concurrency`` requests and belongs to that loop.
+
+    Returns:
+        Tuple of (client, credential); credential is None for the fake backend
+    """
+    if config.AGENT_BACKEND == "fake":
+        from fake_backend import FakeAsyncProjectClient
+        print("Using fake agent backend")
+        return FakeAsyncProjectClient.from_config(), None
+
+    from azure.ai.projects.aio import AIProjectClient
+    from http_transport import get_async_transport
+    from token_cache import AsyncCachedCredential
+
+    if config.AGENT_BACKEND == "http":
+        # The real async SDK against the local HTTP stand-in; see agent_stand_in.py
+        from agent_stand_in import AsyncStandInCredential, local_authentication_policy_async
+        print(f"Using HTTP stand-in agent backend at {config.PROJECT_ENDPOINT}")
+        credential = AsyncCachedCredential(AsyncStandInCredential(config.PROJECT_ENDPOINT),
+                                           f"stand-in|{config.PROJECT_ENDPOINT}")
+        client = AIProjectClient(endpoint=config.PROJECT_ENDPOINT, credential=credential,
+                                 transport=get_async_transport(max_concurrency),
+                                 authentication_policy=local_authentication_policy_async(credential))
+        return client, credential
+
+    from azure.identity.aio import ClientSecretCredential
+
+    credential = AsyncCachedCredential(
+        ClientSecretCredential(
+            tenant_id=os.getenv('AZURE_TENANT_ID'),
+            client_id=os.getenv('AZURE_CLIENT_ID'),
+            client_secret=os.getenv('AZURE_CLIENT_SECRET'),
+        ),
+        f"{os.getenv('AZURE_TENANT_ID')}|{os.getenv('AZURE_CLIENT_ID')}",
+    )
+    client = AIProjectClient(endpoint=config.PROJECT_ENDPOINT, credential=credential,
+                             transport=get_async_transport(max_concurrency))
+    return client, credential
+
+
+async def create_agent_async(client, instructions=None):
+    """Create the certificate mapper agent on an async client."""
+    from azure.ai.agents.models import BingGroundingTool
+
+    instructions = instructions or load_instructions()
+    bing = BingGroundingTool(connection_id=config.BING_CONNECTION_NAME)
+    agent = await client.agents.create_agent(
+        model=config.MODEL_DEPLOYMENT,
+        name=AGENT_NAME,
+        instructions=instructions,
+        tools=bing.definitions,
+        metadata={METADATA_KEY: instructions_hash(instructions)},
+    )
+    print(f"Created new agent with ID: {agent.id}")
+    return agent
+
+
+async def _registered_agent_async(client, key):
+    """The agent registered for ``key`` if it still exists on the service, else None."""
+    agent_id = get_agent_registry().lookup(key)
+    if not agent_id:
+        return None
+    try:
+        agent = await client.agents.get_agent(agent_id)
+    except Exception as e:
+        print(f"Registered agent {agent_id} is unavailable ({e}); resolving again")
+        return None
+    print(f"Reusing agent with ID: {agent.id}")
+    return agent
+
+
+async def resolve_agent_async(client):
+    """
+    Reuse the registered or a matching existing agent on an async client, creating one only if needed.
+
+    The registry file is replaced atomically, so lookups read it without the
+    lock. The lock is only held to register an agent, and to create one after
+    checking that no other process did so meanwhile; it is waited for on a
+    worker thread, so the event loop keeps running.
+    """
+    instructions = load_instructions()
+    key = agent_definition_key(instructions)
+    registry = get_agent_registry()
+    registered_id = registry.lookup(key)
+    agent = await _registered_agent_async(client, key)
+    if agent is not None:
+        return agent
+    async for candidate in client.agents.list_agents():
+        if matches_definition(candidate, AGENT_NAME, config.MODEL_DEPLOYMENT, instructions):
+            print(f"Reusing agent with ID: {candidate.id}")
+            agent = candidate
+            break
+    async with registry.locked_async():
+        if agent is None and registry.lookup(key) != registered_id:
+            # Another process registered an agent while the agents were listed
+            agent = await _registered_agent_async(client, key)
+        if agent is None:
+            agent = await create_agent_async(client, instructions)
+        registry.save(key, agent.id)
+    return agent
+
+
+async def complete_run_async(client, thread_id, agent_id, **run_options):
+    """
+    Run the agent on a thread per RUN_COMPLETION_MODE.
+
+    Returns:
+        Tuple of (run, reply_text); reply_text is None when the reply still has
+        to be fetched with messages.list
+    """
+    if config.RUN_COMPLETION_MODE == "stream" and hasattr(client.agents.runs, "stream"):
+        run = None
+        reply = None
+        async with await client.agents.runs.stream(thread_id=thread_id, agent_id=agent_id,
+                                                   **run_options) as stream:
+            async for event_type, data, _ in stream:
+                event_run, event_reply = read_run_event(event_type, data)
+                run = event_run or run
+                reply = reply if event_reply is None else event_reply
+        if run is not None:
+            return run, reply
+    run = await client.agents.runs.create_and_process(
+        thread_id=thread_id,
+        agent_id=agent_id,
+        polling_interval=config.RUN_POLL_INTERVAL_SECONDS,
+        **run_options,
+    )
+    return run, None
+
+
+async def fetch_reply_async(client, thread_id, run):
+    """Text of the assistant message a completed run produced, or None."""
+    async for message in client.agents.messages.list(thread_id=thread_id, run_id=run.id):
+        # Messages are listed newest first
+        if message.role == "assistant":
+            return message_text(message)
+    return None
+
+
+def add_usage(usage, run):
+    """Add a run's reported token usage to a {"prompt_tokens", "completion_tokens"} dict (if given)."""
+    if usage is not None:
+        prompt_tokens, completion_tokens = run_usage(run)
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+
+
+async def repair_reply_async(client, thread_id, agent_id, reply, run_options, usage=None):
+    """Async counterpart of agent_api._repair_reply for single-row replies."""
+    reply_stats.record("replies")
+    _, error = ROW_REPLY.parse(reply)
+    if error is None:
+        return reply
+    reply_stats.record("parse_failures")
+    repair_options = dict(run_options, tool_choice="none")
+    for _ in range(config.REPLY_REPAIR_ATTEMPTS):
+        reply_stats.record("repairs")
+        await client.agents.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=repair_prompt(error, ROW_REPLY),
+        )
+        run, repaired = await complete_run_async(client, thread_id, agent_id, **repair_options)
+        add_usage(usage, run)
+        if run.status != "completed":
+            print(f"Reply repair run {run.status}: {getattr(run, 'last_error', None)}")
+            return reply
+        if repaired is None:
+            repaired = await fetch_reply_async(client, thread_id, run)
+        _, error = ROW_REPLY.parse(repaired)
+        if error is None:
+            reply_stats.record("repaired")
+            return repaired
+    return reply
+
+
+async def delete_thread_async(client, thread_id):
+    """Delete an agent thread, logging rather than raising on failure."""
+    try:
+        await client.agents.threads.delete(thread_id)
+    except Exception as e:
+        print(f"Could not delete agent thread {thread_id}: {e}")
+
+
+async def call_agent_async(row_dict, client, agent_id, use_cache=True, usage=None, deletions=None):
+    """
+    Verify one row on an async client, answering from the result cache or catalog when possible.
+
+    Token usage of the runs made for the row is added to ``usage`` (see add_usage).
+    The row's agent thread is deleted once the row is done: as a task appended
+    to ``deletions`` when a list is given (the caller awaits them), else inline.
+    """
+    cache = get_result_cache() if use_cache else None
+    if use_cache:
+        local = lookup_local(row_dict, cache)
+        if local is not None:
+            return local
+
+    thread = await client.agents.threads.create()
+    try:
+        await client.agents.messages.create(
+            thread_id=thread.id,
+            role="user",
+            content=format_row(row_dict),
+        )
+        run_options = {"response_format": ROW_REPLY.response_format()} if config.STRUCTURED_OUTPUT else {}
+        run, message_formatted = await complete_run_async(client, thread.id, agent_id, **run_options)
+        add_usage(usage, run)
+        if run.status == "failed":
+            throttled = run_throttle_error(run)
+            if throttled is not None:
+                raise throttled
+            return {col: "Run failed" for col in row_dict.keys()}
+
+        if message_formatted is None:
+            message_formatted = await fetch_reply_async(client, thread.id, run)
+            if message_formatted is None:
+                return {col: "No response" for col in row_dict.keys()}
+        message_formatted = await repair_reply_async(client, thread.id, agent_id, message_formatted,
+                                                     run_options, usage)
+    finally:
+        if deletions is not None:
+            # Off the row's critical path, so its concurrency slot frees up now
+            deletions.append(asyncio.ensure_future(delete_thread_async(client, thread.id)))
+        else:
+            await delete_thread_async(client, thread.id)
+    result = parse_agent_reply(message_formatted, row_dict)
+    if cache is not None:
+        cache.put(row_dict, result)
+    return result
+
+
+async def _call_with_throttle_retry(row_dict, client, agent_id, use_cache, usage=None, deletions=None):
+    """Call the agent, sleeping and retrying when the service throttles the row."""
+    for attempt in range(config.THROTTLE_MAX_REQUEUES + 1):
+        try:
+            return await call_agent_async(row_dict, client, agent_id, use_cache=use_cache, usage=usage,
+                                          deletions=deletions)
+        except Exception as e:
+            retry_after = throttle_retry_after(e)
+            if retry_after is None or attempt == config.THROTTLE_MAX_REQUEUES:
+                raise
+            await asyncio.sleep(retry_after or config.THROTTLE_DEFAULT_BACKOFF_SECONDS)
+
+
+async def process_rows_async(row_dicts, max_concurrency=None, progress_callback=None, stats=None,
+                             client=None, agent_id=None, use_cache=True, result_callback=None,
+                             token_budget=None):
+    """
+    Process rows concurrently on the current event loop.
+
+    As in agent_api.process_rows_with_progress, results carry their share of
+    the reported token usage ("_prompt_tokens", "_completion_tokens",
+    "_cost"), and once the token budget is spent the remaining rows are
+    skipped or run one at a time per config.TOKEN_BUDGET_ACTION.
+
+    Args:
+        row_dicts: List of dictionaries, each representing a row
+        max_concurrency: Maximum number of rows in flight (defaults to config.ASYNC_MAX_CONCURRENCY)
+        progress_callback: Function to call with progress updates (completed_count, total_count)
+        stats: Optional dict filled in with batch statistics (rows, agent_calls, agent_calls_saved,
+            malformed replies and repairs, token usage and cost)
+        client: Optional async project client; one is created (and closed) when omitted
+        agent_id: Optional existing agent ID; the registered agent is reused (or one created) when omitted
+        use_cache: Whether to consult the persistent result cache
+        result_callback: Function called with (index, result) as soon as each row completes
+        token_budget: Total tokens the batch may use (defaults to config.TOKEN_BUDGET; 0 means no limit)
+
+    Returns:
+        List of results in the same order as input rows
+    """
+    max_concurrency = max_concurrency or config.ASYNC_MAX_CONCURRENCY
+    token_budget = config.TOKEN_BUDGET if token_budget is None else token_budget
+    credential = None
+    owns_client = client is None
+    if owns_client:
+        client, credential = create_async_client(max_concurrency)
+
+    results = [None] * len(row_dicts)
+    completed = 0
+    groups = group_duplicate_rows(row_dicts)
+    replies_before = reply_stats.snapshot()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # Rows started once the budget is spent share this lock under TOKEN_BUDGET_ACTION=slow
+    over_budget = asyncio.Lock()
+    totals = {"prompt_tokens": 0, "completion_tokens": 0}
+
+    # Thread deletions still running; awaited before the client is closed
+    deletions = []
+
+    async def call(row_dict, usage):
+        return await _call_with_throttle_retry(row_dict, client, agent_id, use_cache, usage, deletions)
+
+    async def run_group(indices):
+        nonlocal completed
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        async with semaphore:
+            spent = token_budget and totals["prompt_tokens"] + totals["completion_tokens"] >= token_budget
+            try:
+                if spent and config.TOKEN_BUDGET_ACTION != "slow":
+                    result, error = None, f"Token budget of {token_budget} tokens reached"
+                elif spent:
+                    async with over_budget:
+                        result, error = await call(row_dicts[indices[0]], usage), None
+                else:
+                    result, error = await call(row_dicts[indices[0]], usage), None
+            except Exception as e:
+                print(f"Error processing row {indices[0]}: {e}")
+                result, error = None, e
+        for key in totals:
+            totals[key] += usage[key]
+        meta = {
+            "_prompt_tokens": round(usage["prompt_tokens"] / len(indices), 1),
+            "_completion_tokens": round(usage["completion_tokens"] / len(indices), 1),
+            "_cost": token_cost(usage["prompt_tokens"] / len(indices), usage["completion_tokens"] / len(indices)),
+        }
+        for idx in indices:
+            if error is None:
+                results[idx] = dict(result, **meta)
+            else:
+                results[idx] = {col: f"Error: {str(error)}" for col in row_dicts[idx].keys()}
+            completed += 1
+            if result_callback:
+                result_callback(idx, results[idx])
+            if progress_callback:
+                progress_callback(completed, len(row_dicts))
+
+    try:
+        if agent_id is None:
+            agent_id = (await resolve_agent_async(client)).id
+        await asyncio.gather(*(run_group(indices) for indices in groups.values()))
+    finally:
+        if deletions:
+            await asyncio.gather(*deletions)
+        if owns_client:
+            await client.close()
+        if credential is not None:
+            await credential.close()
+
+    if stats is not None:
+        replies_after = reply_stats.snapshot()
+        stats.update(rows=len(row_dicts), agent_calls=len(groups),
+                     agent_calls_saved=len(row_dicts) - len(groups),
+                     prompt_tokens=totals["prompt_tokens"], completion_tokens=totals["completion_tokens"],
+                     total_tokens=totals["prompt_tokens"] + totals["completion_tokens"],
+                     cost=token_cost(totals["prompt_tokens"], totals["completion_tokens"]),
+                     token_budget_reached=bool(token_budget) and (
+                         totals["prompt_tokens"] + totals["completion_tokens"] >= token_budget),
+                     **ReplyStats.summary({k: replies_after[k] - replies_before[k] for k in replies_after}))
+    return results
+
+
+def process_rows_async_sync(row_dicts, **kwargs):
+    """Synchronous wrapper around process_rows_async for callers without an event loop."""
+    return asyncio.run(process_rows_async(row_dicts, **kwargs))
@@ -0,0 +1,135 @@
+"""
+Local registry of agents created by the mapper.
+
+Creating an agent costs a service round trip on every cold start, and a new
+agent per process leaves a trail of orphans in the project. The registry maps
+an agent definition (endpoint, name, model and a hash of the instructions) to
+the ID of the agent created for it, persisted as a small JSON file so later
+processes can look the agent up instead of creating another one. A lock file
+serializes creation across the processes of a batch run.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+METADATA_KEY = "instructions_sha256"
+
+
+def instructions_hash(instructions):
+    """SHA-256 of the agent instructions, stored in the agent metadata."""
+    return hashlib.sha256(instructions.encode("utf-8")).hexdigest()
+
+
+def definition_key(endpoint, name, model, instructions):
+    """Registry key for one agent definition."""
+    return f"{endpoint or ''}|{name}|{model or ''}|{instructions_hash(instructions)}"
+
+
+def matches_definition(agent, name, model, instructions):
+    """True if a service-side agent was created from this name, model and instructions."""
+    if getattr(agent, "name", None) != name:
+        return False
+    if model and getattr(agent, "model", None) not in (None, model):
+        return False
+    expected = instructions_hash(instructions)
+    metadata = getattr(agent, "metadata", None) or {}
+    if metadata.get(METADATA_KEY) == expected:
+        return True
+    return instructions_hash(getattr(agent, "instructions", None) or "") == expected
+
+
+class AgentRegistry:
+    """JSON file of {definition key: agent ID} shared by every process on the machine."""
+
+    def __init__(self, path=None):
+        self.path = config.AGENT_REGISTRY_PATH if path is None else path
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def load(self):
+        """Return all entries; a missing or unreadable file counts as empty."""
+        if not self.enabled or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, key):
+        """Return the agent ID registered for ``key``, or None."""
+        entry = self.load().get(key)
+        return entry.get("agent_id") if isinstance(entry, dict) else None
+
+    def save(self, key, agent_id):
+        if not self.enabled:
+            return
+        entries = self.load()
+        entries[key] = {"agent_id": agent_id, "saved_at": time.time()}
+        self._write(entries)
+
+    def forget(self, key=None, agent_id=None):
+        """Drop the entry for ``key`` and/or every entry pointing at ``agent_id``."""
+        if not self.enabled:
+            return
+        entries = self.load()
+        kept = {k: v for k, v in entries.items()
+                if k != key and not (agent_id and isinstance(v, dict) and v.get("agent_id") == agent_id)}
+        if kept != entries:
+            self._write(kept)
+
+    def agent_ids(self):
+        """IDs of every registered agent."""
+        return {v.get("agent_id") for v in self.load().values() if isinstance(v, dict)}
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the registry lock, across processes where the platform supports it."""
+        with self._lock:
+            if not self.enabled or fcntl is None:
+                yield
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(f"{self.path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextlib.asynccontextmanager
+    async def locked_async(self):
+        """locked() for coroutines: the lock is waited for on a worker thread, so the event loop keeps running."""
+        lock = self.locked()
+        await asyncio.to_thread(lock.__enter__)
+        try:
+            yield
+        finally:
+            lock.__exit__(None, None, None)
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Local HTTP stand-in for the agent service endpoint.
+
+Serves the part of the Agents REST API the mapper uses (assistants, threads,
+messages, runs polled or streamed, run steps) over plain HTTP on localhost,
+answering from fake_backend's simulated service, plus a /token endpoint that
+issues bearer tokens after a configurable sign-in latency. Where
+AGENT_BACKEND=fake swaps the SDK client for an in-process fake, the stand-in
+keeps the real AIProjectClient, its HTTP pipeline, the pooled transport
+(http_transport.py) and the token cache (token_cache.py) in the loop: select
+it with AGENT_BACKEND=http and PROJECT_ENDPOINT pointing at the stand-in.
+
+The server counts the TCP connections it accepts, the requests it serves and
+the tokens it issues (GET /stats), so connection reuse and sign-ins can be
+checked from the service side.
+
+Examples:
+    python agent_stand_in.py --port 8765 --latency 0.2 --auth-latency 0.5
+    AGENT_BACKEND=http PROJECT_ENDPOINT=http://127.0.0.1:8765/api/projects/stand-in \\
+        python batch_cli.py run data.xlsx
+"""
+
+import argparse
+import json
+import re
+import secrets
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from fake_backend import FakeProjectClient, latency_model
+
+PROJECT_PATH = "/api/projects/stand-in"
+
+
+def _message_id(state, message):
+    # fake_backend messages carry no ID; give each one on first use
+    if getattr(message, "id", None) is None:
+        message.id = state.new_id("msg")
+    return message.id
+
+
+def _agent_json(agent):
+    return {"id": agent.id, "object": "assistant", "created_at": int(agent.created_at), "name": agent.name,
+            "model": agent.model, "instructions": agent.instructions, "metadata": agent.metadata, "tools": []}
+
+
+def _message_json(state, message, thread_id):
+    return {"id": _message_id(state, message), "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": thread_id, "role": message.role, "run_id": message.run_id, "status": "completed",
+            "content": [{"type": "text", "text": {"value": part.text.value, "annotations": []}}
+                        for part in message.content],
+            "attachments": [], "metadata": {}}
+
+
+def _run_json(run):
+    last_error = run.last_error and {"code": run.last_error.code, "message": run.last_error.message}
+    usage = run.usage and {"prompt_tokens": run.usage.prompt_tokens, "completion_tokens": run.usage.completion_tokens,
+                           "total_tokens": run.usage.total_tokens}
+    return {"id": run.id, "object": "thread.run", "created_at": int(time.time()), "thread_id": run.thread_id,
+            "assistant_id": run.agent_id, "status": run.status, "last_error": last_error, "usage": usage,
+            "model": "", "instructions": "", "tools": [], "metadata": {}}
+
+
+def _step_json(step):
+    return {"id": step.id, "object": "thread.run.step", "created_at": int(time.time()), "type": step.type,
+            "status": step.status, "run_id": step.run_id, "thread_id": step.thread_id,
+            "step_details": {"type": "tool_calls",
+                             "tool_calls": [{"id": call.id, "type": call.type, call.type: {}}
+                                            for call in step.step_details.tool_calls]}}
+
+
+def _list_json(items, query):
+    """One page of a list response; the SDK pages on with ``after`` until a page comes back empty."""
+    after = query.get("after")
+    if after:
+        ids = [item["id"] for item in items]
+        items = items[ids.index(after) + 1:] if after in ids else []
+    limit = int(query.get("limit") or 20)
+    page = items[:limit]
+    return {"object": "list", "data": page, "first_id": page[0]["id"] if page else None,
+            "last_id": page[-1]["id"] if page else None, "has_more": len(items) > limit}
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the simulated service state and the connection counters."""
+
+    daemon_threads = True
+
+    def __init__(self, address, client=None, token_lifetime=3600, auth_latency=0.0):
+        """
+        Args:
+            address: (host, port) to listen on; port 0 picks a free port
+            client: FakeProjectClient whose state and fault rates answer the requests
+            token_lifetime: Lifetime in seconds of the tokens issued by /token
+            auth_latency: Seconds /token takes to issue a token (sign-in latency)
+        """
+        super().__init__(address, _StandInHandler)
+        self.state = (client or FakeProjectClient(latency=0.0)).state
+        self.token_lifetime = token_lifetime
+        self.auth_latency = auth_latency
+        self.tokens = {}
+        self.connections = 0
+        self.requests = 0
+        self.tokens_issued = 0
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{PROJECT_PATH}"
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def issue_token(self):
+        time.sleep(self.auth_latency)
+        token = secrets.token_hex(16)
+        with self._lock:
+            self.tokens[token] = time.time() + self.token_lifetime
+            self.tokens_issued += 1
+        return token
+
+    def authorized(self, header):
+        token = (header or "").partition("Bearer ")[2]
+        with self._lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def stats(self):
+        with self._lock:
+            return {"connections": self.connections, "requests": self.requests,
+                    "tokens_issued": self.tokens_issued, "calls": dict(self.state.calls)}
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+
+    ROUTES = [
+        ("POST", r"/assistants", "create_agent"),
+        ("GET", r"/assistants", "list_agents"),
+        ("GET", r"/assistants/([^/]+)", "get_agent"),
+        ("DELETE", r"/assistants/([^/]+)", "delete_agent"),
+        ("POST", r"/threads", "create_thread"),
+        ("DELETE", r"/threads/([^/]+)", "delete_thread"),
+        ("POST", r"/threads/([^/]+)/messages", "create_message"),
+        ("GET", r"/threads/([^/]+)/messages", "list_messages"),
+        ("POST", r"/threads/([^/]+)/runs", "create_run"),
+        ("GET", r"/threads/([^/]+)/runs/([^/]+)", "get_run"),
+        ("POST", r"/threads/([^/]+)/runs/([^/]+)/cancel", "cancel_run"),
+        ("GET", r"/threads/([^/]+)/runs/([^/]+)/steps", "list_steps"),
+    ]
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, code, message):
+        self._send_json(status, {"error": {"code": code, "message": message}})
+
+    def _dispatch(self, method):
+        self.server.count("requests")
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        if url.path == "/token" and method == "POST":
+            self._send_json(200, {"access_token": self.server.issue_token(), "token_type": "Bearer",
+                                  "expires_in": self.server.token_lifetime})
+            return
+        if url.path == "/stats" and method == "GET":
+            self._send_json(200, self.server.stats())
+            return
+        if not self.server.authorized(self.headers.get("Authorization")):
+            self._error(401, "Unauthorized", "Missing, unknown or expired bearer token")
+            return
+        path = url.path[len(PROJECT_PATH):] if url.path.startswith(PROJECT_PATH) else url.path
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        for route_method, pattern, handler in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                try:
+                    getattr(self, handler)(*match.groups(), body=body, query=query)
+                except KeyError as e:
+                    self._error(404, "NotFound", str(e))
+                return
+        self._error(404, "NotFound", f"No route for {method} {path}")
+
+    # Assistants
+
+    def create_agent(self, body, query):
+        state = self.server.state
+        state.count("create_agent")
+        agent = state.new_agent(body.get("name"), body.get("model"), body.get("instructions"), body.get("metadata"))
+        self._send_json(200, _agent_json(agent))
+
+    def list_agents(self, body, query):
+        self.server.state.count("list_agents")
+        self._send_json(200, _list_json([_agent_json(agent) for agent in self.server.state.list_agents()], query))
+
+    def get_agent(self, agent_id, body, query):
+        self.server.state.count("get_agent")
+        self._send_json(200, _agent_json(self.server.state.get_agent(agent_id)))
+
+    def delete_agent(self, agent_id, body, query):
+        self.server.state.count("delete_agent")
+        self.server.state.delete_agent(agent_id)
+        self._send_json(200, {"id": agent_id, "object": "assistant.deleted", "deleted": True})
+
+    # Threads and messages
+
+    def create_thread(self, body, query):
+        state = self.server.state
+        state.count("threads.create")
+        time.sleep(state.request_latency)
+        thread = state.new_thread()
+        self._send_json(200, {"id": thread.id, "object": "thread", "created_at": int(time.time()), "metadata": {}})
+
+    def delete_thread(self, thread_id, body, query):
+        state = self.server.state
+        state.count("threads.delete")
+        time.sleep(state.request_latency)
+        state.delete_thread(thread_id)
+        self._send_json(200, {"id": thread_id, "object": "thread.deleted", "deleted": True})
+
+    def create_message(self, thread_id, body, query):
+        state = self.server.state
+        state.count("messages.create")
+        time.sleep(state.request_latency)
+        content = body.get("content")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        message = state.add_message(thread_id, body.get("role", "user"), content or "")
+        self._send_json(200, _message_json(state, message, thread_id))
+
+    def list_messages(self, thread_id, body, query):
+        state = self.server.state
+        state.count("messages.list")
+        time.sleep(state.request_latency)
+        messages = state.messages(thread_id, query.get("run_id"))
+        if query.get("order") == "asc":
+            messages = list(reversed(messages))
+        self._send_json(200, _list_json([_message_json(state, m, thread_id) for m in messages], query))
+
+    # Runs
+
+    def create_run(self, thread_id, body, query):
+        state = self.server.state
+        agent_id = body.get("assistant_id") or body.get("agent_id")
+        if not body.get("stream"):
+            state.count("runs.create")
+            run = state.new_run(thread_id, agent_id, body.get("tool_choice"))
+            run.ready_at = time.monotonic() + state.run_latency(run)
+            self._send_json(200, _run_json(run))
+            return
+        state.count("runs.stream")
+        run = state.new_run(thread_id, agent_id, body.get("tool_choice"))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._send_event("thread.run.created", _run_json(run))
+        time.sleep(state.run_latency(run))
+        if run.status == "in_progress":
+            state.complete(run)
+        for event_type, data, _ in state.stream_events(run):
+            if event_type.startswith("thread.run.step"):
+                data = _step_json(data)
+            elif event_type.startswith("thread.message"):
+                data = _message_json(state, data, thread_id)
+            elif event_type.startswith("thread.run"):
+                data = _run_json(data)
+            self._send_event(event_type, data)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_event(self, event_type, data):
+        payload = data if isinstance(data, str) else json.dumps(data)
+        chunk = f"event: {event_type}\ndata: {payload}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def get_run(self, thread_id, run_id, body, query):
+        self.server.state.count("runs.get")
+        self._send_json(200, _run_json(self.server.state.poll(run_id)))
+
+    def cancel_run(self, thread_id, run_id, body, query):
+        state = self.server.state
+        state.count("runs.cancel")
+        run = state.runs[run_id]
+        if run.status == "in_progress":
+            run.status = "cancelled"
+        self._send_json(200, _run_json(run))
+
+    def list_steps(self, thread_id, run_id, body, query):
+        state = self.server.state
+        state.count("run_steps.list")
+        time.sleep(state.request_latency)
+        self._send_json(200, _list_json([_step_json(step) for step in state.steps(run_id)], query))
+
+
+def serve(client=None, port=0, address="127.0.0.1", token_lifetime=3600, auth_latency=0.0):
+    """
+    Start a stand-in server on a background thread.
+
+    Returns:
+        The running StandInServer; its ``endpoint`` is the PROJECT_ENDPOINT to use
+    """
+    server = StandInServer((address, port), client, token_lifetime, auth_latency)
+    threading.Thread(target=server.serve_forever, name="agent-stand-in", daemon=True).start()
+    return server
+
+
+class StandInCredential:
+    """TokenCredential signing in at the stand-in's /token endpoint (one new token per call)."""
+
+    def __init__(self, endpoint):
+        url = urlsplit(endpoint)
+        self.token_url = f"{url.scheme}://{url.netloc}/token"
+
+    def get_token(self, *scopes, **kwargs):
+        from azure.core.credentials import AccessToken
+
+        request = urllib.request.Request(self.token_url, data=json.dumps({"scope": " ".join(scopes)}).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=30) as response:
+            reply = json.load(response)
+        return AccessToken(reply["access_token"], int(time.time() + reply["expires_in"]))
+
+    def close(self):
+        pass
+
+
+class AsyncStandInCredential:
+    """AsyncTokenCredential counterpart of StandInCredential, for the async engine."""
+
+    def __init__(self, endpoint):
+        self._credential = StandInCredential(endpoint)
+
+    async def get_token(self, *scopes, **kwargs):
+        import asyncio
+
+        return await asyncio.to_thread(self._credential.get_token, *scopes, **kwargs)
+
+    async def close(self):
+        pass
+
+
+def local_authentication_policy(credential, scope="https://ai.azure.com/.default"):
+    """Bearer token policy for the stand-in, which azure-core would otherwise refuse to send over plain HTTP."""
+    from azure.core.pipeline.policies import BearerTokenCredentialPolicy
+
+    class _LocalBearerTokenPolicy(BearerTokenCredentialPolicy):
+        def on_request(self, request):
+            request.context.options["enforce_https"] = False
+            super().on_request(request)
+
+    return _LocalBearerTokenPolicy(credential, scope)
+
+
+def local_authentication_policy_async(credential, scope="https://ai.azure.com/.default"):
+    """Async counterpart of local_authentication_policy."""
+    from azure.core.pipeline.policies import AsyncBearerTokenCredentialPolicy
+
+    class _LocalAsyncBearerTokenPolicy(AsyncBearerTokenCredentialPolicy):
+        async def on_request(self, request):
+            request.context.options["enforce_https"] = False
+            await super().on_request(request)
+
+    return _LocalAsyncBearerTokenPolicy(credential, scope)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP stand-in for the agent service endpoint.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=0.5, help="Median run latency in seconds")
+    parser.add_argument("--latency-model", default="lognormal", choices=["constant", "uniform", "lognormal"])
+    parser.add_argument("--request-latency", type=float, default=0.0,
+                        help="Latency of thread/message requests in seconds")
+    parser.add_argument("--grounding-latency", type=float, default=0.0,
+                        help="Extra latency of each web search in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--token-lifetime", type=int, default=3600, help="Lifetime of issued tokens in seconds")
+    parser.add_argument("--auth-latency", type=float, default=0.0, help="Seconds /token takes to issue a token")
+    args = parser.parse_args(argv)
+
+    client = FakeProjectClient(
+        latency=latency_model(args.latency_model, args.latency),
+        failure_rate=args.failure_rate,
+        throttle_rate=args.throttle_rate,
+        malformed_rate=args.malformed_rate,
+        request_latency=args.request_latency,
+        grounding_latency=args.grounding_latency,
+    )
+    server = StandInServer((args.address, args.port), client, args.token_lifetime, args.auth_latency)
+    print(f"Agent stand-in listening; use PROJECT_ENDPOINT={server.endpoint}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats(), indent=1))
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+Pool of agent conversation threads.
+
+Creating a thread per row costs a service round trip on every row, and
+threads that are never deleted pile up in the project. ``AgentThreadPool``
+hands out threads for agent runs instead:
+
+- threads whose last run completed are reused for up to ``max_runs`` runs;
+  runs on a reused thread pass a truncation strategy so the agent only sees
+  the newest message, not the rows verified before it
+- a background worker keeps up to ``prefetch`` fresh threads ready ahead of
+  demand once the pool is first used, never more than the runs still waiting
+  to start (``set_waiting``), so the end of a batch leaves no unused threads
+- retired threads (used up, or whose run failed, timed out or was cancelled)
+  are deleted by background workers, and the rest when the pool is closed
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+import config
+
+_local = threading.local()
+
+# Only the newest message (the row being verified) is context for a run on a reused thread
+REUSED_THREAD_TRUNCATION = {"type": "last_messages", "last_messages": 1}
+
+
+class AgentThreadPool:
+    """Create-ahead, bounded-reuse pool of agent threads with background deletion."""
+
+    def __init__(self, get_client, max_runs=None, prefetch=None, delete_retired=None):
+        self._get_client = get_client
+        self._client = None
+        self.max_runs = max(1, config.THREAD_MAX_RUNS if max_runs is None else max_runs)
+        self.prefetch = max(0, config.THREAD_PREFETCH if prefetch is None else prefetch)
+        self.delete_retired = config.THREAD_DELETE_RETIRED if delete_retired is None else delete_retired
+        self._idle = deque()
+        self._ready = deque()
+        self._runs = {}
+        self._cond = threading.Condition()
+        self._deletions = queue.Queue()
+        self._prefetcher = None
+        self._deleters = []
+        self._started = False
+        self._closed = False
+        # Runs still waiting to start, as reported by the scheduler; None when unknown
+        self._waiting = None
+        self.created = 0
+        self.reused = 0
+        self.prefetched = 0
+        self.deleted = 0
+        self.delete_errors = 0
+        self.create_seconds = 0.0
+
+    @property
+    def client(self):
+        with self._cond:
+            if self._client is None:
+                self._client = self._get_client()
+            return self._client
+
+    @property
+    def run_options(self):
+        """Extra runs.create/runs.stream arguments for runs on pooled threads."""
+        return {"truncation_strategy": REUSED_THREAD_TRUNCATION} if self.max_runs > 1 else {}
+
+    def _start_workers(self):
+        # Called with the lock held, on first acquire so unused pools cost nothing
+        self._started = True
+        if self.prefetch:
+            self._prefetcher = threading.Thread(target=self._prefetch_loop, name="agent-thread-prefetch",
+                                                daemon=True)
+            self._prefetcher.start()
+        if self.delete_retired:
+            # Enough deleters to keep up with one retired thread per run
+            for i in range(max(2, self.prefetch)):
+                deleter = threading.Thread(target=self._delete_loop, name=f"agent-thread-delete-{i}",
+                                           daemon=True)
+                deleter.start()
+                self._deleters.append(deleter)
+
+    def _create(self):
+        started = time.perf_counter()
+        thread = self.client.agents.threads.create()
+        elapsed = time.perf_counter() - started
+        with self._cond:
+            self.created += 1
+            self.create_seconds += elapsed
+        return thread.id
+
+    def acquire(self):
+        """Return the ID of a thread to run on: a reusable one, a prefetched one or a new one."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Agent thread pool is closed")
+            if not self._started:
+                self._start_workers()
+            if self._idle:
+                self.reused += 1
+                self._cond.notify_all()
+                return self._idle.pop()
+            if self._ready:
+                self.prefetched += 1
+                self._cond.notify_all()
+                return self._ready.popleft()
+        return self._create()
+
+    def release(self, thread_id, reusable):
+        """
+        Hand a thread back after a run.
+
+        Args:
+            thread_id: Thread returned by acquire
+            reusable: True if the run on it completed (no run can still be active)
+        """
+        with self._cond:
+            runs = self._runs.pop(thread_id, 0) + 1
+            if reusable and runs < self.max_runs and not self._closed:
+                self._runs[thread_id] = runs
+                self._idle.append(thread_id)
+                return
+        self._retire(thread_id)
+
+    def set_waiting(self, count):
+        """
+        Report how many runs are still waiting to start.
+
+        The prefetcher keeps no more ready threads than that, and none once it
+        is 0; acquires beyond the estimate (retries, repairs, hedges) create
+        their thread on demand.
+        """
+        with self._cond:
+            self._waiting = count
+            self._cond.notify_all()
+
+    def _spare_target(self):
+        # Called with the lock held
+        return self.prefetch if self._waiting is None else min(self.prefetch, self._waiting)
+
+    def _retire(self, thread_id):
+        if self.delete_retired:
+            self._deletions.put(thread_id)
+
+    def _prefetch_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and len(self._ready) + len(self._idle) >= self._spare_target():
+                    self._cond.wait()
+                if self._closed:
+                    return
+            try:
+                thread_id = self._create()
+            except Exception as e:
+                print(f"Could not pre-create agent thread: {e}")
+                with self._cond:
+                    self._cond.wait(1.0)
+                continue
+            with self._cond:
+                if not self._closed:
+                    self._ready.append(thread_id)
+                    continue
+            self._retire(thread_id)
+
+    def _delete_loop(self):
+        while True:
+            thread_id = self._deletions.get()
+            if thread_id is None:
+                return
+            try:
+                self.client.agents.threads.delete(thread_id)
+                with self._cond:
+                    self.deleted += 1
+            except Exception as e:
+                with self._cond:
+                    self.delete_errors += 1
+                print(f"Could not delete agent thread {thread_id}: {e}")
+
+    def close(self):
+        """Stop prefetching, delete every thread the pool still holds and wait for pending deletions."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            leftover = list(self._idle) + list(self._ready)
+            self._idle.clear()
+            self._ready.clear()
+            self._runs.clear()
+            self._cond.notify_all()
+        if self._prefetcher is not None:
+            # A thread it was creating while closing is retired before it exits
+            self._prefetcher.join()
+        for thread_id in leftover:
+            self._retire(thread_id)
+        for deleter in self._deleters:
+            self._deletions.put(None)
+        for deleter in self._deleters:
+            deleter.join()
+
+    def stats(self):
+        """Thread lifecycle counters and the creation time saved by reuse and prefetching."""
+        with self._cond:
+            average = self.create_seconds / self.created if self.created else 0.0
+            return {
+                "threads_created": self.created,
+                "threads_reused": self.reused,
+                "threads_prefetched": self.prefetched,
+                "threads_deleted": self.deleted,
+                "thread_delete_errors": self.delete_errors,
+                "thread_seconds_saved": round((self.reused + self.prefetched) * average, 3),
+            }
+
+    def bind(self, fn):
+        """Wrap ``fn`` so agent calls made while it runs take their threads from this pool."""
+        def wrapper(*args, **kwargs):
+            previous = getattr(_local, "pool", None)
+            _local.pool = self
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _local.pool = previous
+        return wrapper
+
+
+def current_pool():
+    """The AgentThreadPool bound to this thread, or None."""
+    return getattr(_local, "pool", None)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Headless batch runner for the certificate mapper.
+
+Runs the agent over a row range of a workbook without Streamlit, sharding rows
+across worker processes (each with its own AIProjectClient, all reusing the
+registered agent), and merges results deterministically into the output sheet.
+
+Examples:
+    # All rows 2-5000 on 4 processes
+    python batch_cli.py run data.xlsx --start-row 2 --end-row 5000 --processes 4 --output updated.xlsx
+
+    # Group rows by certifier/URL so each provider's listing is looked up once
+    python batch_cli.py run data.xlsx --schedule affinity --output updated.xlsx
+
+    # Split one catalog across two machines, then stitch the outputs
+    python batch_cli.py run data.xlsx --shard 1/2 --results shard1.json
+    python batch_cli.py run data.xlsx --shard 2/2 --results shard2.json
+    python batch_cli.py merge data.xlsx shard1.json shard2.json --output updated.xlsx
+
+    # Every sheet of two workbooks plus a CSV and a Parquet file in one batch
+    python batch_cli.py run-many q1.xlsx q2.xlsx extra.csv archive.parquet --output-dir updated
+
+    # Delete agents left behind by earlier versions that created one per process
+    python batch_cli.py cleanup-agents --dry-run
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import config
+import metrics
+from excel_io import iter_row_dicts, read_headers, write_results
+from input_sources import iter_rows, open_sources, write_outputs
+from provider_context import provider_key
+from result_cache import row_key
+
+DEFAULT_COLUMNS = "URL,Certifier,Certification Name"
+
+
+def parse_shard(value):
+    """Parse an ``i/N`` shard spec (1-based) into (index, count)."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}', expected i/N")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}', need 1 <= i <= N")
+    return index, count
+
+
+def partition_of(row_dict, count, level=0, by_provider=False):
+    """
+    Deterministic partition for a row; identical rows always land together so they dedupe.
+
+    Different levels use independent hash bits, so splitting a machine shard
+    across processes (level 1) stays balanced. With ``by_provider`` all rows of
+    a provider (certifier and URL host) land together, so affinity scheduling
+    summarizes each provider once.
+    """
+    provider = provider_key(row_dict) if by_provider else ""
+    key = hashlib.sha256(provider.encode("utf-8")).hexdigest() if provider else row_key(row_dict)
+    return int(key[level * 8:(level + 1) * 8], 16) % count
+
+
+def load_rows(args, columns):
+    """Stream the selected rows of the workbook and keep only this shard's rows."""
+    shard_index, shard_count = args.shard
+    rows = []
+    for row_number, row_dict in iter_row_dicts(args.workbook, columns, args.start_row, args.end_row, args.sheet):
+        if not any(value not in (None, "") for value in row_dict.values()):
+            continue
+        if partition_of(row_dict, shard_count, by_provider=args.schedule == "affinity") == shard_index - 1:
+            rows.append((row_number, row_dict))
+    return rows
+
+
+def _process_partition(rows, max_workers, batch_size, schedule=None, process_index=None):
+    """Worker process entry point: verify one partition with this process's own client."""
+    from agent_api import process_rows_with_progress
+
+    metrics.start_exporters(process_index)
+    try:
+        results = process_rows_with_progress(
+            [row_dict for _, row_dict in rows],
+            max_workers=max_workers,
+            batch_size=batch_size,
+            schedule=schedule,
+        )
+    finally:
+        metrics.dump_json()
+    return [(row_number, result) for (row_number, _), result in zip(rows, results)]
+
+
+def run_partitions(rows, processes, max_workers, batch_size, schedule=None):
+    """Shard rows across worker processes and return {row_number: result}."""
+    schedule = schedule or config.SCHEDULING_MODE
+    partitions = [[] for _ in range(processes)]
+    for row_number, row_dict in rows:
+        partition = partition_of(row_dict, processes, level=1, by_provider=schedule == "affinity")
+        partitions[partition].append((row_number, row_dict))
+    partitions = [part for part in partitions if part]
+
+    results = {}
+    if len(partitions) <= 1:
+        for part in partitions:
+            results.update(_process_partition(part, max_workers, batch_size, schedule))
+        return results
+
+    with ProcessPoolExecutor(max_workers=len(partitions)) as executor:
+        futures = [executor.submit(_process_partition, part, max_workers, batch_size, schedule, i)
+                   for i, part in enumerate(partitions, start=1)]
+        for future in as_completed(futures):
+            part_results = future.result()
+            results.update(part_results)
+            print(f"Worker finished {len(part_results)} rows ({len(results)}/{len(rows)} total)")
+    return results
+
+
+def save_results(path, results, args):
+    """Write shard results as JSON so other machines' shards can be merged later."""
+    payload = {
+        "workbook": args.workbook,
+        "shard": f"{args.shard[0]}/{args.shard[1]}",
+        "results": {str(row): result for row, result in sorted(results.items())},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=1, default=str)
+
+
+def load_results(paths):
+    """Merge shard result files; on overlap the later file wins, so pass them in shard order."""
+    merged = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        merged.update({int(row): result for row, result in payload["results"].items()})
+    return merged
+
+
+def write_output(args, results):
+    headers = read_headers(args.workbook, args.sheet)
+    for header in (args.new_cert_column, args.remark_column):
+        if header not in headers:
+            raise SystemExit(f"Column '{header}' not found in {args.workbook}")
+    write_results(
+        args.workbook,
+        args.output,
+        results,
+        {args.new_cert_column: "newCertificateName", args.remark_column: "remark"},
+        args.sheet,
+    )
+    print(f"Updated file saved as {args.output}")
+
+
+def cmd_run(args):
+    columns = [c.strip() for c in args.columns.split(",") if c.strip()]
+    rows = load_rows(args, columns)
+    print(f"Shard {args.shard[0]}/{args.shard[1]}: {len(rows)} rows across {args.processes} processes")
+    started = time.time()
+    results = run_partitions(rows, args.processes, args.workers, args.batch_size, args.schedule)
+    print(f"Processed {len(results)} rows in {time.time() - started:.1f}s")
+    if args.results:
+        save_results(args.results, results, args)
+        print(f"Results saved as {args.results}")
+    if args.output:
+        write_output(args, results)
+
+
+def cmd_run_many(args):
+    from agent_api import process_rows_with_progress
+
+    metrics.start_exporters()
+    columns = [c.strip() for c in args.columns.split(",") if c.strip()]
+    sources = open_sources(args.inputs, args.sheet)
+    print(f"Reading {len(sources)} tables: {', '.join(source.label for source in sources)}")
+    provenances, row_dicts = [], []
+    for provenance, row_dict in iter_rows(sources, columns):
+        provenances.append(provenance)
+        row_dicts.append(row_dict)
+    started = time.time()
+    # One batch across every file, so duplicates are verified once whichever file they are in
+    results = process_rows_with_progress(row_dicts, max_workers=args.workers, batch_size=args.batch_size,
+                                         schedule=args.schedule)
+    print(f"Processed {len(results)} rows in {time.time() - started:.1f}s")
+    column_map = {args.new_cert_column: "newCertificateName", args.remark_column: "remark"}
+    for output_path in write_outputs(sources, dict(zip(provenances, results)), column_map, args.output_dir):
+        print(f"Updated file saved as {output_path}")
+
+
+def cmd_merge(args):
+    results = load_results(args.results)
+    print(f"Merging {len(results)} rows from {len(args.results)} result files")
+    write_output(args, results)
+
+
+def cmd_cleanup_agents(args):
+    from agent_api import cleanup_orphaned_agents
+
+    orphans = cleanup_orphaned_agents(min_age_hours=args.min_age_hours, dry_run=args.dry_run)
+    print(f"{len(orphans)} orphaned agents {'found' if args.dry_run else 'deleted'}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the certificate mapper agent over a workbook.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_output_args(p):
+        p.add_argument("workbook", help="Path to the input .xlsx workbook")
+        p.add_argument("--sheet", help="Sheet name (defaults to the active sheet)")
+        p.add_argument("--new-cert-column", default="NEW CERTIFICATE NAME BY AGENT",
+                       help="Column receiving newCertificateName")
+        p.add_argument("--remark-column", default="AGENT REMARKS", help="Column receiving remark")
+
+    run = subparsers.add_parser("run", help="Verify rows and write results")
+    add_output_args(run)
+    run.add_argument("--columns", default=DEFAULT_COLUMNS, help="Comma-separated columns to send to the agent")
+    run.add_argument("--start-row", type=int, default=2, help="First sheet row (inclusive)")
+    run.add_argument("--end-row", type=int, default=None, help="Last sheet row (inclusive)")
+    run.add_argument("--output", help="Path of the updated workbook to write")
+    run.add_argument("--results", help="Path of a JSON results file to write (for merging shards)")
+    run.add_argument("--processes", type=int, default=1, help="Worker processes on this machine")
+    run.add_argument("--workers", type=int, default=config.MAX_WORKERS,
+                     help="Maximum concurrent agent calls per process")
+    run.add_argument("--batch-size", type=int, default=config.BATCH_SIZE, help="Rows per agent run")
+    run.add_argument("--schedule", choices=["sheet", "affinity"], default=config.SCHEDULING_MODE,
+                     help="Row order: sheet order, or grouped by certifier/URL with a shared provider summary")
+    run.add_argument("--shard", type=parse_shard, default=(1, 1),
+                     help="Process only shard i of N (1-based), e.g. 2/4")
+    run.set_defaults(func=cmd_run)
+
+    run_many = subparsers.add_parser(
+        "run-many", help="Verify the rows of several workbooks, sheets, CSV and Parquet files in one batch")
+    run_many.add_argument("inputs", nargs="+", help="Input .xlsx, .csv and .parquet files")
+    run_many.add_argument("--sheet", action="append",
+                          help="Workbook sheet to include (repeatable; every sheet when omitted)")
+    run_many.add_argument("--columns", default=DEFAULT_COLUMNS, help="Comma-separated columns to send to the agent")
+    run_many.add_argument("--new-cert-column", default="NEW CERTIFICATE NAME BY AGENT",
+                          help="Column receiving newCertificateName (added to tables without it)")
+    run_many.add_argument("--remark-column", default="AGENT REMARKS",
+                          help="Column receiving remark (added to tables without it)")
+    run_many.add_argument("--output-dir", default=".", help="Directory for the updated_<name> output files")
+    run_many.add_argument("--workers", type=int, default=config.MAX_WORKERS,
+                          help="Maximum concurrent agent calls")
+    run_many.add_argument("--batch-size", type=int, default=config.BATCH_SIZE, help="Rows per agent run")
+    run_many.add_argument("--schedule", choices=["sheet", "affinity"], default=config.SCHEDULING_MODE,
+                          help="Row order: input order, or grouped by certifier/URL with a shared provider summary")
+    run_many.set_defaults(func=cmd_run_many)
+
+    merge = subparsers.add_parser("merge", help="Stitch shard result files into one workbook")
+    add_output_args(merge)
+    merge.add_argument("results", nargs="+", help="JSON results files written by 'run --results'")
+    merge.add_argument("--output", required=True, help="Path of the updated workbook to write")
+    merge.set_defaults(func=cmd_merge)
+
+    cleanup = subparsers.add_parser("cleanup-agents", help="Delete mapper agents other than the one in use")
+    cleanup.add_argument("--min-age-hours", type=float, default=config.AGENT_ORPHAN_MIN_AGE_HOURS,
+                         help="Keep agents created more recently than this")
+    cleanup.add_argument("--dry-run", action="store_true", help="Only list the agents that would be deleted")
+    cleanup.set_defaults(func=cmd_cleanup_agents)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "run" and not (args.output or args.results):
+        print("Nothing to write: pass --output and/or --results", file=sys.stderr)
+        return 2
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
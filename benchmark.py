@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Offline throughput/latency benchmarks for the certificate mapper.
+
+Generates synthetic workbooks and runs them through ``process_rows_with_progress``
+and the asyncio engine (``agent_api_async.process_rows_async``) against the fake
+agent backend (fake_backend.py), and through the streaming Excel round trip used
+by streamlit_ui (excel_io). Each scenario runs in a fresh process so peak RSS
+is per scenario. Results are printed and optionally saved as JSON so they can
+be compared across versions.
+
+Examples:
+    python benchmark.py --rows 1000 10000 --latency 0.05 --workers 16
+    python benchmark.py --rows 100000 --scenarios excel --output bench.json
+    python benchmark.py --rows 5000 --batch-size 1 10 --throttle-rate 0.02 --output bench.json
+    python benchmark.py --rows 2000 --scenarios agent --completion-mode poll --output poll.json
+    python benchmark.py --rows 2000 --scenarios agent --schedule sheet affinity --grounding-latency 0.2
+    python benchmark.py --rows 10000 --scenarios agent agent_async --workers 64 --output engines.json
+"""
+
+import os
+
+# The benchmark must never reach Azure, and cached or catalogued answers and reused agents
+# would hide agent costs
+os.environ["AGENT_BACKEND"] = "fake"
+os.environ["CACHE_ENABLED"] = "false"
+os.environ["CATALOG_ENABLED"] = "false"
+os.environ["AGENT_REGISTRY_PATH"] = ""
+
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+HEADERS = ("Area", "URL", "Certifier", "Certification Name",
+           "NEW CERTIFICATE NAME BY AGENT", "AGENT REMARKS")
+SEND_COLUMNS = ["URL", "Certifier", "Certification Name"]
+
+
+def generate_workbook(path, rows, duplicate_ratio=0.3, seed=42):
+    """Write a synthetic catalog of ``rows`` data rows, a share of them duplicates."""
+    import openpyxl
+
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(HEADERS)
+    distinct = max(1, int(rows * (1 - duplicate_ratio)))
+    for i in range(rows):
+        n = i if i < distinct else rng.randrange(distinct)
+        certifier = f"Provider {n % 97}"
+        ws.append(("IT", f"https://provider{n % 97}.example.com/certs", certifier,
+                   f"{certifier} Certified Professional {n}", None, None))
+    wb.save(path)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0.0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def latency_summary(latencies):
+    return {
+        "p50": round(percentile(latencies, 50) * 1000, 2),
+        "p95": round(percentile(latencies, 95) * 1000, 2),
+        "p99": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def fake_client_options(params):
+    """Keyword arguments for a fake_backend client with the benchmark's injected latency and faults."""
+    from fake_backend import latency_model
+
+    return {
+        "latency": latency_model(params["latency_model"], params["latency"]),
+        "failure_rate": params["failure_rate"],
+        "throttle_rate": params["throttle_rate"],
+        "malformed_rate": params["malformed_rate"],
+        "seed": params["seed"],
+        "request_latency": params["request_latency"],
+        "grounding_latency": params["grounding_latency"],
+    }
+
+
+def bench_agent(workbook, rows, params):
+    """Run process_rows_with_progress on the fake backend and time every row."""
+    import agent_api
+    from excel_io import iter_row_dicts
+    from fake_backend import FakeProjectClient
+    from result_cache import is_agent_answer
+
+    client = FakeProjectClient(**fake_client_options(params))
+    agent_api.use_backend(client)
+
+    latencies = []
+    call_agent = agent_api.call_agent
+    verify_rows_batched = agent_api.verify_rows_batched
+
+    def timed_call_agent(row_dict, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return call_agent(row_dict, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    def timed_verify_rows_batched(row_dicts, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return verify_rows_batched(row_dicts, *args, **kwargs)
+        finally:
+            latencies.extend([time.perf_counter() - started] * len(row_dicts))
+
+    agent_api.call_agent = timed_call_agent
+    agent_api.verify_rows_batched = timed_verify_rows_batched
+
+    row_dicts = [row_dict for _, row_dict in iter_row_dicts(workbook, SEND_COLUMNS, 2, rows + 1)]
+    stats = {}
+    started = time.perf_counter()
+    results = agent_api.process_rows_with_progress(
+        row_dicts, max_workers=params["workers"], batch_size=params["batch_size"], stats=stats,
+        hedge=params["hedge"], schedule=params["schedule"]
+    )
+    elapsed = time.perf_counter() - started
+    errors = sum(1 for result in results if not is_agent_answer(result))
+    return {
+        "scenario": "agent",
+        "rows": len(row_dicts),
+        "batch_size": params["batch_size"],
+        "schedule": params["schedule"],
+        "workers": params["workers"],
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(len(row_dicts) / elapsed, 2) if elapsed else None,
+        "latency_ms": latency_summary(latencies),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "agent_calls": dict(client.calls),
+        "error_rows": errors,
+        "batch_stats": stats,
+    }
+
+
+def bench_agent_async(workbook, rows, params):
+    """Run process_rows_async on the fake async backend, --workers rows in flight, and time every row."""
+    import asyncio
+
+    import agent_api_async
+    from excel_io import iter_row_dicts
+    from fake_backend import FakeAsyncProjectClient
+    from result_cache import is_agent_answer
+
+    client = FakeAsyncProjectClient(**fake_client_options(params))
+
+    latencies = []
+    call_agent_async = agent_api_async.call_agent_async
+
+    async def timed_call_agent_async(row_dict, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await call_agent_async(row_dict, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    agent_api_async.call_agent_async = timed_call_agent_async
+
+    row_dicts = [row_dict for _, row_dict in iter_row_dicts(workbook, SEND_COLUMNS, 2, rows + 1)]
+    stats = {}
+    started = time.perf_counter()
+    results = asyncio.run(agent_api_async.process_rows_async(
+        row_dicts, max_concurrency=params["workers"], stats=stats, client=client))
+    elapsed = time.perf_counter() - started
+    errors = sum(1 for result in results if not is_agent_answer(result))
+    return {
+        "scenario": "agent_async",
+        "rows": len(row_dicts),
+        "workers": params["workers"],
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(len(row_dicts) / elapsed, 2) if elapsed else None,
+        "latency_ms": latency_summary(latencies),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "agent_calls": dict(client.calls),
+        "error_rows": errors,
+        "batch_stats": stats,
+    }
+
+
+def bench_excel(workbook, rows, params):
+    """Time the streaming read and write-back of a workbook, as done by streamlit_ui."""
+    from excel_io import iter_row_dicts, read_headers, write_results
+
+    started = time.perf_counter()
+    headers = read_headers(workbook)
+    row_numbers = [row_number for row_number, _ in iter_row_dicts(workbook, SEND_COLUMNS, 2, rows + 1)]
+    read_seconds = time.perf_counter() - started
+
+    results = {row_number: {"newCertificateName": "X", "remark": "Certificate exists."}
+               for row_number in row_numbers}
+    with tempfile.TemporaryDirectory() as tmp:
+        write_started = time.perf_counter()
+        write_results(workbook, os.path.join(tmp, "out.xlsx"), results,
+                      {headers[4]: "newCertificateName", headers[5]: "remark"})
+        write_seconds = time.perf_counter() - write_started
+    elapsed = read_seconds + write_seconds
+    return {
+        "scenario": "excel",
+        "rows": len(row_numbers),
+        "seconds": round(elapsed, 3),
+        "read_seconds": round(read_seconds, 3),
+        "write_seconds": round(write_seconds, 3),
+        "rows_per_sec": round(len(row_numbers) / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+SCENARIOS = {"agent": bench_agent, "agent_async": bench_agent_async, "excel": bench_excel}
+
+
+def _run_scenario(name, workbook, rows, params):
+    return SCENARIOS[name](workbook, rows, params)
+
+
+def run_isolated(name, workbook, rows, params):
+    """Run one scenario in a fresh process so its peak RSS is not inherited."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(_run_scenario, name, workbook, rows, params).result()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the certificate mapper.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000], help="Workbook sizes to test")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=16,
+                        help="max_workers for process_rows_with_progress, max_concurrency for process_rows_async")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1], help="Rows per agent run")
+    parser.add_argument("--latency", type=float, default=0.05, help="Median fake run latency in seconds")
+    parser.add_argument("--latency-model", default="lognormal", choices=["constant", "uniform", "lognormal"])
+    parser.add_argument("--schedule", nargs="+", choices=["sheet", "affinity"], default=["sheet"],
+                        help="Row scheduling modes to compare")
+    parser.add_argument("--grounding-latency", type=float, default=0.0,
+                        help="Extra fake latency of each web search in seconds")
+    parser.add_argument("--request-latency", type=float, default=0.0,
+                        help="Fake latency of thread/message requests in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--poll-interval", type=float, default=None,
+                        help="Run status poll interval in seconds (RUN_POLL_INTERVAL_SECONDS)")
+    parser.add_argument("--completion-mode", choices=["stream", "poll"], default=None,
+                        help="How runs are awaited (RUN_COMPLETION_MODE)")
+    parser.add_argument("--thread-max-runs", type=int, default=None,
+                        help="Runs per agent thread before it is retired (THREAD_MAX_RUNS; 1 disables reuse)")
+    parser.add_argument("--hedge", action="store_true", help="Enable hedged duplicate runs for stragglers")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.3, help="Share of duplicate rows")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args(argv)
+    if args.poll_interval is not None:
+        # Read by config.py in the scenario processes
+        os.environ["RUN_POLL_INTERVAL_SECONDS"] = str(args.poll_interval)
+    if args.completion_mode is not None:
+        os.environ["RUN_COMPLETION_MODE"] = args.completion_mode
+    if args.thread_max_runs is not None:
+        os.environ["THREAD_MAX_RUNS"] = str(args.thread_max_runs)
+
+    report = {
+        "git_revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(args),
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            workbook = os.path.join(tmp, f"synthetic_{rows}.xlsx")
+            generate_workbook(workbook, rows, args.duplicate_ratio, args.seed)
+            for name in args.scenarios:
+                agent_runs = [(b, sched) for b in args.batch_size for sched in args.schedule]
+                for batch_size, schedule in (agent_runs if name == "agent" else [(None, None)]):
+                    params = {
+                        "workers": args.workers,
+                        "batch_size": batch_size,
+                        "schedule": schedule,
+                        "latency": args.latency,
+                        "latency_model": args.latency_model,
+                        "request_latency": args.request_latency,
+                        "grounding_latency": args.grounding_latency,
+                        "failure_rate": args.failure_rate,
+                        "throttle_rate": args.throttle_rate,
+                        "malformed_rate": args.malformed_rate,
+                        "hedge": args.hedge,
+                        "seed": args.seed,
+                    }
+                    result = run_isolated(name, workbook, rows, params)
+                    report["results"].append(result)
+                    print(f"{name:<11} rows={result['rows']:<7} {result['rows_per_sec']} rows/s "
+                          f"peak_rss={result['peak_rss_mb']}MiB", file=sys.stderr)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Local catalog of certificates verified in earlier runs.
+
+Most rows of a new sheet were already answered by the agent in a previous
+output workbook. The catalog indexes those answers by certifier and
+normalized certificate name (plus the URL host and known renames), so
+``call_agent`` can answer high-confidence rows locally and only send new,
+ambiguous or stale rows to the web-grounded agent.
+
+Only durable answers are indexed ("Certificate exists.", slight name
+differences and renames); expiring and not-found answers change too quickly.
+Lookups are an exact dict probe first, then a fuzzy match against entries of
+the same certifier that share at least half of the name's tokens, scored by
+edit-distance ratio.
+A fuzzy match must also carry the same code tokens (exam codes, versions,
+years and levels such as "204", "v2" or "ii"): "AZ-204" scores 0.98 against
+"AZ-104" but is another certificate, so such near-matches count as ambiguous
+and go to the agent.
+The index is stored as gzip-compressed column lists; the token postings for
+fuzzy lookup are built per certifier the first time that certifier is queried.
+
+Examples:
+    python catalog_index.py build updated_q1.xlsx updated_q2.xlsx
+    python catalog_index.py lookup --certifier "Microsoft" --name "Azure Fundamentals"
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from difflib import SequenceMatcher
+from urllib.parse import urlsplit
+
+import config
+from result_cache import agent_answer, normalize_value
+
+FORMAT_VERSION = 1
+EXISTS = "Certificate exists."
+SLIGHT_DIFFERENCE = "Certificate exists but with a slight different name"
+RENAMED = "Certificate has been renamed."
+TRUSTED_REMARKS = (EXISTS, SLIGHT_DIFFERENCE, RENAMED)
+FIELDS = ("certifier", "name", "canonical", "remark", "host", "seen_at")
+MAX_FUZZY_CANDIDATES = 16
+# Entries sharing less than this fraction of a name's tokens are never scored
+MIN_SHARED_TOKEN_FRACTION = 0.5
+
+_TOKEN_RE = re.compile(r"\w+")
+_ROMAN_NUMERALS = frozenset(("i", "ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x"))
+
+
+def normalize_name(value):
+    """Case-folded certificate name with punctuation dropped, for keying and matching."""
+    return " ".join(_TOKEN_RE.findall(normalize_value(value)))
+
+
+def code_tokens(name):
+    """Tokens of a normalized name that identify one certificate among similar names: digits and levels."""
+    return frozenset(token for token in name.split()
+                     if token in _ROMAN_NUMERALS or any(c.isdigit() for c in token))
+
+
+def url_host(value):
+    """Host part of a URL without a leading 'www.' ('' when there is none)."""
+    text = normalize_value(value)
+    if not text:
+        return ""
+    host = urlsplit(text if "//" in text else "//" + text).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+class CatalogIndex:
+    """In-memory certificate catalog with exact and fuzzy lookup."""
+
+    def __init__(self, min_score=None, max_age_days=None, name_column=None, certifier_column=None,
+                 url_column=None):
+        self.min_score = config.CATALOG_MIN_SCORE if min_score is None else min_score
+        self.max_age_days = config.CATALOG_MAX_AGE_DAYS if max_age_days is None else max_age_days
+        self.name_column = name_column or config.CATALOG_NAME_COLUMN
+        self.certifier_column = certifier_column or config.CATALOG_CERTIFIER_COLUMN
+        self.url_column = url_column or config.CATALOG_URL_COLUMN
+        self.columns = {field: [] for field in FIELDS}
+        self.sources = []
+        self._exact = {}
+        self._by_name = {}
+        self._by_certifier = {}
+        self._postings = {}
+        self._lock = threading.Lock()
+        self.counts = {"exact": 0, "fuzzy": 0, "ambiguous": 0, "stale": 0, "miss": 0}
+
+    def __len__(self):
+        return len(self.columns["name"])
+
+    # Building
+
+    def _key_entry(self, i):
+        certifier, name = self.columns["certifier"][i], self.columns["name"][i]
+        self._exact[(certifier, name)] = i
+        self._by_certifier.setdefault(certifier, []).append(i)
+        previous = self._by_name.get(name)
+        # -1 marks names shared by several certifiers: no certifier, no answer
+        self._by_name[name] = i if previous is None or previous == i else -1
+
+    def add(self, certifier, name, canonical, remark, url=None, seen_at=None):
+        """Add or refresh one verified certificate; newer answers replace older ones."""
+        key = (normalize_value(certifier), normalize_name(name))
+        if not key[1] or remark not in TRUSTED_REMARKS:
+            return False
+        seen_at = int(seen_at if seen_at is not None else time.time())
+        values = (key[0], key[1], str(canonical or name).strip(), remark, url_host(url), seen_at)
+        existing = self._exact.get(key)
+        if existing is not None:
+            if self.columns["seen_at"][existing] > seen_at:
+                return False
+            for field, value in zip(FIELDS, values):
+                self.columns[field][existing] = value
+            return True
+        for field, value in zip(FIELDS, values):
+            self.columns[field].append(value)
+        self._key_entry(len(self) - 1)
+        self._postings.pop(key[0], None)
+        return True
+
+    def add_result(self, certifier, name, url, result, seen_at=None):
+        """Index an agent result; renames also record that the new name exists."""
+        remark = str(result.get("remark") or "").strip()
+        canonical = str(result.get("newCertificateName") or "").strip() or name
+        if not self.add(certifier, name, canonical, remark, url, seen_at):
+            return False
+        if remark in (RENAMED, SLIGHT_DIFFERENCE) and normalize_name(canonical) != normalize_name(name):
+            alias = (normalize_value(certifier), normalize_name(canonical))
+            if alias not in self._exact:
+                self.add(certifier, canonical, canonical, EXISTS, url, seen_at)
+        return True
+
+    def add_workbook(self, source, new_name_column="NEW CERTIFICATE NAME BY AGENT",
+                     remark_column="AGENT REMARKS", sheet_name=None):
+        """Index every trusted answer in a previous output workbook; returns the rows added."""
+        from excel_io import iter_row_dicts
+
+        seen_at = os.path.getmtime(source) if isinstance(source, str) else time.time()
+        columns = [self.name_column, self.certifier_column, self.url_column, new_name_column, remark_column]
+        added = 0
+        for _, row in iter_row_dicts(source, columns, sheet_name=sheet_name):
+            result = {"newCertificateName": row.get(new_name_column), "remark": row.get(remark_column)}
+            if self.add_result(row.get(self.certifier_column), row.get(self.name_column),
+                               row.get(self.url_column), result, seen_at):
+                added += 1
+        self.sources.append({"source": str(source), "rows": added, "seen_at": int(seen_at)})
+        return added
+
+    # Storage
+
+    def save(self, path=None):
+        path = path or config.CATALOG_PATH
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        payload = {"version": FORMAT_VERSION, "built_at": int(time.time()), "sources": self.sources,
+                   "columns": self.columns}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            f.write(json.dumps(payload, separators=(",", ":")))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=None, **kwargs):
+        path = path or config.CATALOG_PATH
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported catalog format version {payload.get('version')} in {path}")
+        index = cls(**kwargs)
+        index.columns = {field: payload["columns"][field] for field in FIELDS}
+        index.sources = payload.get("sources", [])
+        for i in range(len(index)):
+            index._key_entry(i)
+        return index
+
+    # Lookup
+
+    def _fuzzy_postings(self, certifier):
+        """Token -> entry IDs for one certifier's entries."""
+        postings = self._postings.get(certifier)
+        if postings is None:
+            with self._lock:
+                postings = self._postings.get(certifier)
+                if postings is None:
+                    postings = {}
+                    names = self.columns["name"]
+                    for i in self._by_certifier.get(certifier, ()):
+                        for token in set(names[i].split()):
+                            postings.setdefault(token, set()).add(i)
+                    self._postings[certifier] = postings
+        return postings
+
+    def _fuzzy(self, certifier, name):
+        """
+        Best fuzzy candidate as (score, index).
+
+        The index is None when two distinct names tie, or when the only
+        candidates scoring min_score differ in their code tokens; the score is
+        then that of the best such candidate.
+        """
+        postings = self._fuzzy_postings(certifier)
+        tokens = sorted(set(name.split()), key=lambda token: len(postings.get(token, ())))
+        required = max(1, math.ceil(len(tokens) * MIN_SHARED_TOKEN_FRACTION))
+        # An entry sharing ``required`` of the name's tokens holds one of its len - required + 1 rarest,
+        # so only those postings are counted in full; common words ("azure", "associate") are only
+        # looked up for entries already found
+        prefix = len(tokens) - required + 1
+        shared = Counter()
+        for token in tokens[:prefix]:
+            shared.update(postings.get(token, ()))
+        for token in tokens[prefix:]:
+            shared.update(shared.keys() & postings.get(token, set()))
+        # Only entries sharing the most tokens with the name are scored
+        close = Counter({i: count for i, count in shared.items() if count >= required})
+        candidates = [i for i, _ in close.most_common(MAX_FUZZY_CANDIDATES)]
+        best_score, best, runner_up, conflict = 0.0, None, 0.0, 0.0
+        codes = code_tokens(name)
+        matcher = SequenceMatcher(autojunk=False)
+        matcher.set_seq2(name)
+        names = self.columns["name"]
+        for i in candidates:
+            matcher.set_seq1(names[i])
+            if matcher.real_quick_ratio() < self.min_score or matcher.quick_ratio() < self.min_score:
+                continue
+            score = matcher.ratio()
+            if code_tokens(names[i]) != codes:
+                # Another exam code, version or level of a similar name is a different certificate
+                conflict = max(conflict, score)
+                continue
+            if score > best_score:
+                if best is not None and self.columns["canonical"][best] != self.columns["canonical"][i]:
+                    runner_up = best_score
+                best_score, best = score, i
+            elif (best is not None and score > runner_up
+                  and self.columns["canonical"][best] != self.columns["canonical"][i]):
+                runner_up = score
+        if best is not None and best_score - runner_up < config.CATALOG_AMBIGUITY_MARGIN:
+            return best_score, None
+        if best is None and conflict >= self.min_score:
+            return conflict, None
+        return best_score, best
+
+    def lookup(self, certifier, name, url=None):
+        """
+        Find the catalog entry for a certificate.
+
+        Returns:
+            Tuple of (outcome, index, score): outcome is 'exact', 'fuzzy',
+            'ambiguous', 'stale' or 'miss'; index is None unless an entry
+            was matched
+        """
+        certifier, name = normalize_value(certifier), normalize_name(name)
+        if not name:
+            return "miss", None, 0.0
+        index, score, outcome = self._exact.get((certifier, name)), 1.0, "exact"
+        if index is None and not certifier:
+            index = self._by_name.get(name)
+            if index == -1:
+                return "ambiguous", None, 0.0
+        if index is None:
+            if not certifier:
+                return "miss", None, 0.0
+            score, index = self._fuzzy(certifier, name)
+            if index is None:
+                return ("ambiguous" if score >= self.min_score else "miss"), None, score
+            outcome = "fuzzy"
+        host = url_host(url)
+        if host and self.columns["host"][index] and host != self.columns["host"][index]:
+            # Same name on another site is a different certificate until the agent says otherwise
+            return "ambiguous", index, score
+        if self.max_age_days and time.time() - self.columns["seen_at"][index] > self.max_age_days * 86400:
+            return "stale", index, score
+        return outcome, index, score
+
+    def resolve(self, row_dict):
+        """
+        Answer a row from the catalog when the match is confident.
+
+        Returns:
+            A verification result dict, or None when the row should go to the agent
+        """
+        name = row_dict.get(self.name_column)
+        outcome, index, score = self.lookup(row_dict.get(self.certifier_column), name,
+                                            row_dict.get(self.url_column))
+        with self._lock:
+            self.counts[outcome] += 1
+        if outcome not in ("exact", "fuzzy"):
+            return None
+        canonical, remark = self.columns["canonical"][index], self.columns["remark"][index]
+        if remark == EXISTS and normalize_value(canonical) != normalize_value(name):
+            remark = SLIGHT_DIFFERENCE
+        return agent_answer({"newCertificateName": canonical, "remark": remark, "_catalog": round(score, 3)})
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, entries=len(self))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the local certificate catalog index.")
+    parser.add_argument("--index", default=config.CATALOG_PATH, help="Index file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Index the answers in previous output workbooks")
+    build.add_argument("workbooks", nargs="+", help="Output workbooks written by earlier runs")
+    build.add_argument("--append", action="store_true", help="Add to the existing index instead of replacing it")
+    build.add_argument("--sheet", help="Sheet name (defaults to the active sheet)")
+    build.add_argument("--new-cert-column", default="NEW CERTIFICATE NAME BY AGENT")
+    build.add_argument("--remark-column", default="AGENT REMARKS")
+
+    lookup = subparsers.add_parser("lookup", help="Look up one certificate")
+    lookup.add_argument("--certifier", default="")
+    lookup.add_argument("--name", required=True)
+    lookup.add_argument("--url", default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        index = CatalogIndex.load(args.index) if args.append and os.path.exists(args.index) else CatalogIndex()
+        for path in args.workbooks:
+            added = index.add_workbook(path, args.new_cert_column, args.remark_column, args.sheet)
+            print(f"{path}: {added} verified rows indexed")
+        index.save(args.index)
+        print(f"Catalog index saved as {args.index} ({len(index)} entries)")
+    else:
+        started = time.perf_counter()
+        index = CatalogIndex.load(args.index)
+        loaded = time.perf_counter()
+        outcome, i, score = index.lookup(args.certifier, args.name, args.url)
+        elapsed = time.perf_counter() - loaded
+        print(f"Loaded {len(index)} entries in {loaded - started:.3f}s; lookup took {elapsed * 1000:.3f}ms")
+        entry = {field: index.columns[field][i] for field in FIELDS} if i is not None else None
+        print(json.dumps({"outcome": outcome, "score": round(score, 3), "entry": entry}, indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,10 +17,39 @@ MODEL_DEPLOYMENT = os.getenv('MODEL_DEPLOYMENT')
 SUBSCRIPTION_KEY = os.getenv('SUBSCRIPTION_KEY')
 BING_CONNECTION_NAME = os.getenv('BING_CONNECTION_NAME')
 
+# Agent backend: 'azure' (default), 'fake' for the offline stand-in in fake_backend.py, or 'http'
+# for the Azure SDK against the local HTTP stand-in at PROJECT_ENDPOINT (agent_stand_in.py)
+AGENT_BACKEND = os.getenv('AGENT_BACKEND', 'azure').lower()
+FAKE_LATENCY_MODEL = os.getenv('FAKE_LATENCY_MODEL', 'lognormal')
+FAKE_LATENCY_SECONDS = float(os.getenv('FAKE_LATENCY_SECONDS', 0.5))
+FAKE_FAILURE_RATE = float(os.getenv('FAKE_FAILURE_RATE', 0))
+FAKE_THROTTLE_RATE = float(os.getenv('FAKE_THROTTLE_RATE', 0))
+FAKE_MALFORMED_RATE = float(os.getenv('FAKE_MALFORMED_RATE', 0))
+# Latency of every other fake service request (thread/message create, list, delete)
+FAKE_REQUEST_LATENCY_SECONDS = float(os.getenv('FAKE_REQUEST_LATENCY_SECONDS', 0))
+# Extra latency of a fake run that searches the web (runs answering from a provider summary don't)
+FAKE_GROUNDING_LATENCY_SECONDS = float(os.getenv('FAKE_GROUNDING_LATENCY_SECONDS', 0))
+
+# Agent reuse: IDs of created agents are kept in this file (empty disables it) so new
+# processes reuse the agent; cleanup only deletes orphans older than the minimum age
+AGENT_REGISTRY_PATH = os.getenv('AGENT_REGISTRY_PATH', '.cache/agents.json')
+AGENT_ORPHAN_MIN_AGE_HOURS = float(os.getenv('AGENT_ORPHAN_MIN_AGE_HOURS', 24))
+
 # Azure Service Principal (for authentication)
 AZURE_CLIENT_ID = os.getenv('AZURE_CLIENT_ID')
 AZURE_CLIENT_SECRET = os.getenv('AZURE_CLIENT_SECRET')
 AZURE_TENANT_ID = os.getenv('AZURE_TENANT_ID')
+# Access tokens shared across processes (empty path keeps them in memory only) and renewed
+# in the background this long before they expire
+TOKEN_CACHE_PATH = os.getenv('TOKEN_CACHE_PATH', '.cache/tokens.json')
+TOKEN_REFRESH_AHEAD_SECONDS = float(os.getenv('TOKEN_REFRESH_AHEAD_SECONDS', 600))
+
+# Shared HTTP connection pool: connections per host (0 = twice the worker count), keep-alive
+# and per-request connect/read timeouts
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 0))
+HTTP_KEEP_ALIVE = os.getenv('HTTP_KEEP_ALIVE', 'true').lower() == 'true'
+HTTP_CONNECTION_TIMEOUT_SECONDS = float(os.getenv('HTTP_CONNECTION_TIMEOUT_SECONDS', 10))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv('HTTP_READ_TIMEOUT_SECONDS', 300))
 
 # Application settings
 DEBUG = os.getenv('DEBUG', 'false').lower() == 'true'
@@ -30,6 +59,132 @@ LOG_LEVEL = os.getenv('LOG_LEVEL', 'info')
 STREAMLIT_PORT = int(os.getenv('STREAMLIT_SERVER_PORT', 8501))
 STREAMLIT_ADDRESS = os.getenv('STREAMLIT_SERVER_ADDRESS', '0.0.0.0')
 
+# Agent concurrency and rate limits (0 disables a budget)
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', 8))
+INITIAL_WORKERS = int(os.getenv('INITIAL_WORKERS', 2))
+REQUESTS_PER_MINUTE = int(os.getenv('REQUESTS_PER_MINUTE', 0))
+TOKENS_PER_MINUTE = int(os.getenv('TOKENS_PER_MINUTE', 0))
+ESTIMATED_TOKENS_PER_REQUEST = int(os.getenv('ESTIMATED_TOKENS_PER_REQUEST', 3000))
+THROTTLE_DEFAULT_BACKOFF_SECONDS = float(os.getenv('THROTTLE_DEFAULT_BACKOFF_SECONDS', 10))
+THROTTLE_MAX_REQUEUES = int(os.getenv('THROTTLE_MAX_REQUEUES', 8))
+# Tail-latency control: per-row deadline (0 disables), retries and hedged duplicate runs
+ROW_DEADLINE_SECONDS = float(os.getenv('ROW_DEADLINE_SECONDS', 300))
+# Run completion: 'stream' waits on the run event stream, 'poll' polls run status on an
+# adaptive schedule (first poll after RUN_POLL_INITIAL_SECONDS, growing by
+# RUN_POLL_BACKOFF_FACTOR up to RUN_POLL_INTERVAL_SECONDS). Streaming falls back to polling
+# when the backend does not support it.
+RUN_COMPLETION_MODE = os.getenv('RUN_COMPLETION_MODE', 'stream').lower()
+RUN_POLL_INITIAL_SECONDS = float(os.getenv('RUN_POLL_INITIAL_SECONDS', 0.25))
+RUN_POLL_BACKOFF_FACTOR = float(os.getenv('RUN_POLL_BACKOFF_FACTOR', 1.5))
+RUN_POLL_INTERVAL_SECONDS = float(os.getenv('RUN_POLL_INTERVAL_SECONDS', 1))
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 3))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv('RETRY_BASE_DELAY_SECONDS', 2))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv('RETRY_MAX_DELAY_SECONDS', 30))
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'false').lower() == 'true'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+HEDGE_MAX_FRACTION = float(os.getenv('HEDGE_MAX_FRACTION', 0.1))
+# Agent threads: runs per thread before it is retired (1 = a fresh thread per run),
+# threads created ahead of demand per batch, and whether retired threads are deleted
+THREAD_MAX_RUNS = int(os.getenv('THREAD_MAX_RUNS', 20))
+THREAD_PREFETCH = int(os.getenv('THREAD_PREFETCH', 8))
+THREAD_DELETE_RETIRED = os.getenv('THREAD_DELETE_RETIRED', 'true').lower() == 'true'
+
+# Prompt compaction: only these columns (the fields agent_instruction.md uses) are sent to the
+# agent when the row has any of them, with values whitespace-collapsed and cut to PROMPT_MAX_VALUE_CHARS
+PROMPT_FIELDS = [f.strip() for f in os.getenv('PROMPT_FIELDS', 'Certifier,Certification Name,URL').split(',')
+                 if f.strip()]
+PROMPT_MAX_VALUE_CHARS = int(os.getenv('PROMPT_MAX_VALUE_CHARS', 200))
+# Token accounting from run usage: prices per 1,000 tokens for the cost estimate, and an optional
+# per-batch ceiling (0 disables) at which the batch either stops or slows to one run at a time
+PROMPT_TOKEN_PRICE_PER_1K = float(os.getenv('PROMPT_TOKEN_PRICE_PER_1K', 0))
+COMPLETION_TOKEN_PRICE_PER_1K = float(os.getenv('COMPLETION_TOKEN_PRICE_PER_1K', 0))
+TOKEN_BUDGET = int(os.getenv('TOKEN_BUDGET', 0))
+TOKEN_BUDGET_ACTION = os.getenv('TOKEN_BUDGET_ACTION', 'stop')
+
+# Request the reply JSON schema (response_schema.py) as strict structured output on every run,
+# and re-ask on the same thread up to REPLY_REPAIR_ATTEMPTS times when a reply is malformed
+STRUCTURED_OUTPUT = os.getenv('STRUCTURED_OUTPUT', 'false').lower() == 'true'
+REPLY_REPAIR_ATTEMPTS = int(os.getenv('REPLY_REPAIR_ATTEMPTS', 1))
+
+# Row scheduling: 'sheet' runs rows in sheet order; 'affinity' groups them by provider (certifier and
+# URL host), has one web-grounded run summarize the certificate listing of each provider with at least
+# PROVIDER_MIN_GROUP_ROWS distinct rows and shares it with the provider's other rows, interleaving
+# providers across workers. Summaries are cut to PROVIDER_CONTEXT_MAX_CHARS and kept for
+# PROVIDER_CONTEXT_TTL_SECONDS by each process.
+SCHEDULING_MODE = os.getenv('SCHEDULING_MODE', 'sheet').lower()
+PROVIDER_MIN_GROUP_ROWS = int(os.getenv('PROVIDER_MIN_GROUP_ROWS', 3))
+PROVIDER_CONTEXT_MAX_CHARS = int(os.getenv('PROVIDER_CONTEXT_MAX_CHARS', 4000))
+PROVIDER_CONTEXT_TTL_SECONDS = float(os.getenv('PROVIDER_CONTEXT_TTL_SECONDS', 3600))
+# Count the web-grounding tool calls of every run: read from run step events when streaming,
+# one run_steps.list request per run when polling
+COUNT_GROUNDING_CALLS = os.getenv('COUNT_GROUNDING_CALLS', 'true').lower() == 'true'
+
+# Distinct rows verified per agent run (1 = one row per run)
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 1))
+# Rows kept in flight by the asyncio engine (agent_api_async)
+ASYNC_MAX_CONCURRENCY = int(os.getenv('ASYNC_MAX_CONCURRENCY', 100))
+
+# Per-stage timing metrics for agent calls (see metrics.py); port 0 disables the HTTP endpoint
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_JSON_PATH = os.getenv('METRICS_JSON_PATH', '.cache/metrics.json')
+METRICS_DUMP_INTERVAL_SECONDS = float(os.getenv('METRICS_DUMP_INTERVAL_SECONDS', 30))
+METRICS_RECENT_SPANS = int(os.getenv('METRICS_RECENT_SPANS', 1000))
+
+# Checkpoint journals for resumable runs
+JOURNAL_DIR = os.getenv('JOURNAL_DIR', '.cache/journal')
+
+# Local job queue (job_queue.py) drained by job_worker.py processes: rows per leased chunk,
+# lease length (renewed every JOB_HEARTBEAT_SECONDS while a worker holds it) and attempts per chunk
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', '.cache/jobs.sqlite3')
+JOB_DIR = os.getenv('JOB_DIR', '.cache/jobs')
+JOB_CHUNK_ROWS = int(os.getenv('JOB_CHUNK_ROWS', 50))
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 120))
+JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', 15))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', 2))
+# Submit Streamlit runs to the job queue instead of running them in the Streamlit process
+UI_USE_JOB_QUEUE = os.getenv('UI_USE_JOB_QUEUE', 'false').lower() == 'true'
+
+# Streamlit results view: seconds between live table refreshes, rows per table page and
+# seconds between rebuilds of the partial-workbook download while a run is in progress
+UI_REFRESH_SECONDS = float(os.getenv('UI_REFRESH_SECONDS', 1))
+UI_PAGE_SIZE = int(os.getenv('UI_PAGE_SIZE', 50))
+UI_PARTIAL_DOWNLOAD_SECONDS = float(os.getenv('UI_PARTIAL_DOWNLOAD_SECONDS', 15))
+# Parsed uploads kept per browser session; sheets over the cell budget are streamed instead
+WORKBOOK_CACHE_MAX_ENTRIES = int(os.getenv('WORKBOOK_CACHE_MAX_ENTRIES', 3))
+WORKBOOK_CACHE_MAX_CELLS = int(os.getenv('WORKBOOK_CACHE_MAX_CELLS', 5000000))
+
+# Rows per record batch when reading and writing Parquet inputs (input_sources.py)
+INPUT_CHUNK_ROWS = int(os.getenv('INPUT_CHUNK_ROWS', 10000))
+
+# Verification result cache
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
+CACHE_PATH = os.getenv('CACHE_PATH', '.cache/verification_cache.sqlite3')
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 100000))
+CACHE_DEFAULT_TTL_DAYS = float(os.getenv('CACHE_DEFAULT_TTL_DAYS', 7))
+# TTL (in days) per remark returned by the agent; see agent_instruction.md
+CACHE_REMARK_TTL_DAYS = {
+    "Certificate exists.": float(os.getenv('CACHE_TTL_EXISTS_DAYS', 90)),
+    "Certificate exists but with a slight different name": float(os.getenv('CACHE_TTL_SLIGHT_DIFF_DAYS', 60)),
+    "Certificate has been renamed.": float(os.getenv('CACHE_TTL_RENAMED_DAYS', 60)),
+    "Certificate is expiring soon.": float(os.getenv('CACHE_TTL_EXPIRING_DAYS', 7)),
+    "Certificate not found or expired.": float(os.getenv('CACHE_TTL_NOT_FOUND_DAYS', 3)),
+}
+
+# Local catalog of previously verified certificates (build it with catalog_index.py).
+# Rows matching an entry at CATALOG_MIN_SCORE or better are answered without the agent;
+# entries older than CATALOG_MAX_AGE_DAYS (0 = never) are re-verified.
+CATALOG_ENABLED = os.getenv('CATALOG_ENABLED', 'true').lower() == 'true'
+CATALOG_PATH = os.getenv('CATALOG_PATH', '.cache/catalog_index.json.gz')
+CATALOG_MIN_SCORE = float(os.getenv('CATALOG_MIN_SCORE', 0.92))
+CATALOG_AMBIGUITY_MARGIN = float(os.getenv('CATALOG_AMBIGUITY_MARGIN', 0.03))
+CATALOG_MAX_AGE_DAYS = float(os.getenv('CATALOG_MAX_AGE_DAYS', 180))
+CATALOG_NAME_COLUMN = os.getenv('CATALOG_NAME_COLUMN', 'Certification Name')
+CATALOG_CERTIFIER_COLUMN = os.getenv('CATALOG_CERTIFIER_COLUMN', 'Certifier')
+CATALOG_URL_COLUMN = os.getenv('CATALOG_URL_COLUMN', 'URL')
+
 
 def get_config():
     """Return application configuration from environment variables."""
@@ -44,11 +199,74 @@ def get_config():
             'subscription_key': SUBSCRIPTION_KEY,
             'bing_connection_name': BING_CONNECTION_NAME,
         },
+        'agent_backend': AGENT_BACKEND,
+        'agent_registry_path': AGENT_REGISTRY_PATH,
+        'token_cache_path': TOKEN_CACHE_PATH,
+        'token_refresh_ahead_seconds': TOKEN_REFRESH_AHEAD_SECONDS,
+        'http': {
+            'pool_size': HTTP_POOL_SIZE,
+            'keep_alive': HTTP_KEEP_ALIVE,
+            'connection_timeout_seconds': HTTP_CONNECTION_TIMEOUT_SECONDS,
+            'read_timeout_seconds': HTTP_READ_TIMEOUT_SECONDS,
+        },
         'debug': DEBUG,
         'log_level': LOG_LEVEL,
         'streamlit': {
             'port': STREAMLIT_PORT,
-            'address': STREAMLIT_ADDRESS
+            'address': STREAMLIT_ADDRESS,
+            'refresh_seconds': UI_REFRESH_SECONDS,
+            'page_size': UI_PAGE_SIZE,
+            'workbook_cache_max_entries': WORKBOOK_CACHE_MAX_ENTRIES,
+            'workbook_cache_max_cells': WORKBOOK_CACHE_MAX_CELLS,
+        },
+        'concurrency': {
+            'max_workers': MAX_WORKERS,
+            'initial_workers': INITIAL_WORKERS,
+            'requests_per_minute': REQUESTS_PER_MINUTE,
+            'tokens_per_minute': TOKENS_PER_MINUTE,
+            'async_max_concurrency': ASYNC_MAX_CONCURRENCY,
+            'batch_size': BATCH_SIZE,
+            'row_deadline_seconds': ROW_DEADLINE_SECONDS,
+            'run_completion_mode': RUN_COMPLETION_MODE,
+            'retry_max_attempts': RETRY_MAX_ATTEMPTS,
+            'hedge_enabled': HEDGE_ENABLED,
+            'thread_max_runs': THREAD_MAX_RUNS,
+            'thread_prefetch': THREAD_PREFETCH,
+            'structured_output': STRUCTURED_OUTPUT,
+            'reply_repair_attempts': REPLY_REPAIR_ATTEMPTS,
+            'prompt_fields': PROMPT_FIELDS,
+            'token_budget': TOKEN_BUDGET,
+            'token_budget_action': TOKEN_BUDGET_ACTION,
+            'scheduling_mode': SCHEDULING_MODE,
+            'provider_min_group_rows': PROVIDER_MIN_GROUP_ROWS,
+            'count_grounding_calls': COUNT_GROUNDING_CALLS,
+        },
+        'journal_dir': JOURNAL_DIR,
+        'input_chunk_rows': INPUT_CHUNK_ROWS,
+        'jobs': {
+            'queue_path': JOB_QUEUE_PATH,
+            'dir': JOB_DIR,
+            'chunk_rows': JOB_CHUNK_ROWS,
+            'lease_seconds': JOB_LEASE_SECONDS,
+            'max_attempts': JOB_MAX_ATTEMPTS,
+        },
+        'metrics': {
+            'enabled': METRICS_ENABLED,
+            'port': METRICS_PORT,
+            'json_path': METRICS_JSON_PATH,
+        },
+        'catalog': {
+            'enabled': CATALOG_ENABLED,
+            'path': CATALOG_PATH,
+            'min_score': CATALOG_MIN_SCORE,
+            'max_age_days': CATALOG_MAX_AGE_DAYS,
+        },
+        'cache': {
+            'enabled': CACHE_ENABLED,
+            'path': CACHE_PATH,
+            'max_entries': CACHE_MAX_ENTRIES,
+            'default_ttl_days': CACHE_DEFAULT_TTL_DAYS,
+            'remark_ttl_days': CACHE_REMARK_TTL_DAYS,
         }
     }
     return config
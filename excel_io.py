@@ -0,0 +1,262 @@
+"""
+Streaming, constant-memory Excel reading and writing.
+
+Workbooks are opened in openpyxl read-only mode and consumed row by row, and
+output workbooks are produced in write-only mode, so neither the input sheet
+nor the output sheet is ever materialized in memory as a whole.
+
+Interactive callers that re-read the same upload many times (Streamlit
+re-executes the whole script on every widget change) can parse a sheet once
+with ``parse_sheet`` and keep it in a ``WorkbookCache`` keyed by content hash.
+"""
+
+import threading
+from collections import Counter, OrderedDict
+
+import openpyxl
+
+import config
+
+
+def _rewind(source):
+    """Rewind file-like sources (e.g. Streamlit uploads) so they can be read again."""
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def open_sheet(source, sheet_name=None):
+    """Open a workbook in read-only mode and return (workbook, worksheet)."""
+    _rewind(source)
+    wb = openpyxl.load_workbook(source, read_only=True)
+    ws = wb[sheet_name] if sheet_name else wb.active
+    return wb, ws
+
+
+def sheet_names(source):
+    """Names of the worksheets of a workbook, in workbook order."""
+    _rewind(source)
+    wb = openpyxl.load_workbook(source, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def read_headers(source, sheet_name=None):
+    """Return the header row of a sheet as a tuple, or an empty tuple for an empty sheet."""
+    wb, ws = open_sheet(source, sheet_name)
+    try:
+        for row in ws.iter_rows(min_row=1, max_row=1, values_only=True):
+            return tuple(row)
+        return ()
+    finally:
+        wb.close()
+
+
+def iter_row_dicts(source, columns, start_row=2, end_row=None, sheet_name=None):
+    """
+    Stream rows of a sheet as dicts limited to the selected columns.
+
+    Args:
+        source: Path or file-like object of the workbook
+        columns: Header names to keep in each row dict
+        start_row: First 1-based sheet row to yield (inclusive)
+        end_row: Last 1-based sheet row to yield (inclusive), or None for the rest of the sheet
+        sheet_name: Sheet to read; the active sheet when omitted
+
+    Yields:
+        Tuples of (row_number, row_dict)
+    """
+    wb, ws = open_sheet(source, sheet_name)
+    try:
+        headers = None
+        for row in ws.iter_rows(min_row=1, max_row=1, values_only=True):
+            headers = row
+        if headers is None:
+            return
+        wanted = [(i, header) for i, header in enumerate(headers) if header in columns]
+        rows = ws.iter_rows(min_row=max(start_row, 2), max_row=end_row, values_only=True)
+        for row_number, row in enumerate(rows, start=max(start_row, 2)):
+            yield row_number, {header: (row[i] if i < len(row) else None) for i, header in wanted}
+    finally:
+        wb.close()
+
+
+def _copy_sheet(ws_in, wb_out, results_by_row, column_map, add_columns=False):
+    """Append a copy of ``ws_in`` to ``wb_out`` with results merged into the mapped columns."""
+    ws_out = wb_out.create_sheet(title=ws_in.title)
+    targets = {}
+    for row_number, row in enumerate(ws_in.iter_rows(values_only=True), start=1):
+        if row_number == 1:
+            if add_columns and results_by_row:
+                row = tuple(row) + tuple(h for h in column_map if h not in row)
+            targets = {i: column_map[h] for i, h in enumerate(row) if h in column_map}
+            ws_out.append(row)
+            continue
+        result = results_by_row.get(row_number)
+        if result is not None:
+            width = max([len(row)] + [i + 1 for i in targets])
+            row = list(row) + [None] * (width - len(row))
+            for i, key in targets.items():
+                row[i] = result.get(key)
+        ws_out.append(row)
+
+
+def write_results(source, output_path, results_by_row, column_map, sheet_name=None):
+    """
+    Stream a copy of a workbook to a new workbook with agent results merged into one sheet.
+
+    Every sheet is copied; only ``sheet_name`` receives results. The output is
+    written in write-only mode, so cell styles of the original workbook are not
+    carried over; values are.
+
+    Args:
+        source: Path or file-like object of the original workbook
+        output_path: Path or file-like object to save the updated workbook to
+        results_by_row: Dict mapping 1-based sheet row numbers to agent result dicts
+        column_map: Dict mapping a header name to the result key written into that column
+        sheet_name: Sheet receiving the results; the active sheet when omitted
+    """
+    write_workbook_results(source, output_path, {sheet_name: results_by_row}, column_map)
+
+
+def write_workbook_results(source, output_path, results_by_sheet, column_map, add_columns=False):
+    """
+    Stream a copy of every sheet of a workbook with agent results merged into several sheets.
+
+    Args:
+        source: Path or file-like object of the original workbook
+        output_path: Path or file-like object to save the updated workbook to
+        results_by_sheet: Dict mapping a sheet name (None for the active sheet) to
+            {sheet row number: result}; other sheets are copied unchanged
+        column_map: Dict mapping a header name to the result key written into that column
+        add_columns: Append mapped headers missing from a sheet that receives results
+    """
+    _rewind(source)
+    wb_in = openpyxl.load_workbook(source, read_only=True)
+    wb_out = openpyxl.Workbook(write_only=True)
+    try:
+        if None in results_by_sheet:
+            results_by_sheet = dict(results_by_sheet)
+            results_by_sheet[wb_in.active.title] = results_by_sheet.pop(None)
+        for ws_in in wb_in.worksheets:
+            _copy_sheet(ws_in, wb_out, results_by_sheet.get(ws_in.title, {}), column_map, add_columns)
+        wb_out.active = wb_in.worksheets.index(wb_in.active)
+    finally:
+        wb_in.close()
+    wb_out.save(output_path)
+
+
+class ParsedSheet:
+    """Headers, row values and per-column type hints of one sheet, held in memory."""
+
+    def __init__(self, headers, rows, sheet_name=None):
+        self.headers = tuple(headers)
+        self.rows = rows
+        self.sheet_name = sheet_name
+        self.cells = len(self.headers) * (len(rows) + 1)
+        self.column_types = self._column_types()
+
+    def _column_types(self):
+        types = {}
+        for i, header in enumerate(self.headers):
+            counts = Counter(type(row[i]).__name__ for row in self.rows if i < len(row) and row[i] is not None)
+            types[header] = counts.most_common(1)[0][0] if counts else "empty"
+        return types
+
+    def iter_row_dicts(self, columns, start_row=2, end_row=None):
+        """Same contract as excel_io.iter_row_dicts, served from memory."""
+        wanted = [(i, header) for i, header in enumerate(self.headers) if header in columns]
+        first = max(start_row, 2)
+        last = len(self.rows) + 1 if end_row is None else min(end_row, len(self.rows) + 1)
+        for row_number in range(first, last + 1):
+            row = self.rows[row_number - 2]
+            yield row_number, {header: (row[i] if i < len(row) else None) for i, header in wanted}
+
+
+def parse_sheet(source, sheet_name=None, max_cells=None):
+    """
+    Read a whole sheet into a ParsedSheet.
+
+    Args:
+        source: Path or file-like object of the workbook
+        sheet_name: Sheet to read; the active sheet when omitted
+        max_cells: Give up (return None) once the sheet exceeds this many cells
+
+    Returns:
+        ParsedSheet, or None if the sheet is empty or larger than max_cells
+    """
+    wb, ws = open_sheet(source, sheet_name)
+    try:
+        rows = ws.iter_rows(values_only=True)
+        headers = next(rows, None)
+        if headers is None:
+            return None
+        body = []
+        cells = len(headers)
+        for row in rows:
+            cells += len(headers)
+            if max_cells and cells > max_cells:
+                return None
+            body.append(row)
+        return ParsedSheet(headers, body, ws.title)
+    finally:
+        wb.close()
+
+
+class WorkbookCache:
+    """LRU of ParsedSheets keyed by workbook content hash, bounded by entries and total cells."""
+
+    def __init__(self, max_entries=None, max_cells=None):
+        self.max_entries = max_entries or config.WORKBOOK_CACHE_MAX_ENTRIES
+        self.max_cells = max_cells or config.WORKBOOK_CACHE_MAX_CELLS
+        self._sheets = OrderedDict()
+        # Keys of sheets found empty or too large, so later calls skip parsing them again
+        self._unparsable = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, wb_hash, source, sheet_name=None):
+        """
+        Return the parsed sheet for a workbook, parsing it on first use.
+
+        Args:
+            wb_hash: Content hash of the workbook (run_journal.workbook_hash)
+            source: Path or file-like object to parse on a miss
+            sheet_name: Sheet to read; the active sheet when omitted
+
+        Returns:
+            ParsedSheet, or None if the sheet is empty or too large to cache
+        """
+        key = (wb_hash, sheet_name)
+        with self._lock:
+            if key in self._sheets:
+                self.hits += 1
+                self._sheets.move_to_end(key)
+                return self._sheets[key]
+            if key in self._unparsable:
+                self.hits += 1
+                self._unparsable.move_to_end(key)
+                return None
+            self.misses += 1
+        parsed = parse_sheet(source, sheet_name, max_cells=self.max_cells)
+        if parsed is None:
+            with self._lock:
+                self._unparsable[key] = True
+                while len(self._unparsable) > self.max_entries:
+                    self._unparsable.popitem(last=False)
+            return None
+        with self._lock:
+            self._sheets[key] = parsed
+            self._sheets.move_to_end(key)
+            # Evict the least recently used uploads first, never the one just parsed
+            while len(self._sheets) > 1 and (len(self._sheets) > self.max_entries or
+                                             sum(p.cells for p in self._sheets.values()) > self.max_cells):
+                self._sheets.popitem(last=False)
+        return parsed
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._sheets), "cells": sum(p.cells for p in self._sheets.values()),
+                    "hits": self.hits, "misses": self.misses}
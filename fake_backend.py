@@ -0,0 +1,537 @@
+"""
+Local stand-in for the Azure AI Projects agent service.
+
+The fake clients expose the small part of ``AIProjectClient.agents`` that the
+mapper uses (agents, threads, messages, runs) and answer every run with a
+verification result after an injected latency. Failure, throttling and
+malformed-JSON rates can be dialled in, so the execution engines can be
+exercised and benchmarked without network access. Runs that would search the
+web (any run not answering from a provider summary or repairing a reply)
+report one ``bing_grounding`` tool call step and take the extra grounding
+latency.
+
+Select it for the whole app with ``AGENT_BACKEND=fake`` (see config.py).
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import config
+from provider_context import PROVIDER_CONTEXT_HEADER
+
+
+def constant_latency(seconds):
+    """Latency model that always waits ``seconds``."""
+    return lambda: seconds
+
+
+def uniform_latency(low, high):
+    """Latency model drawing uniformly between ``low`` and ``high`` seconds."""
+    return lambda: random.uniform(low, high)
+
+
+def lognormal_latency(median, sigma=0.5):
+    """Heavy-tailed latency model with the given median (seconds) and log-space sigma."""
+    import math
+    mu = math.log(median)
+    return lambda: random.lognormvariate(mu, sigma)
+
+
+LATENCY_MODELS = {
+    "constant": lambda median: constant_latency(median),
+    "uniform": lambda median: uniform_latency(median * 0.5, median * 1.5),
+    "lognormal": lambda median: lognormal_latency(median),
+}
+
+
+def latency_model(name, median):
+    """Build a latency model by name ('constant', 'uniform' or 'lognormal')."""
+    try:
+        return LATENCY_MODELS[name](median)
+    except KeyError:
+        raise ValueError(f"Unknown latency model '{name}', expected one of {sorted(LATENCY_MODELS)}")
+
+
+def _fake_result(row_text):
+    match = re.search(r"Certification Name: ([^,]*)", row_text)
+    name = match.group(1).strip() if match else ""
+    return {"newCertificateName": name, "remark": "Certificate exists."}
+
+
+def fake_reply(content):
+    """Build the assistant reply the real agent would give for a user message."""
+    batch_lines = re.findall(r"^id=(\d+); (.*)$", content, re.MULTILINE)
+    if batch_lines:
+        return json.dumps([dict(id=int(row_id), **_fake_result(text)) for row_id, text in batch_lines])
+    return json.dumps(_fake_result(content))
+
+
+def estimate_tokens(text):
+    """Rough token count of a text (about four characters per token)."""
+    return max(1, len(text or "") // 4)
+
+
+def _grounding_step(run):
+    tool_call = SimpleNamespace(id=f"call_{run.id}", type="bing_grounding")
+    return SimpleNamespace(id=f"step_{run.id}", run_id=run.id, thread_id=run.thread_id, type="tool_calls",
+                           status="completed",
+                           step_details=SimpleNamespace(type="tool_calls", tool_calls=[tool_call]))
+
+
+def _text_message(role, text, run_id=None):
+    return SimpleNamespace(role=role, run_id=run_id,
+                           content=[SimpleNamespace(text=SimpleNamespace(value=text))])
+
+
+class _FakeState:
+    """Threads, fault injection and call counters shared by the sync and async fake clients."""
+
+    def __init__(self, latency, failure_rate=0.0, throttle_rate=0.0, malformed_rate=0.0, seed=None,
+                 request_latency=0.0, grounding_latency=0.0):
+        self.latency = latency if callable(latency) else constant_latency(latency)
+        self.request_latency = request_latency
+        self.grounding_latency = grounding_latency
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.threads = {}
+        self.runs = {}
+        self.run_steps = {}
+        self.agents = {}
+        self.calls = {"create_agent": 0, "get_agent": 0, "list_agents": 0, "delete_agent": 0,
+                      "threads.create": 0, "threads.delete": 0, "messages.create": 0,
+                      "runs.create_and_process": 0, "runs.create": 0, "runs.get": 0,
+                      "runs.cancel": 0, "runs.stream": 0, "messages.list": 0, "run_steps.list": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def new_id(self, prefix):
+        return f"{prefix}_{next(self.ids)}"
+
+    def new_agent(self, name, model=None, instructions=None, metadata=None):
+        agent = SimpleNamespace(id=self.new_id("asst"), name=name, model=model, instructions=instructions,
+                                metadata=dict(metadata or {}), created_at=time.time())
+        with self._lock:
+            self.agents[agent.id] = agent
+        return agent
+
+    def get_agent(self, agent_id):
+        with self._lock:
+            if agent_id not in self.agents:
+                raise KeyError(f"No agent found with id '{agent_id}'")
+            return self.agents[agent_id]
+
+    def list_agents(self):
+        with self._lock:
+            return sorted(self.agents.values(), key=lambda agent: agent.created_at, reverse=True)
+
+    def delete_agent(self, agent_id):
+        with self._lock:
+            self.agents.pop(agent_id, None)
+        return SimpleNamespace(id=agent_id, deleted=True)
+
+    def new_thread(self):
+        thread_id = self.new_id("thread")
+        with self._lock:
+            self.threads[thread_id] = []
+        return SimpleNamespace(id=thread_id)
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            del self.threads[thread_id]
+
+    def add_message(self, thread_id, role, content, run_id=None):
+        message = _text_message(role, content, run_id)
+        with self._lock:
+            self.threads[thread_id].append(message)
+        return message
+
+    def messages(self, thread_id, run_id=None):
+        with self._lock:
+            messages = list(reversed(self.threads[thread_id]))
+        if run_id is not None:
+            messages = [m for m in messages if m.run_id == run_id]
+        return messages
+
+    def new_run(self, thread_id, agent_id, tool_choice=None):
+        with self._lock:
+            user_messages = [m for m in self.threads[thread_id] if m.role == "user"]
+        newest = user_messages[-1].content[0].text.value if user_messages else ""
+        # The agent searches unless it may not use tools or was handed its provider's listing
+        grounding_calls = 0 if tool_choice == "none" or newest.startswith(PROVIDER_CONTEXT_HEADER) else 1
+        run = SimpleNamespace(id=self.new_id("run"), thread_id=thread_id, agent_id=agent_id,
+                              status="in_progress", last_error=None, ready_at=None, tool_choice=tool_choice,
+                              usage=None, grounding_calls=grounding_calls)
+        with self._lock:
+            self.runs[run.id] = run
+        return run
+
+    def run_latency(self, run):
+        """Latency of one run: the latency model plus the grounding latency of each web search."""
+        return self.latency() + self.grounding_latency * run.grounding_calls
+
+    def steps(self, run_id):
+        with self._lock:
+            return list(self.run_steps.get(run_id, ()))
+
+    def complete(self, run):
+        """Finish a run, applying the configured fault rates."""
+        with self._lock:
+            draw = self.random.random()
+            # Like a run on a reused thread with truncation, only the newest user message counts;
+            # a repair run (no tools) restates the answer to the row message before it
+            user_messages = [m for m in self.threads[run.thread_id] if m.role == "user"]
+            newest = -2 if run.tool_choice == "none" and len(user_messages) > 1 else -1
+            content = user_messages[newest].content[0].text.value
+            agent = self.agents.get(run.agent_id)
+            prompt = (getattr(agent, "instructions", None) or "") + "".join(
+                m.content[0].text.value for m in user_messages[newest:])
+        if draw < self.throttle_rate:
+            run.status = "failed"
+            run.last_error = SimpleNamespace(
+                code="rate_limit_exceeded",
+                message="Rate limit is exceeded. Try again in 1 seconds.",
+            )
+            return run
+        draw -= self.throttle_rate
+        if draw < self.failure_rate:
+            run.status = "failed"
+            run.last_error = SimpleNamespace(code="server_error", message="Sorry, something went wrong.")
+            return run
+        draw -= self.failure_rate
+        reply = "I could not format that as JSON, sorry." if draw < self.malformed_rate else fake_reply(content)
+        with self._lock:
+            self.run_steps[run.id] = [_grounding_step(run) for _ in range(run.grounding_calls)]
+        self.add_message(run.thread_id, "assistant", reply, run.id)
+        completion_tokens = estimate_tokens(reply)
+        run.usage = SimpleNamespace(prompt_tokens=estimate_tokens(prompt), completion_tokens=completion_tokens,
+                                    total_tokens=estimate_tokens(prompt) + completion_tokens)
+        run.status = "completed"
+        return run
+
+    def stream_events(self, run):
+        """Events the service emits once a run finishes: its steps, the assistant message, then the run."""
+        snapshot = SimpleNamespace(**vars(run))
+        if run.status != "completed":
+            return [(f"thread.run.{run.status}", snapshot, None), ("done", "[DONE]", None)]
+        with self._lock:
+            message = self.threads[run.thread_id][-1]
+        steps = [("thread.run.step.completed", step, None) for step in self.steps(run.id)]
+        return steps + [("thread.message.completed", message, None),
+                        ("thread.run.completed", snapshot, None),
+                        ("done", "[DONE]", None)]
+
+    def poll(self, run_id):
+        """Return a snapshot of a background run, completing it once its latency has elapsed."""
+        with self._lock:
+            run = self.runs[run_id]
+        if run.status == "in_progress" and time.monotonic() >= run.ready_at:
+            self.complete(run)
+        return SimpleNamespace(**vars(run))
+
+
+class _FakeRunStream:
+    """Context manager standing in for ``AgentRunStream``; iterating it yields (event_type, data, None)."""
+
+    def __init__(self, state, thread_id, agent_id, tool_choice=None):
+        self._state = state
+        self._run = state.new_run(thread_id, agent_id, tool_choice)
+
+    def __enter__(self):
+        return self._events()
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def _events(self):
+        run = self._run
+        yield "thread.run.created", SimpleNamespace(**vars(run)), None
+        time.sleep(self._state.run_latency(run))
+        if run.status == "in_progress":
+            self._state.complete(run)
+        yield from self._state.stream_events(run)
+
+
+class _FakeThreads:
+    def __init__(self, state):
+        self._state = state
+
+    def create(self, **kwargs):
+        self._state.count("threads.create")
+        time.sleep(self._state.request_latency)
+        return self._state.new_thread()
+
+    def delete(self, thread_id, **kwargs):
+        self._state.count("threads.delete")
+        time.sleep(self._state.request_latency)
+        self._state.delete_thread(thread_id)
+
+
+class _FakeMessages:
+    def __init__(self, state):
+        self._state = state
+
+    def create(self, thread_id, role, content, **kwargs):
+        self._state.count("messages.create")
+        time.sleep(self._state.request_latency)
+        return self._state.add_message(thread_id, role, content)
+
+    def list(self, thread_id, run_id=None, **kwargs):
+        self._state.count("messages.list")
+        time.sleep(self._state.request_latency)
+        return self._state.messages(thread_id, run_id)
+
+
+class _FakeRuns:
+    def __init__(self, state):
+        self._state = state
+
+    def create_and_process(self, thread_id, agent_id, **kwargs):
+        self._state.count("runs.create_and_process")
+        run = self._state.new_run(thread_id, agent_id, kwargs.get("tool_choice"))
+        time.sleep(self._state.run_latency(run))
+        return self._state.complete(run)
+
+    def create(self, thread_id, agent_id, **kwargs):
+        self._state.count("runs.create")
+        run = self._state.new_run(thread_id, agent_id, kwargs.get("tool_choice"))
+        run.ready_at = time.monotonic() + self._state.run_latency(run)
+        return SimpleNamespace(**vars(run))
+
+    def get(self, thread_id, run_id, **kwargs):
+        self._state.count("runs.get")
+        return self._state.poll(run_id)
+
+    def cancel(self, thread_id, run_id, **kwargs):
+        self._state.count("runs.cancel")
+        run = self._state.runs[run_id]
+        if run.status == "in_progress":
+            run.status = "cancelled"
+        return SimpleNamespace(**vars(run))
+
+    def stream(self, thread_id, agent_id, **kwargs):
+        self._state.count("runs.stream")
+        return _FakeRunStream(self._state, thread_id, agent_id, kwargs.get("tool_choice"))
+
+
+class _FakeRunSteps:
+    def __init__(self, state):
+        self._state = state
+
+    def list(self, thread_id, run_id, **kwargs):
+        self._state.count("run_steps.list")
+        time.sleep(self._state.request_latency)
+        return self._state.steps(run_id)
+
+
+class _FakeAgents:
+    def __init__(self, state):
+        self._state = state
+        self.threads = _FakeThreads(state)
+        self.messages = _FakeMessages(state)
+        self.runs = _FakeRuns(state)
+        self.run_steps = _FakeRunSteps(state)
+
+    def create_agent(self, model=None, name=None, instructions=None, tools=None, metadata=None, **kwargs):
+        self._state.count("create_agent")
+        return self._state.new_agent(name, model, instructions, metadata)
+
+    def get_agent(self, agent_id, **kwargs):
+        self._state.count("get_agent")
+        return self._state.get_agent(agent_id)
+
+    def list_agents(self, **kwargs):
+        self._state.count("list_agents")
+        return self._state.list_agents()
+
+    def delete_agent(self, agent_id, **kwargs):
+        self._state.count("delete_agent")
+        return self._state.delete_agent(agent_id)
+
+
+class FakeProjectClient:
+    """Sync drop-in for ``azure.ai.projects.AIProjectClient`` with injected latency and faults."""
+
+    def __init__(self, latency=0.5, failure_rate=0.0, throttle_rate=0.0, malformed_rate=0.0, seed=None,
+                 request_latency=0.0, grounding_latency=0.0):
+        self.state = _FakeState(latency, failure_rate, throttle_rate, malformed_rate, seed, request_latency,
+                                grounding_latency)
+        self.agents = _FakeAgents(self.state)
+
+    @classmethod
+    def from_config(cls):
+        """Build a fake client from the FAKE_* settings in config.py."""
+        return cls(
+            latency=latency_model(config.FAKE_LATENCY_MODEL, config.FAKE_LATENCY_SECONDS),
+            failure_rate=config.FAKE_FAILURE_RATE,
+            throttle_rate=config.FAKE_THROTTLE_RATE,
+            malformed_rate=config.FAKE_MALFORMED_RATE,
+            request_latency=config.FAKE_REQUEST_LATENCY_SECONDS,
+            grounding_latency=config.FAKE_GROUNDING_LATENCY_SECONDS,
+        )
+
+    @property
+    def calls(self):
+        return self.state.calls
+
+    def close(self):
+        pass
+
+
+class _AsyncItemList:
+    def __init__(self, messages):
+        self._messages = messages
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for message in self._messages:
+            yield message
+
+
+class _FakeAsyncRunStream:
+    """Async counterpart of _FakeRunStream (``async with await runs.stream(...)``)."""
+
+    def __init__(self, state, thread_id, agent_id, tool_choice=None):
+        self._state = state
+        self._run = state.new_run(thread_id, agent_id, tool_choice)
+
+    async def __aenter__(self):
+        return self._events()
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def _events(self):
+        run = self._run
+        yield "thread.run.created", SimpleNamespace(**vars(run)), None
+        await asyncio.sleep(self._state.run_latency(run))
+        if run.status == "in_progress":
+            self._state.complete(run)
+        for event in self._state.stream_events(run):
+            yield event
+
+
+class _FakeAsyncThreads:
+    def __init__(self, state):
+        self._state = state
+
+    async def create(self, **kwargs):
+        self._state.count("threads.create")
+        await asyncio.sleep(self._state.request_latency)
+        return self._state.new_thread()
+
+    async def delete(self, thread_id, **kwargs):
+        self._state.count("threads.delete")
+        await asyncio.sleep(self._state.request_latency)
+        self._state.delete_thread(thread_id)
+
+
+class _FakeAsyncMessages:
+    def __init__(self, state):
+        self._state = state
+
+    async def create(self, thread_id, role, content, **kwargs):
+        self._state.count("messages.create")
+        await asyncio.sleep(self._state.request_latency)
+        return self._state.add_message(thread_id, role, content)
+
+    def list(self, thread_id, run_id=None, **kwargs):
+        self._state.count("messages.list")
+        return _AsyncItemList(self._state.messages(thread_id, run_id))
+
+
+class _FakeAsyncRuns:
+    def __init__(self, state):
+        self._state = state
+
+    async def create_and_process(self, thread_id, agent_id, **kwargs):
+        self._state.count("runs.create_and_process")
+        run = self._state.new_run(thread_id, agent_id, kwargs.get("tool_choice"))
+        await asyncio.sleep(self._state.run_latency(run))
+        return self._state.complete(run)
+
+    async def stream(self, thread_id, agent_id, **kwargs):
+        self._state.count("runs.stream")
+        return _FakeAsyncRunStream(self._state, thread_id, agent_id, kwargs.get("tool_choice"))
+
+
+class _FakeAsyncRunSteps:
+    def __init__(self, state):
+        self._state = state
+
+    def list(self, thread_id, run_id, **kwargs):
+        self._state.count("run_steps.list")
+        return _AsyncItemList(self._state.steps(run_id))
+
+
+class _FakeAsyncAgents:
+    def __init__(self, state):
+        self._state = state
+        self.threads = _FakeAsyncThreads(state)
+        self.messages = _FakeAsyncMessages(state)
+        self.runs = _FakeAsyncRuns(state)
+        self.run_steps = _FakeAsyncRunSteps(state)
+
+    async def create_agent(self, model=None, name=None, instructions=None, tools=None, metadata=None, **kwargs):
+        self._state.count("create_agent")
+        return self._state.new_agent(name, model, instructions, metadata)
+
+    async def get_agent(self, agent_id, **kwargs):
+        self._state.count("get_agent")
+        return self._state.get_agent(agent_id)
+
+    def list_agents(self, **kwargs):
+        self._state.count("list_agents")
+        return _AsyncItemList(self._state.list_agents())
+
+    async def delete_agent(self, agent_id, **kwargs):
+        self._state.count("delete_agent")
+        return self._state.delete_agent(agent_id)
+
+
+class FakeAsyncProjectClient:
+    """Async drop-in for ``azure.ai.projects.aio.AIProjectClient`` with injected latency and faults."""
+
+    def __init__(self, latency=0.5, failure_rate=0.0, throttle_rate=0.0, malformed_rate=0.0, seed=None,
+                 request_latency=0.0, grounding_latency=0.0):
+        self.state = _FakeState(latency, failure_rate, throttle_rate, malformed_rate, seed, request_latency,
+                                grounding_latency)
+        self.agents = _FakeAsyncAgents(self.state)
+
+    @classmethod
+    def from_config(cls):
+        """Build a fake async client from the FAKE_* settings in config.py."""
+        return cls(
+            latency=latency_model(config.FAKE_LATENCY_MODEL, config.FAKE_LATENCY_SECONDS),
+            failure_rate=config.FAKE_FAILURE_RATE,
+            throttle_rate=config.FAKE_THROTTLE_RATE,
+            malformed_rate=config.FAKE_MALFORMED_RATE,
+            request_latency=config.FAKE_REQUEST_LATENCY_SECONDS,
+            grounding_latency=config.FAKE_GROUNDING_LATENCY_SECONDS,
+        )
+
+    @property
+    def calls(self):
+        return self.state.calls
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,142 @@
+"""
+One pooled HTTP transport for every agent call of a process.
+
+By default each Azure SDK client gets a requests session whose urllib3 pool
+keeps 10 connections per host. With more worker threads than that, the extra
+connections are opened for a single request and discarded when it returns,
+so each of those requests pays for a TCP connect and TLS handshake. Here all
+agent calls share one session whose pool is sized to the worker count:
+config.HTTP_POOL_SIZE connections, or twice max_workers when that is 0, which
+leaves room for hedged runs, cancels and thread create-ahead. The pool grows
+when a later batch runs with more workers. Connections are kept alive between
+requests (config.HTTP_KEEP_ALIVE), and connect and read timeouts apply to
+every request.
+
+``stats`` reports requests and opened connections, so connection reuse can be
+checked. The counters are also published through metrics.register_counters.
+"""
+
+import threading
+
+import config
+import metrics
+
+# Distinct hosts kept in the pool manager: the project endpoint plus the odd redirect or sign-in host
+POOLED_HOSTS = 4
+
+_lock = threading.Lock()
+_session = None
+_adapter = None
+_pool_size = 0
+# Counts of adapters replaced when the pool grew
+_retired = {"connections": 0, "requests": 0}
+
+
+def pool_size(max_workers=None):
+    """Connections kept per host for ``max_workers`` concurrent agent calls."""
+    return config.HTTP_POOL_SIZE or 2 * max(1, max_workers or config.MAX_WORKERS)
+
+
+def _pool_counts(adapter):
+    connections = requests = 0
+    pools = adapter.poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None:
+            connections += pool.num_connections
+            requests += pool.num_requests
+    return connections, requests
+
+
+def _new_adapter(size):
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # Retries and redirects are left to the SDK pipeline, as with its own default session
+    return HTTPAdapter(pool_connections=POOLED_HOSTS, pool_maxsize=size,
+                       max_retries=Retry(total=False, redirect=False, raise_on_status=False))
+
+
+def get_session(max_workers=None):
+    """
+    The process-wide requests session, its pool grown to fit ``max_workers`` concurrent calls.
+
+    Args:
+        max_workers: Concurrent agent calls to size the pool for (config.MAX_WORKERS when omitted)
+    """
+    global _session, _adapter, _pool_size
+    size = pool_size(max_workers)
+    with _lock:
+        if _session is None:
+            import requests
+
+            _session = requests.Session()
+            if not config.HTTP_KEEP_ALIVE:
+                _session.headers["Connection"] = "close"
+            metrics.register_counters("http", stats)
+        if size > _pool_size:
+            if _adapter is not None:
+                connections, requests = _pool_counts(_adapter)
+                _retired["connections"] += connections
+                _retired["requests"] += requests
+                # Idle connections close now, connections in use when they are returned
+                _adapter.close()
+            _adapter = _new_adapter(size)
+            _session.mount("https://", _adapter)
+            _session.mount("http://", _adapter)
+            _pool_size = size
+        return _session
+
+
+def get_transport(max_workers=None):
+    """An azure-core RequestsTransport over the shared session, with the configured timeouts."""
+    from azure.core.pipeline.transport import RequestsTransport
+
+    return RequestsTransport(
+        session=get_session(max_workers),
+        session_owner=False,
+        connection_timeout=config.HTTP_CONNECTION_TIMEOUT_SECONDS,
+        read_timeout=config.HTTP_READ_TIMEOUT_SECONDS,
+    )
+
+
+def get_async_transport(max_concurrency=None):
+    """
+    An azure-core AioHttpTransport whose connector is sized to ``max_concurrency`` requests.
+
+    Must be called with the event loop that will use it running.
+    """
+    import aiohttp
+    from azure.core.pipeline.transport import AioHttpTransport
+
+    limit = config.HTTP_POOL_SIZE or 2 * max(1, max_concurrency or config.ASYNC_MAX_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit,
+                                     force_close=not config.HTTP_KEEP_ALIVE)
+    session = aiohttp.ClientSession(connector=connector)
+    # The transport owns the session so closing the client closes the connector
+    return AioHttpTransport(
+        session=session,
+        session_owner=True,
+        connection_timeout=config.HTTP_CONNECTION_TIMEOUT_SECONDS,
+        read_timeout=config.HTTP_READ_TIMEOUT_SECONDS,
+    )
+
+
+def stats():
+    """
+    Requests sent and connections opened through the shared session.
+
+    Returns:
+        Dict with http_pool_size, http_requests, http_connections_opened and
+        http_connections_reused (requests that found an open connection)
+    """
+    with _lock:
+        connections, requests = _pool_counts(_adapter) if _adapter is not None else (0, 0)
+        connections += _retired["connections"]
+        requests += _retired["requests"]
+        return {
+            "http_pool_size": _pool_size,
+            "http_requests": requests,
+            "http_connections_opened": connections,
+            "http_connections_reused": max(requests - connections, 0),
+        }
@@ -0,0 +1,314 @@
+"""
+Multi-file, multi-sheet input for one verification batch.
+
+Workbooks (every sheet or selected ones), CSV files and Parquet files are
+described as ``Source`` tables and read into a single stream of
+(provenance, row_dict) pairs, so rows from all of them go through one
+process_rows_with_progress batch and deduplicate against each other. The
+provenance (file, sheet, row) records where each row came from; afterwards
+``write_outputs`` merges the results back into a copy of every input file in
+that file's own format.
+
+Every format is streamed: workbooks through excel_io's read-only and
+write-only modes, CSV files record by record, and Parquet files in record
+batches of config.INPUT_CHUNK_ROWS rows holding only the selected columns.
+Row numbers follow the sheet convention for all formats: the header is row 1
+and the first data row is row 2. Parquet support needs the optional pyarrow
+package.
+"""
+
+import csv
+import io
+import os
+from collections import namedtuple
+
+import config
+from excel_io import iter_row_dicts, read_headers, sheet_names, write_workbook_results
+
+SOURCE_KINDS = {".xlsx": "xlsx", ".csv": "csv", ".parquet": "parquet"}
+CSV_DELIMITERS = ",;\t|"
+
+
+class Provenance(namedtuple("Provenance", ("file", "sheet", "row"))):
+    """Where a row came from: file name, sheet name ("" for CSV and Parquet) and 1-based row number."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        if self.sheet:
+            return f"{self.file} [{self.sheet}] row {self.row}"
+        return f"{self.file} row {self.row}"
+
+
+def source_kind(name):
+    """Input format of a file name ('xlsx', 'csv' or 'parquet')."""
+    kind = SOURCE_KINDS.get(os.path.splitext(str(name))[1].lower())
+    if kind is None:
+        raise ValueError(f"Unsupported input file '{name}', expected one of {sorted(SOURCE_KINDS)}")
+    return kind
+
+
+def _rewind(data):
+    if hasattr(data, "seek"):
+        data.seek(0)
+
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Reading and writing Parquet files needs the pyarrow package (pip install pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+
+class _CsvText:
+    """Text view of a CSV path or binary file-like object, leaving file-like objects open on exit."""
+
+    def __init__(self, data):
+        self._data = data
+        self._text = None
+
+    def __enter__(self):
+        if hasattr(self._data, "read"):
+            _rewind(self._data)
+            self._text = io.TextIOWrapper(self._data, encoding="utf-8-sig", newline="")
+        else:
+            self._text = open(self._data, "r", encoding="utf-8-sig", newline="")
+        return self._text
+
+    def __exit__(self, *exc_info):
+        if hasattr(self._data, "read"):
+            # Detach so closing the wrapper does not close the caller's file
+            self._text.detach()
+        else:
+            self._text.close()
+        return False
+
+
+def _csv_delimiter(text):
+    """Delimiter of a CSV file: the one of CSV_DELIMITERS occurring most often in its header line."""
+    header = text.readline()
+    text.seek(0)
+    counts = {delimiter: header.count(delimiter) for delimiter in CSV_DELIMITERS}
+    delimiter = max(counts, key=counts.get)
+    return delimiter if counts[delimiter] else ","
+
+
+class Source:
+    """One input table: a workbook sheet, a CSV file or a Parquet file."""
+
+    def __init__(self, data, name, kind=None, sheet=None):
+        """
+        Args:
+            data: Path or binary file-like object of the file
+            name: File name recorded in the provenance and used for the output file
+            kind: 'xlsx', 'csv' or 'parquet'; derived from ``name`` when omitted
+            sheet: Worksheet of a workbook (the active sheet when omitted)
+        """
+        self.data = data
+        self.name = name
+        self.kind = kind or source_kind(name)
+        self.sheet = sheet
+
+    @property
+    def label(self):
+        return f"{self.name} [{self.sheet}]" if self.sheet else self.name
+
+    def headers(self):
+        """Column names of the table."""
+        if self.kind == "xlsx":
+            return read_headers(self.data, self.sheet)
+        if self.kind == "csv":
+            with _CsvText(self.data) as text:
+                return tuple(next(csv.reader(text, delimiter=_csv_delimiter(text)), ()))
+        _, pq = _parquet()
+        _rewind(self.data)
+        return tuple(pq.ParquetFile(self.data).schema_arrow.names)
+
+    def iter_row_dicts(self, columns):
+        """
+        Stream the table's rows as dicts limited to the selected columns.
+
+        Yields:
+            Tuples of (Provenance, row_dict)
+        """
+        sheet = self.sheet or ""
+        if self.kind == "xlsx":
+            for row_number, row_dict in iter_row_dicts(self.data, columns, sheet_name=self.sheet):
+                yield Provenance(self.name, sheet, row_number), row_dict
+        elif self.kind == "csv":
+            with _CsvText(self.data) as text:
+                reader = csv.reader(text, delimiter=_csv_delimiter(text))
+                headers = next(reader, None)
+                if headers is None:
+                    return
+                wanted = [(i, header) for i, header in enumerate(headers) if header in columns]
+                for row_number, row in enumerate(reader, start=2):
+                    yield Provenance(self.name, sheet, row_number), {
+                        header: ((row[i] or None) if i < len(row) else None) for i, header in wanted}
+        else:
+            _, pq = _parquet()
+            _rewind(self.data)
+            parquet_file = pq.ParquetFile(self.data)
+            wanted = [name for name in parquet_file.schema_arrow.names if name in columns]
+            row_number = 2
+            for batch in parquet_file.iter_batches(batch_size=config.INPUT_CHUNK_ROWS, columns=wanted):
+                for row_dict in batch.to_pylist():
+                    yield Provenance(self.name, sheet, row_number), row_dict
+                    row_number += 1
+
+
+def open_sources(files, sheets=None):
+    """
+    Describe the tables of several input files.
+
+    Args:
+        files: Paths or binary file-like objects with a ``name`` (e.g. Streamlit
+            uploads) of .xlsx, .csv and .parquet files
+        sheets: Worksheets to include: None for every sheet of every workbook,
+            a list of sheet names applied to every workbook, or a dict mapping
+            a file name to its list of sheet names
+
+    Returns:
+        List of Source, one per CSV/Parquet file and per selected worksheet
+    """
+    sources = []
+    names = set()
+    for data in files:
+        file_name = os.path.basename(str(getattr(data, "name", data)))
+        stem, ext = os.path.splitext(file_name)
+        name, n = file_name, 1
+        while name in names:
+            # Two inputs with the same file name get distinct output files
+            n += 1
+            name = f"{stem}_{n}{ext}"
+        names.add(name)
+        kind = source_kind(name)
+        if kind != "xlsx":
+            sources.append(Source(data, name, kind))
+            continue
+        wanted = sheets.get(file_name) if isinstance(sheets, dict) else sheets
+        for sheet in sheet_names(data):
+            if wanted is None or sheet in wanted:
+                sources.append(Source(data, name, kind, sheet))
+    return sources
+
+
+def iter_rows(sources, columns, skip_empty=True):
+    """
+    Stream the rows of several sources as one sequence.
+
+    Args:
+        sources: List of Source
+        columns: Header names to keep in each row dict (sources keep the ones they have)
+        skip_empty: Leave out rows whose selected cells are all empty
+
+    Yields:
+        Tuples of (Provenance, row_dict)
+    """
+    for source in sources:
+        for provenance, row_dict in source.iter_row_dicts(columns):
+            if skip_empty and not any(value not in (None, "") for value in row_dict.values()):
+                continue
+            yield provenance, row_dict
+
+
+def _write_csv(data, output_path, results_by_row, column_map):
+    with _CsvText(data) as text, open(output_path, "w", encoding="utf-8", newline="") as out:
+        delimiter = _csv_delimiter(text)
+        reader = csv.reader(text, delimiter=delimiter)
+        writer = csv.writer(out, delimiter=delimiter)
+        headers = next(reader, None)
+        if headers is None:
+            return
+        headers = headers + [h for h in column_map if h not in headers]
+        targets = {i: column_map[h] for i, h in enumerate(headers) if h in column_map}
+        writer.writerow(headers)
+        for row_number, row in enumerate(reader, start=2):
+            result = results_by_row.get(row_number)
+            if result is not None:
+                row = row + [""] * (len(headers) - len(row))
+                for i, key in targets.items():
+                    value = result.get(key)
+                    row[i] = "" if value is None else value
+            writer.writerow(row)
+
+
+def _set_string_column(pa, table, header, values):
+    # Result columns are strings, so every batch has the same schema
+    column = pa.array(values, type=pa.string())
+    if header in table.column_names:
+        return table.set_column(table.column_names.index(header), header, column)
+    return table.append_column(header, column)
+
+
+def _write_parquet(data, output_path, results_by_row, column_map):
+    pa, pq = _parquet()
+    _rewind(data)
+    parquet_file = pq.ParquetFile(data)
+    writer = None
+    row_number = 2
+    try:
+        for batch in parquet_file.iter_batches(batch_size=config.INPUT_CHUNK_ROWS):
+            table = pa.Table.from_batches([batch])
+            rows = range(row_number, row_number + table.num_rows)
+            row_number += table.num_rows
+            for header, key in column_map.items():
+                existing = table.column(header).to_pylist() if header in table.column_names else [None] * len(rows)
+                values = []
+                for row, value in zip(rows, existing):
+                    result = results_by_row.get(row)
+                    value = result.get(key) if result is not None else value
+                    values.append(None if value is None else str(value))
+                table = _set_string_column(pa, table, header, values)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        # A file without rows still gets an output, with the same columns as any other
+        table = parquet_file.schema_arrow.empty_table()
+        for header in column_map:
+            table = _set_string_column(pa, table, header, [])
+        pq.write_table(table, output_path)
+
+
+def write_outputs(sources, results, column_map, output_dir=".", prefix="updated_"):
+    """
+    Write a copy of every input file with its results merged in, in the file's own format.
+
+    Workbooks keep all their sheets, with results merged into the selected ones.
+    Mapped columns a table lacks are appended to it.
+
+    Args:
+        sources: List of Source the rows were read from
+        results: Dict mapping a Provenance to its agent result dict
+        column_map: Dict mapping an output header to the result key written into that column
+        output_dir: Directory receiving the output files
+        prefix: Prepended to each input file name
+
+    Returns:
+        List of output file paths, one per input file
+    """
+    by_table = {}
+    for provenance, result in results.items():
+        by_table.setdefault((provenance.file, provenance.sheet), {})[provenance.row] = result
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = []
+    files = {}
+    for source in sources:
+        files.setdefault(source.name, source)
+    for name, source in files.items():
+        output_path = os.path.join(output_dir, prefix + name)
+        if source.kind == "xlsx":
+            results_by_sheet = {sheet: rows for (file, sheet), rows in by_table.items() if file == name}
+            write_workbook_results(source.data, output_path, results_by_sheet, column_map, add_columns=True)
+        elif source.kind == "csv":
+            _write_csv(source.data, output_path, by_table.get((name, ""), {}), column_map)
+        else:
+            _write_parquet(source.data, output_path, by_table.get((name, ""), {}), column_map)
+        outputs.append(output_path)
+    return outputs
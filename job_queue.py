@@ -0,0 +1,378 @@
+"""
+Local SQLite job queue for verification batches.
+
+A job is a workbook (copied into JOB_DIR), the row dicts to verify and where
+to write the results. Its rows are split into chunks of JOB_CHUNK_ROWS that
+workers (job_worker.py, any number of processes on the machine) lease one at
+a time, so several workers can drain one large job and small jobs are not
+stuck behind it:
+
+- chunks are handed out by job priority (higher first) and, within a
+  priority, round-robin across jobs (the job served least recently goes next)
+- a lease expires after JOB_LEASE_SECONDS without a heartbeat, and the chunk
+  of a crashed worker is handed out again
+- cancelling a job stops its queued chunks at once and its running chunks at
+  the worker's next heartbeat
+- the worker writing a job's output keeps the lease of its last chunk; if it
+  dies, the chunk is handed out again and its next holder redoes the write
+
+Row results are stored as they complete, so front ends can poll a job's
+progress and partial results, and the worker finishing the last chunk writes
+the output workbook.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+import config
+from provider_context import provider_key
+
+ACTIVE_STATUSES = ("queued", "running", "writing")
+FINAL_STATUSES = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when the job it is processing has been cancelled."""
+
+
+class JobQueue:
+    """SQLite-backed queue of jobs, their row chunks and row results, shared by every process."""
+
+    def __init__(self, path=None, job_dir=None, chunk_rows=None, lease_seconds=None):
+        self.path = path or config.JOB_QUEUE_PATH
+        self.job_dir = job_dir or config.JOB_DIR
+        self.chunk_rows = chunk_rows or config.JOB_CHUNK_ROWS
+        self.lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        os.makedirs(self.job_dir, exist_ok=True)
+        # Autocommit mode; multi-statement updates take the write lock with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                workbook_path TEXT NOT NULL,
+                sheet TEXT,
+                column_map TEXT NOT NULL,
+                options TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                completed INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                last_scheduled_at REAL NOT NULL DEFAULT 0,
+                output_path TEXT,
+                error TEXT,
+                stats TEXT
+            );
+            CREATE TABLE IF NOT EXISTS job_rows (
+                job_id TEXT NOT NULL,
+                row_number INTEGER NOT NULL,
+                chunk INTEGER NOT NULL,
+                row TEXT NOT NULL,
+                result TEXT,
+                completed_at REAL,
+                PRIMARY KEY (job_id, row_number)
+            );
+            CREATE TABLE IF NOT EXISTS job_chunks (
+                job_id TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                leased_until REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (job_id, chunk)
+            );
+            CREATE INDEX IF NOT EXISTS idx_job_rows_chunk ON job_rows (job_id, chunk);
+            CREATE INDEX IF NOT EXISTS idx_job_chunks_status ON job_chunks (status, leased_until);
+            """
+        )
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return value
+
+    def submit(self, workbook, name, rows, column_map, sheet=None, priority=0, options=None):
+        """
+        Queue a job.
+
+        Args:
+            workbook: Path, bytes or file-like object of the workbook; a copy is kept in JOB_DIR
+            name: File name of the workbook, used for the output file name
+            rows: List of (row_number, row_dict) to verify
+            column_map: Dict mapping an output header to the result key written into that column
+            sheet: Sheet to write back to; the active sheet when omitted
+            priority: Higher priorities are served first
+            options: Keyword arguments for process_rows_with_progress (max_workers, batch_size,
+                schedule); with affinity scheduling rows are chunked by provider
+
+        Returns:
+            The new job ID
+        """
+        job_id = uuid.uuid4().hex[:16]
+        workbook_path = os.path.join(self.job_dir, f"{job_id}.xlsx")
+        if isinstance(workbook, (bytes, bytearray)):
+            with open(workbook_path, "wb") as f:
+                f.write(workbook)
+        elif hasattr(workbook, "read"):
+            workbook.seek(0)
+            with open(workbook_path, "wb") as f:
+                shutil.copyfileobj(workbook, f)
+            workbook.seek(0)
+        else:
+            shutil.copyfile(workbook, workbook_path)
+
+        if (options or {}).get("schedule") == "affinity":
+            # Each provider's rows in as few chunks as possible, so one worker summarizes it once
+            rows = sorted(rows, key=lambda row: provider_key(row[1]))
+        chunks = (len(rows) + self.chunk_rows - 1) // self.chunk_rows
+
+        def insert(conn):
+            conn.execute(
+                "INSERT INTO jobs (id, name, workbook_path, sheet, column_map, options, priority, status, total, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, name, workbook_path, sheet, json.dumps(column_map), json.dumps(options or {}),
+                 priority, "queued" if rows else "done", len(rows), time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO job_rows (job_id, row_number, chunk, row) VALUES (?, ?, ?, ?)",
+                ((job_id, row_number, i // self.chunk_rows, json.dumps(row_dict, default=str))
+                 for i, (row_number, row_dict) in enumerate(rows)),
+            )
+            conn.executemany(
+                "INSERT INTO job_chunks (job_id, chunk, status) VALUES (?, ?, 'queued')",
+                ((job_id, chunk) for chunk in range(chunks)),
+            )
+        self._transaction(insert)
+        return job_id
+
+    def claim(self, worker):
+        """
+        Lease the next chunk to work on: highest priority first, round-robin across jobs.
+
+        Returns:
+            Dict with job_id, chunk and the job's settings, or None when there is no work
+        """
+        def pick(conn):
+            now = time.time()
+            # Write-backs whose worker stopped renewing the lease go back to the queue
+            stale = conn.execute(
+                "SELECT id FROM jobs j WHERE status = 'writing' AND NOT EXISTS "
+                "(SELECT 1 FROM job_chunks c WHERE c.job_id = j.id AND c.leased_until >= ?)",
+                (now,),
+            ).fetchall()
+            for (job_id,) in stale:
+                conn.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,))
+                conn.execute(
+                    "UPDATE job_chunks SET status = 'queued' WHERE job_id = ? "
+                    "AND chunk = (SELECT MAX(chunk) FROM job_chunks WHERE job_id = ?)",
+                    (job_id, job_id),
+                )
+            found = conn.execute(
+                "SELECT c.job_id, c.chunk FROM job_chunks c JOIN jobs j ON j.id = c.job_id "
+                "WHERE j.status IN ('queued', 'running') "
+                "AND (c.status = 'queued' OR (c.status = 'running' AND c.leased_until < ?)) "
+                "ORDER BY j.priority DESC, j.last_scheduled_at ASC, j.created_at ASC, c.chunk ASC LIMIT 1",
+                (now,),
+            ).fetchone()
+            if found is None:
+                return None
+            job_id, chunk = found
+            conn.execute(
+                "UPDATE job_chunks SET status = 'running', worker = ?, leased_until = ?, attempts = attempts + 1 "
+                "WHERE job_id = ? AND chunk = ?",
+                (worker, now + self.lease_seconds, job_id, chunk),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'running', last_scheduled_at = ?, started_at = COALESCE(started_at, ?) "
+                "WHERE id = ?",
+                (now, now, job_id),
+            )
+            return job_id, chunk
+        claimed = self._transaction(pick)
+        if claimed is None:
+            return None
+        job = self.job(claimed[0])
+        job["chunk"] = claimed[1]
+        job["job_id"] = job.pop("id")
+        return job
+
+    def pending_rows(self, job_id, chunk):
+        """(row_number, row_dict) of a chunk's rows that have no result yet."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_number, row FROM job_rows WHERE job_id = ? AND chunk = ? AND result IS NULL "
+                "ORDER BY row_number",
+                (job_id, chunk),
+            ).fetchall()
+        return [(row_number, json.loads(row)) for row_number, row in rows]
+
+    def record_results(self, job_id, results):
+        """Store completed rows, given as {row_number: result}."""
+        now = time.time()
+
+        def update(conn):
+            changed = 0
+            for row_number, result in results.items():
+                changed += conn.execute(
+                    "UPDATE job_rows SET result = ?, completed_at = ? "
+                    "WHERE job_id = ? AND row_number = ? AND result IS NULL",
+                    (json.dumps(result, default=str), now, job_id, row_number),
+                ).rowcount
+            conn.execute("UPDATE jobs SET completed = completed + ? WHERE id = ?", (changed, job_id))
+        if results:
+            self._transaction(update)
+
+    def heartbeat(self, job_id, chunk, worker):
+        """
+        Extend a chunk lease.
+
+        Raises:
+            JobCancelled if the job has been cancelled (or the lease was handed to another worker)
+        """
+        def renew(conn):
+            status = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            renewed = conn.execute(
+                "UPDATE job_chunks SET leased_until = ? WHERE job_id = ? AND chunk = ? AND worker = ?",
+                (time.time() + self.lease_seconds, job_id, chunk, worker),
+            ).rowcount
+            return status[0] if status else None, renewed
+        status, renewed = self._transaction(renew)
+        if status == "cancelled":
+            raise JobCancelled(f"Job {job_id} was cancelled")
+        if not renewed:
+            raise JobCancelled(f"Lease on chunk {chunk} of job {job_id} was lost")
+
+    def complete_chunk(self, job_id, chunk, worker, stats=None):
+        """
+        Mark a chunk done.
+
+        Returns:
+            True if this was the job's last outstanding chunk, in which case the
+            caller writes the output and calls finish_job, renewing the chunk's
+            lease with heartbeat meanwhile
+        """
+        def complete(conn):
+            conn.execute(
+                "UPDATE job_chunks SET status = 'done', leased_until = 0 WHERE job_id = ? AND chunk = ? "
+                "AND worker = ?",
+                (job_id, chunk, worker),
+            )
+            if stats:
+                merged = json.loads(conn.execute("SELECT stats FROM jobs WHERE id = ?",
+                                                 (job_id,)).fetchone()[0] or "{}")
+                for key, value in stats.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        merged[key] = merged.get(key, 0) + value
+                conn.execute("UPDATE jobs SET stats = ? WHERE id = ?", (json.dumps(merged), job_id))
+            remaining = conn.execute(
+                "SELECT COUNT(*) FROM job_chunks WHERE job_id = ? AND status != 'done'", (job_id,)
+            ).fetchone()[0]
+            status = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            if remaining or status != "running":
+                return False
+            # Claim the write-back so only one worker does it, under the chunk's lease
+            conn.execute("UPDATE jobs SET status = 'writing' WHERE id = ?", (job_id,))
+            conn.execute("UPDATE job_chunks SET leased_until = ? WHERE job_id = ? AND chunk = ?",
+                         (time.time() + self.lease_seconds, job_id, chunk))
+            return True
+        return self._transaction(complete)
+
+    def fail_chunk(self, job_id, chunk, worker, error):
+        """Hand a chunk back after a failure, failing the job once it has used up JOB_MAX_ATTEMPTS."""
+        def fail(conn):
+            attempts = conn.execute(
+                "SELECT attempts FROM job_chunks WHERE job_id = ? AND chunk = ? AND worker = ?",
+                (job_id, chunk, worker),
+            ).fetchone()
+            if attempts is None:
+                return
+            if attempts[0] < config.JOB_MAX_ATTEMPTS:
+                conn.execute("UPDATE job_chunks SET status = 'queued', leased_until = 0 "
+                             "WHERE job_id = ? AND chunk = ?", (job_id, chunk))
+                return
+            conn.execute("UPDATE job_chunks SET status = 'failed' WHERE job_id = ? AND chunk = ?", (job_id, chunk))
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+                (str(error), time.time(), job_id),
+            )
+        self._transaction(fail)
+
+    def finish_job(self, job_id, output_path=None, error=None):
+        """Record the outcome of the write-back that follows the last chunk, unless the job was cancelled."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, output_path = ?, error = ?, finished_at = ? "
+                "WHERE id = ? AND status = 'writing'",
+                ("failed" if error else "done", output_path, str(error) if error else None, time.time(), job_id),
+            )
+
+    def cancel(self, job_id):
+        """Cancel a queued, running or writing job; returns True if it was still active."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN (?, ?, ?)",
+                (time.time(), job_id) + ACTIVE_STATUSES,
+            ).rowcount > 0
+
+    def set_priority(self, job_id, priority):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, job_id))
+
+    def job(self, job_id):
+        """The job's row as a dict (column_map, options and stats decoded), or None."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            names = [d[0] for d in cursor.description]
+        if row is None:
+            return None
+        job = dict(zip(names, row))
+        for key in ("column_map", "options", "stats"):
+            job[key] = json.loads(job[key]) if job[key] else {}
+        return job
+
+    def jobs(self, limit=50):
+        """The most recent jobs, newest first."""
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()]
+        return [self.job(job_id) for job_id in ids]
+
+    def results(self, job_id, latest=None):
+        """
+        Completed rows of a job as {row_number: result}.
+
+        Args:
+            latest: Only the N most recently completed rows, newest first
+        """
+        query = ("SELECT row_number, result FROM job_rows WHERE job_id = ? AND result IS NOT NULL "
+                 "ORDER BY " + ("completed_at DESC, row_number DESC LIMIT ?" if latest else "row_number"))
+        params = (job_id, latest) if latest else (job_id,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return {row_number: json.loads(result) for row_number, result in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
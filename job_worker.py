@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Worker service and command line for the job queue (job_queue.py).
+
+Workers lease chunks of queued jobs, verify them with
+process_rows_with_progress and store the results; any number of worker
+processes, started here or on separate terminals, can drain the same queue.
+The worker that finishes a job's last chunk writes its output workbook.
+
+Examples:
+    # Two worker processes draining the queue until interrupted
+    python job_worker.py work --processes 2
+
+    # Queue rows 2-5000 of a workbook at a higher priority, then follow it
+    python job_worker.py submit data.xlsx --end-row 5000 --priority 5
+    python job_worker.py status <job id>
+
+    python job_worker.py list
+    python job_worker.py cancel <job id>
+"""
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+import metrics
+from excel_io import iter_row_dicts, write_results
+from job_queue import JobCancelled, JobQueue
+
+DEFAULT_COLUMNS = "URL,Certifier,Certification Name"
+# Completed rows are stored at least this often, and at the latest once per heartbeat
+FLUSH_ROWS = 25
+
+
+def output_path_for(queue, job):
+    return os.path.join(queue.job_dir, f"{job['job_id']}_updated_{job['name']}")
+
+
+def write_output(queue, job):
+    """Write a finished job's output workbook and record the outcome, even if the write is interrupted."""
+    job_id = job["job_id"]
+    output_path = output_path_for(queue, job)
+    try:
+        write_results(job["workbook_path"], output_path, queue.results(job_id), job["column_map"], job["sheet"])
+    except Exception as e:
+        print(f"Could not write the output of job {job_id}: {e}")
+        queue.finish_job(job_id, error=e)
+        return
+    except BaseException:
+        queue.finish_job(job_id, error="Output write was interrupted")
+        raise
+    queue.finish_job(job_id, output_path)
+    print(f"Job {job_id} done; updated file saved as {output_path}")
+
+
+def process_chunk(queue, job, worker, limiter=None):
+    """
+    Verify one leased chunk, storing results as rows complete and renewing the lease meanwhile.
+
+    A cancelled job's runs in flight are cancelled at the next heartbeat. The
+    worker completing a job's last chunk writes the output under the same lease.
+
+    Returns:
+        Number of rows processed
+    """
+    from agent_api import process_rows_with_progress
+    from retry_policy import RunCancelled
+
+    job_id, chunk = job["job_id"], job["chunk"]
+    rows = queue.pending_rows(job_id, chunk)
+    pending = {}
+    stopped = threading.Event()
+    cancel_event = threading.Event()
+    cancelled = []
+    last_flush = [time.monotonic()]
+
+    def keep_lease():
+        while not stopped.wait(config.JOB_HEARTBEAT_SECONDS):
+            try:
+                queue.heartbeat(job_id, chunk, worker)
+            except JobCancelled as e:
+                cancelled.append(e)
+                cancel_event.set()
+                return
+            except Exception as e:
+                # A busy or briefly unavailable queue database; the lease outlasts a few missed beats
+                print(f"Could not renew the lease on chunk {chunk} of job {job_id}: {e}")
+
+    def flush():
+        queue.record_results(job_id, dict(pending))
+        pending.clear()
+        last_flush[0] = time.monotonic()
+
+    def on_result(i, result):
+        pending[rows[i][0]] = result
+        if len(pending) >= FLUSH_ROWS or time.monotonic() - last_flush[0] >= config.JOB_HEARTBEAT_SECONDS:
+            flush()
+        if cancelled:
+            raise cancelled[0]
+
+    heartbeat = threading.Thread(target=keep_lease, name="job-heartbeat", daemon=True)
+    heartbeat.start()
+    stats = {}
+    try:
+        try:
+            process_rows_with_progress(
+                [row_dict for _, row_dict in rows],
+                result_callback=on_result,
+                stats=stats,
+                limiter=limiter,
+                run_id=job_id,
+                cancel_event=cancel_event,
+                **job["options"],
+            )
+            flush()
+        except (JobCancelled, RunCancelled) as e:
+            flush()
+            print(f"Stopped chunk {chunk} of job {job_id}: {cancelled[0] if cancelled else e}")
+            return len(rows)
+        except Exception as e:
+            flush()
+            print(f"Chunk {chunk} of job {job_id} failed: {e}")
+            queue.fail_chunk(job_id, chunk, worker, e)
+            return len(rows)
+
+        if queue.complete_chunk(job_id, chunk, worker, stats):
+            write_output(queue, job)
+    finally:
+        stopped.set()
+        heartbeat.join()
+    return len(rows)
+
+
+def run_worker(worker=None, once=False, queue=None):
+    """
+    Lease and process chunks until interrupted (or, with ``once``, until the queue is empty).
+
+    Returns:
+        Number of rows processed
+    """
+    from rate_limiter import AdaptiveConcurrencyLimiter
+
+    queue = queue or JobQueue()
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    # One limiter per worker, so concurrency learned on one chunk carries over to the next
+    limiter = AdaptiveConcurrencyLimiter()
+    processed = 0
+    print(f"Worker {worker} polling {queue.path}")
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            if once:
+                return processed
+            time.sleep(config.JOB_POLL_SECONDS)
+            continue
+        print(f"Worker {worker}: job {job['job_id']} chunk {job['chunk']} (priority {job['priority']})")
+        processed += process_chunk(queue, job, worker, limiter)
+
+
+def _worker_process(index, once):
+    metrics.start_exporters(index)
+    try:
+        return run_worker(f"{socket.gethostname()}-{os.getpid()}-{index}", once=once)
+    finally:
+        metrics.dump_json()
+
+
+def cmd_work(args):
+    if args.processes <= 1:
+        metrics.start_exporters()
+        run_worker(once=args.once)
+        return
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = [executor.submit(_worker_process, i, args.once) for i in range(1, args.processes + 1)]
+        print(f"{sum(f.result() for f in futures)} rows processed")
+
+
+def cmd_submit(args):
+    columns = [c.strip() for c in args.columns.split(",") if c.strip()]
+    rows = [(row_number, row_dict) for row_number, row_dict
+            in iter_row_dicts(args.workbook, columns, args.start_row, args.end_row, args.sheet)
+            if any(value not in (None, "") for value in row_dict.values())]
+    options = {"max_workers": args.workers, "batch_size": args.batch_size, "schedule": args.schedule}
+    job_id = JobQueue().submit(
+        args.workbook, os.path.basename(args.workbook), rows,
+        {args.new_cert_column: "newCertificateName", args.remark_column: "remark"},
+        sheet=args.sheet, priority=args.priority, options=options,
+    )
+    print(f"Queued job {job_id} with {len(rows)} rows")
+
+
+def describe(job):
+    line = (f"{job['id']}  {job['status']:<9} {job['completed']}/{job['total']} rows  "
+            f"priority {job['priority']}  {job['name']}")
+    if job["output_path"]:
+        line += f"  -> {job['output_path']}"
+    if job["error"]:
+        line += f"  ({job['error']})"
+    return line
+
+
+def cmd_status(args):
+    job = JobQueue().job(args.job_id)
+    if job is None:
+        raise SystemExit(f"No job {args.job_id}")
+    print(describe(job))
+
+
+def cmd_list(args):
+    for job in JobQueue().jobs(args.limit):
+        print(describe(job))
+
+
+def cmd_cancel(args):
+    if JobQueue().cancel(args.job_id):
+        print(f"Cancelled job {args.job_id}")
+    else:
+        print(f"Job {args.job_id} is not queued or running")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Job queue worker for the certificate mapper.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    work = subparsers.add_parser("work", help="Process queued jobs")
+    work.add_argument("--processes", type=int, default=1, help="Worker processes to start")
+    work.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+    work.set_defaults(func=cmd_work)
+
+    submit = subparsers.add_parser("submit", help="Queue a workbook row range")
+    submit.add_argument("workbook", help="Path to the input .xlsx workbook")
+    submit.add_argument("--sheet", help="Sheet name (defaults to the active sheet)")
+    submit.add_argument("--columns", default=DEFAULT_COLUMNS, help="Comma-separated columns to send to the agent")
+    submit.add_argument("--start-row", type=int, default=2, help="First sheet row (inclusive)")
+    submit.add_argument("--end-row", type=int, default=None, help="Last sheet row (inclusive)")
+    submit.add_argument("--new-cert-column", default="NEW CERTIFICATE NAME BY AGENT",
+                        help="Column receiving newCertificateName")
+    submit.add_argument("--remark-column", default="AGENT REMARKS", help="Column receiving remark")
+    submit.add_argument("--priority", type=int, default=0, help="Higher priorities are served first")
+    submit.add_argument("--workers", type=int, default=config.MAX_WORKERS,
+                        help="Maximum concurrent agent calls per worker")
+    submit.add_argument("--batch-size", type=int, default=config.BATCH_SIZE, help="Rows per agent run")
+    submit.add_argument("--schedule", choices=["sheet", "affinity"], default=config.SCHEDULING_MODE,
+                        help="Row order: sheet order, or grouped by certifier/URL with a shared provider summary")
+    submit.set_defaults(func=cmd_submit)
+
+    status = subparsers.add_parser("status", help="Show one job")
+    status.add_argument("job_id")
+    status.set_defaults(func=cmd_status)
+
+    listing = subparsers.add_parser("list", help="Show recent jobs")
+    listing.add_argument("--limit", type=int, default=20)
+    listing.set_defaults(func=cmd_list)
+
+    cancel = subparsers.add_parser("cancel", help="Cancel a queued or running job")
+    cancel.add_argument("job_id")
+    cancel.set_defaults(func=cmd_cancel)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
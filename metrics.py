@@ -0,0 +1,323 @@
+"""
+Lightweight per-stage timing instrumentation for agent calls.
+
+``span(stage)`` times one stage of a row (threads.acquire, messages.create,
+runs.complete, messages.list, parse, ...) and feeds a per-stage
+histogram and error counter. The row index and run ID of the current worker
+thread are attached via ``bound``. Aggregates can be scraped in Prometheus
+text format from ``start_metrics_server`` or dumped periodically as JSON;
+entry points start both with ``start_exporters``.
+
+When metrics are disabled (METRICS_ENABLED=false) ``span`` returns a shared
+no-op context manager and ``bound`` returns the function unchanged, so the
+instrumentation costs a flag check per stage.
+
+Components keeping their own counters (the HTTP connection pool, the token
+cache) publish them with ``register_counters``; they are reported alongside
+the stages whether or not spans are being recorded.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, float("inf"))
+_NOOP = contextlib.nullcontext()
+_local = threading.local()
+_lock = threading.Lock()
+_enabled = config.METRICS_ENABLED
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count", "errors")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Approximate quantile: the upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(BUCKETS, self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return bound
+        return BUCKETS[-1]
+
+
+_histograms = {}
+_recent_spans = deque(maxlen=config.METRICS_RECENT_SPANS)
+_counters = {}
+
+
+def enabled():
+    return _enabled
+
+
+def set_enabled(value):
+    """Turn instrumentation on or off at runtime."""
+    global _enabled
+    _enabled = bool(value)
+
+
+def reset():
+    """Drop all recorded spans and aggregates."""
+    with _lock:
+        _histograms.clear()
+        _recent_spans.clear()
+
+
+def register_counters(name, collect):
+    """
+    Publish a component's counters in every snapshot and Prometheus scrape.
+
+    Args:
+        name: Component name, e.g. "http" (exported as certmapper_<counter>{component="http"})
+        collect: Callable returning a dict of counter name -> number
+    """
+    with _lock:
+        _counters[name] = collect
+
+
+def counters():
+    """Current values of every registered component's counters."""
+    with _lock:
+        collectors = dict(_counters)
+    return {name: collect() for name, collect in collectors.items()}
+
+
+def _record(stage, seconds, error):
+    context = getattr(_local, "context", None) or {}
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = _Histogram()
+        histogram.observe(seconds)
+        if error:
+            histogram.errors += 1
+        _recent_spans.append({
+            "stage": stage,
+            "seconds": round(seconds, 4),
+            "error": error,
+            "row": context.get("row"),
+            "run_id": context.get("run_id"),
+        })
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _record(self.stage, time.perf_counter() - self.started, exc_type is not None)
+        return False
+
+
+def span(stage):
+    """Context manager timing one stage of the current row."""
+    if not _enabled:
+        return _NOOP
+    return _Span(stage)
+
+
+def bound(fn, row=None, run_id=None):
+    """Wrap ``fn`` so spans recorded while it runs carry the given row index and run ID."""
+    if not _enabled:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, "context", None)
+        _local.context = {"row": row, "run_id": run_id}
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.context = previous
+
+    return wrapper
+
+
+def snapshot():
+    """Return per-stage aggregates as a JSON-serializable dict."""
+    with _lock:
+        stages = {
+            stage: {
+                "count": h.count,
+                "errors": h.errors,
+                "total_seconds": round(h.total, 4),
+                "mean_seconds": round(h.total / h.count, 4) if h.count else 0.0,
+                "p50_seconds": h.quantile(0.5),
+                "p95_seconds": h.quantile(0.95),
+                "buckets": {str(b): c for b, c in zip(BUCKETS, h.counts)},
+            }
+            for stage, h in _histograms.items()
+        }
+        recent = list(_recent_spans)[-20:]
+    return {"timestamp": time.time(), "stages": stages, "counters": counters(), "recent_spans": recent}
+
+
+def summary_rows():
+    """Compact per-stage summary for display (one dict per stage)."""
+    return [
+        {
+            "stage": stage,
+            "count": data["count"],
+            "errors": data["errors"],
+            "mean_s": data["mean_seconds"],
+            "p95_s": data["p95_seconds"],
+            "total_s": data["total_seconds"],
+        }
+        for stage, data in snapshot()["stages"].items()
+    ]
+
+
+def prometheus_text():
+    """Render aggregates in the Prometheus text exposition format."""
+    lines = [
+        "# HELP certmapper_stage_seconds Time spent per agent call stage.",
+        "# TYPE certmapper_stage_seconds histogram",
+    ]
+    errors = [
+        "# HELP certmapper_stage_errors_total Errors raised per agent call stage.",
+        "# TYPE certmapper_stage_errors_total counter",
+    ]
+    with _lock:
+        for stage, h in sorted(_histograms.items()):
+            cumulative = 0
+            for bound_, bucket_count in zip(BUCKETS, h.counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound_ == float("inf") else repr(bound_)
+                lines.append(f'certmapper_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'certmapper_stage_seconds_sum{{stage="{stage}"}} {h.total}')
+            lines.append(f'certmapper_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            errors.append(f'certmapper_stage_errors_total{{stage="{stage}"}} {h.errors}')
+    gauges = []
+    for component, values in sorted(counters().items()):
+        for counter, value in sorted(values.items()):
+            gauges.append(f"# TYPE certmapper_{counter} gauge")
+            gauges.append(f'certmapper_{counter}{{component="{component}"}} {value}')
+    return "\n".join(lines + errors + gauges) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") == "/metrics":
+            body, content_type = prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path.rstrip("/") == "/metrics.json":
+            body, content_type = json.dumps(snapshot()).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port=None, address="127.0.0.1"):
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread."""
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((address, port or config.METRICS_PORT), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"Metrics available at http://{address}:{_server.server_address[1]}/metrics")
+    return _server
+
+
+def _write_json(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def start_json_dump(path=None, interval=None):
+    """Write snapshot() to a JSON file every ``interval`` seconds from a background thread, and once at exit."""
+    path = path or config.METRICS_JSON_PATH
+    interval = interval or config.METRICS_DUMP_INTERVAL_SECONDS
+    stop = threading.Event()
+
+    def dump_loop():
+        while not stop.wait(interval):
+            _write_json(path)
+
+    threading.Thread(target=dump_loop, name="metrics-dump", daemon=True).start()
+    atexit.register(_write_json, path)
+    return stop
+
+
+_exporters_pid = None
+_dump_path = None
+
+
+def start_exporters(process_index=None):
+    """
+    Start the /metrics server (METRICS_PORT) and the JSON dump (METRICS_JSON_PATH) if metrics are enabled.
+
+    Called by the entry points (streamlit_ui, batch_cli, job_worker), once per
+    process; later calls in the same process do nothing. Worker processes pass
+    their index so each serves on METRICS_PORT + index and dumps to its own
+    file instead of contending for the parent's.
+
+    Args:
+        process_index: 1-based index of a worker process, or None for the main process
+    """
+    global _exporters_pid, _dump_path, _server
+    if _exporters_pid == os.getpid() or not config.METRICS_ENABLED:
+        return
+    if _exporters_pid is not None:
+        # Forked from a process with exporters running; their threads did not survive the fork
+        _server = None
+    _exporters_pid = os.getpid()
+    if config.METRICS_PORT:
+        try:
+            start_metrics_server(config.METRICS_PORT + (process_index or 0))
+        except OSError as e:
+            print(f"Could not start the metrics server: {e}")
+    if config.METRICS_JSON_PATH:
+        _dump_path = config.METRICS_JSON_PATH
+        if process_index:
+            root, ext = os.path.splitext(_dump_path)
+            _dump_path = f"{root}.{process_index}{ext}"
+        start_json_dump(_dump_path)
+
+
+def dump_json():
+    """Write the JSON dump started by start_exporters now (pool worker processes exit without atexit)."""
+    if _dump_path and _exporters_pid == os.getpid():
+        _write_json(_dump_path)
@@ -0,0 +1,190 @@
+"""
+Certifier-affinity scheduling and the shared provider context.
+
+Catalogs hold many certificates from the same certifier and provider page, and
+a run per row re-searches and re-reads that page every time. In affinity mode
+(config.SCHEDULING_MODE = "affinity") agent_api.process_rows_with_progress
+groups rows by provider (certifier plus URL host). The first row of a group
+that needs the agent has it summarize the provider's certificate listing in
+one web-grounded run. The summary is cached here and prefixed to the prompt of
+every other row of the group, so the listing is fetched once per group rather
+than once per row. Groups are interleaved so concurrent workers start on
+different providers instead of queueing behind one provider's summary.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+import config
+from catalog_index import normalize_name, url_host
+from result_cache import normalize_value
+
+# First line of a prompt carrying a provider summary; agent_instruction.md tells the agent to
+# answer from it and search only for certificates it does not cover
+PROVIDER_CONTEXT_HEADER = "Provider context"
+
+SUMMARY_PROMPT = (
+    "Do not verify a single certificate yet. Visit {url} (search the web for the certifications of "
+    "{certifier} if no URL is given) and list every certification {certifier} currently offers, one per "
+    "line with its current official name. Mark certifications that were renamed (old name -> new name), "
+    "retired or are expiring soon. Reply with the list only."
+)
+
+
+def _column(row_dict, column):
+    """Value of ``column`` in a row dict, matching the header ignoring case and spacing."""
+    wanted = normalize_value(column)
+    for key, value in row_dict.items():
+        if normalize_value(key) == wanted:
+            return value
+    return None
+
+
+def provider_key(row_dict):
+    """
+    Affinity key of a row: its normalized certifier and URL host.
+
+    Returns:
+        String key, or "" when the row names neither a certifier nor a URL
+    """
+    certifier = normalize_name(_column(row_dict, config.CATALOG_CERTIFIER_COLUMN))
+    host = url_host(_column(row_dict, config.CATALOG_URL_COLUMN))
+    if not certifier and not host:
+        return ""
+    return f"{certifier}|{host}"
+
+
+def summary_prompt(row_dict):
+    """User message asking the agent for the certificate listing of a row's provider."""
+    certifier = " ".join(str(_column(row_dict, config.CATALOG_CERTIFIER_COLUMN) or "").split())
+    url = " ".join(str(_column(row_dict, config.CATALOG_URL_COLUMN) or "").split())
+    return SUMMARY_PROMPT.format(certifier=certifier or "the provider", url=url or "the provider's website")
+
+
+def with_context(content, summary):
+    """Prefix a row or batch prompt with a provider summary (unchanged when there is none)."""
+    if not summary:
+        return content
+    return (f"{PROVIDER_CONTEXT_HEADER} (the provider's certificate listing, gathered earlier):\n"
+            f"{summary}\n\n{content}")
+
+
+def interleave(buckets):
+    """
+    Round-robin over lists of items, taking one from each list in turn.
+
+    Args:
+        buckets: Lists of items, in the order they should first be visited
+
+    Returns:
+        One list holding every item
+    """
+    ordered = []
+    buckets = [list(bucket) for bucket in buckets if bucket]
+    for i in range(max((len(bucket) for bucket in buckets), default=0)):
+        ordered.extend(bucket[i] for bucket in buckets if i < len(bucket))
+    return ordered
+
+
+class ProviderContextCache:
+    """
+    Provider summaries shared by all worker threads of a process.
+
+    Only one summary per provider is built at a time: other rows of the
+    provider wait for it instead of starting their own search. A failed
+    build is remembered as None (rows then run without context) until it
+    expires, while exceptions such as throttling propagate so the row is
+    re-queued and the next row of the group tries again.
+    """
+
+    def __init__(self, ttl_seconds=None, max_chars=None):
+        self.ttl_seconds = config.PROVIDER_CONTEXT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_chars = config.PROVIDER_CONTEXT_MAX_CHARS if max_chars is None else max_chars
+        self._entries = {}
+        self._locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self.built = 0
+        self.hits = 0
+        self.failures = 0
+        self.build_seconds = 0.0
+
+    def get(self, key, build):
+        """
+        Summary for ``key``, calling ``build()`` to produce it when none is cached.
+
+        Returns:
+            The summary text (cut to max_chars), or None when none could be built
+        """
+        with self._lock:
+            key_lock = self._locks[key]
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() - entry[1] < self.ttl_seconds:
+                    self.hits += 1
+                    return entry[0]
+            started = time.perf_counter()
+            summary = build()
+            elapsed = time.perf_counter() - started
+            if summary and self.max_chars and len(summary) > self.max_chars:
+                summary = summary[:self.max_chars].rsplit("\n", 1)[0]
+            with self._lock:
+                self._entries[key] = (summary or None, time.monotonic())
+                self.build_seconds += elapsed
+                if summary:
+                    self.built += 1
+                else:
+                    self.failures += 1
+            return summary or None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "provider_contexts_built": self.built,
+                "provider_context_hits": self.hits,
+                "provider_context_failures": self.failures,
+                "provider_context_seconds": round(self.build_seconds, 3),
+            }
+
+
+class GroupStats:
+    """Rows, runs, latency and web-grounding calls per provider group of a batch."""
+
+    def __init__(self):
+        self._groups = {}
+
+    def record(self, key, rows, started, finished, grounding_calls):
+        """Add one finished unit of work (run latency from ``started`` to ``finished``, monotonic seconds)."""
+        group = self._groups.setdefault(key, {"rows": 0, "runs": 0, "grounding_calls": 0, "latency": 0.0,
+                                              "first_started": started, "last_finished": finished})
+        group["rows"] += rows
+        group["runs"] += 1
+        group["grounding_calls"] += grounding_calls
+        group["latency"] += finished - started
+        group["first_started"] = min(group["first_started"], started)
+        group["last_finished"] = max(group["last_finished"], finished)
+
+    def summary(self):
+        """
+        Per-group report, largest groups first.
+
+        Returns:
+            List of dicts with provider, rows, runs, grounding_calls,
+            mean_latency_seconds and wall_seconds (first start to last finish)
+        """
+        report = []
+        for key, group in sorted(self._groups.items(), key=lambda item: -item[1]["rows"]):
+            report.append({
+                "provider": key or "(none)",
+                "rows": group["rows"],
+                "runs": group["runs"],
+                "grounding_calls": group["grounding_calls"],
+                "mean_latency_seconds": round(group["latency"] / group["runs"], 3),
+                "wall_seconds": round(group["last_finished"] - group["first_started"], 3),
+            })
+        return report
@@ -0,0 +1,227 @@
+"""
+Adaptive concurrency control for agent calls.
+
+The limiter grows the number of in-flight agent runs additively while the
+service is healthy and cuts it multiplicatively (AIMD) when the service
+throttles us, pausing new submissions for the Retry-After interval. Optional
+requests-per-minute and tokens-per-minute budgets are enforced with token
+buckets so a batch can run right up to the deployment quota.
+"""
+
+import re
+import threading
+import time
+
+import config
+
+# Service error codes for throttling, compared case-insensitively ("429" is how Azure OpenAI spells it)
+THROTTLE_ERROR_CODES = frozenset(("rate_limit_exceeded", "ratelimitexceeded", "too_many_requests",
+                                  "toomanyrequests", "429"))
+# Exhausted quota or billing limits do not clear by waiting: they fail fast instead of being re-queued
+QUOTA_ERROR_CODES = frozenset(("insufficient_quota", "quota_exceeded", "quotaexceeded"))
+RETRY_AFTER_HEADERS = ("retry-after-ms", "x-ms-retry-after-ms", "retry-after")
+
+
+class ThrottledError(Exception):
+    """Raised when the agent service rejects or fails a run because of throttling."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(text):
+    """Extract a 'try again in N seconds' hint from an error message."""
+    if not text:
+        return None
+    match = re.search(r"(?:try again|retry) (?:in|after) (\d+(?:\.\d+)?) ?(ms|milliseconds|s|sec|seconds)?",
+                      str(text), re.IGNORECASE)
+    if not match:
+        return None
+    value = float(match.group(1))
+    unit = (match.group(2) or "s").lower()
+    return value / 1000 if unit in ("ms", "milliseconds") else value
+
+
+def _retry_after_from_headers(headers):
+    for name in RETRY_AFTER_HEADERS:
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except (TypeError, ValueError):
+            continue
+        return seconds / 1000 if name.endswith("-ms") else seconds
+    return None
+
+
+def error_code(exc):
+    """Service error code of an exception (azure.core HttpResponseError or a run error), lower-cased, or ''."""
+    for code in (getattr(getattr(exc, "error", None), "code", None), getattr(exc, "error_code", None),
+                 getattr(exc, "code", None)):
+        if code:
+            return str(code).strip().lower()
+    return ""
+
+
+def throttle_retry_after(exc):
+    """
+    Classify an exception as throttling, by HTTP status 429 or a throttling error code.
+
+    Returns:
+        The number of seconds to wait (0.0 when unknown) if the exception is a
+        throttling error, otherwise None (also for an exhausted quota)
+    """
+    if isinstance(exc, ThrottledError):
+        return exc.retry_after or 0.0
+    code = error_code(exc)
+    if code in QUOTA_ERROR_CODES:
+        return None
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    if status != 429 and code not in THROTTLE_ERROR_CODES:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    retry_after = _retry_after_from_headers({k.lower(): v for k, v in headers.items()})
+    if retry_after is None:
+        retry_after = parse_retry_after(str(exc))
+    return retry_after or 0.0
+
+
+def run_throttle_error(run):
+    """Return a ThrottledError for a failed run whose last_error code is a rate limit, else None."""
+    last_error = getattr(run, "last_error", None)
+    if not last_error:
+        return None
+    code = str(getattr(last_error, "code", "") or "")
+    message = str(getattr(last_error, "message", "") or "")
+    if code.strip().lower() in THROTTLE_ERROR_CODES:
+        return ThrottledError(f"Run throttled: {code} {message}".strip(), parse_retry_after(message))
+    return None
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``per_minute`` tokens per minute."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until ``amount`` tokens are available."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limiter with Retry-After pauses and optional RPM/TPM budgets."""
+
+    def __init__(self, max_limit=None, min_limit=1, initial_limit=None,
+                 requests_per_minute=None, tokens_per_minute=None,
+                 tokens_per_request=None, decrease_factor=0.5):
+        self.max_limit = max_limit or config.MAX_WORKERS
+        self.min_limit = min_limit
+        self.limit = float(min(initial_limit or config.INITIAL_WORKERS, self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.tokens_per_request = tokens_per_request or config.ESTIMATED_TOKENS_PER_REQUEST
+        rpm = requests_per_minute if requests_per_minute is not None else config.REQUESTS_PER_MINUTE
+        tpm = tokens_per_minute if tokens_per_minute is not None else config.TOKENS_PER_MINUTE
+        self._request_bucket = TokenBucket(rpm) if rpm else None
+        self._token_bucket = TokenBucket(tpm) if tpm else None
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttle_count = 0
+        self.success_count = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit))
+
+    def wait_time(self):
+        """Seconds until another request may be started (0.0 if one may start now)."""
+        with self._lock:
+            return self._wait_time(time.monotonic())
+
+    def _wait_time(self, now):
+        waits = [max(0.0, self.paused_until - now)]
+        if self._request_bucket:
+            waits.append(self._request_bucket.wait_time(1, now))
+        if self._token_bucket:
+            waits.append(self._token_bucket.wait_time(self.tokens_per_request, now))
+        return max(waits)
+
+    def try_acquire(self):
+        """Reserve a slot for one request without blocking; returns True on success."""
+        with self._lock:
+            if self.in_flight >= self.current_limit or self._wait_time(time.monotonic()) > 0:
+                return False
+            if self._request_bucket:
+                self._request_bucket.take(1)
+            if self._token_bucket:
+                self._token_bucket.take(self.tokens_per_request)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return True
+
+    def acquire(self):
+        """Block until a slot is available."""
+        while not self.try_acquire():
+            time.sleep(min(max(self.wait_time(), 0.05), 1.0))
+
+    def release_success(self):
+        """Release a slot after a healthy response and grow the limit additively."""
+        with self._lock:
+            self.in_flight -= 1
+            self.success_count += 1
+            self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+
+    def release_throttled(self, retry_after=None):
+        """Release a slot after a throttling response, shrink the limit and pause."""
+        with self._lock:
+            self.in_flight -= 1
+            self.throttle_count += 1
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            pause = retry_after if retry_after else config.THROTTLE_DEFAULT_BACKOFF_SECONDS
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        print(f"Throttled by agent service; concurrency now {self.current_limit}, pausing {pause:.1f}s")
+
+    def cap(self, max_limit):
+        """Lower the concurrency ceiling for the rest of the batch (e.g. once a token budget is spent)."""
+        with self._lock:
+            self.max_limit = max(self.min_limit, min(self.max_limit, max_limit))
+            self.limit = min(self.limit, float(self.max_limit))
+
+    def release_error(self):
+        """Release a slot after a non-throttling failure without changing the limit."""
+        with self._lock:
+            self.in_flight -= 1
+
+    def record_tokens(self, actual_tokens):
+        """Correct the token budget once the real token usage of a request is known."""
+        if not self._token_bucket:
+            return
+        with self._lock:
+            self._token_bucket.take(actual_tokens - self.tokens_per_request)
+
+    def stats(self):
+        return {
+            "concurrency_limit": self.current_limit,
+            "peak_in_flight": self.peak_in_flight,
+            "throttled": self.throttle_count,
+            "succeeded": self.success_count,
+        }
@@ -0,0 +1,195 @@
+"""
+Reply schema, validating parser and repair prompts for agent answers.
+
+The agent answers each row with a ``newCertificateName`` and one of the
+remarks fixed by the rules in agent_instruction.md. In structured-output mode
+(config.STRUCTURED_OUTPUT) runs request these schemas as a strict JSON
+``response_format``; in either mode replies go through the validating parsers
+below. A reply that fails validation is repaired by a short follow-up run on
+the same thread (see agent_api) instead of re-running the web-grounded search.
+"""
+
+import json
+import re
+import threading
+
+from result_cache import normalize_value
+
+# The remark rules in agent_instruction.md, in rule order
+REMARKS = (
+    "Certificate exists.",
+    "Certificate exists but with a slight different name",
+    "Certificate has been renamed.",
+    "Certificate is expiring soon.",
+    "Certificate not found or expired.",
+)
+_REMARKS_BY_KEY = {normalize_value(remark).rstrip("."): remark for remark in REMARKS}
+
+_RESULT_PROPERTIES = {
+    "newCertificateName": {"type": "string"},
+    "remark": {"type": "string", "enum": list(REMARKS)},
+}
+
+ROW_SCHEMA = {
+    "type": "object",
+    "properties": _RESULT_PROPERTIES,
+    "required": ["newCertificateName", "remark"],
+    "additionalProperties": False,
+}
+
+# Strict schemas need an object at the top level, so batched answers are wrapped in "results"
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"id": {"type": "integer"}, **_RESULT_PROPERTIES},
+                "required": ["id", "newCertificateName", "remark"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["results"],
+    "additionalProperties": False,
+}
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class ReplyError(ValueError):
+    """An assistant reply that is not valid JSON or does not match the reply schema."""
+
+
+def validate_result(item):
+    """
+    Check one answer object and return it normalized.
+
+    Remarks are matched to REMARKS ignoring case, spacing and a trailing period;
+    a null name becomes "".
+
+    Returns:
+        Dict with exactly newCertificateName and remark
+
+    Raises:
+        ReplyError describing the first problem found
+    """
+    if not isinstance(item, dict):
+        raise ReplyError(f"expected a JSON object, got {type(item).__name__}")
+    name = item.get("newCertificateName")
+    if name is None:
+        name = ""
+    if not isinstance(name, str):
+        raise ReplyError("newCertificateName must be a string")
+    remark = item.get("remark")
+    canonical = _REMARKS_BY_KEY.get(normalize_value(remark).rstrip(".")) if isinstance(remark, str) else None
+    if canonical is None:
+        raise ReplyError(f"remark {remark!r} is not one of the allowed remarks")
+    return {"newCertificateName": name, "remark": canonical}
+
+
+def _load_json(text, opening):
+    """Decode the JSON value in a reply: the whole text when possible, else the outermost ``opening`` span."""
+    text = _FENCE_RE.sub("", (text or "").strip())
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    closing = "}" if opening == "{" else "]"
+    start = text.find(opening)
+    end = text.rfind(closing) + 1
+    if start < 0 or end <= start:
+        raise ReplyError("reply contains no JSON")
+    try:
+        return json.loads(text[start:end])
+    except ValueError as e:
+        raise ReplyError(f"reply is not valid JSON ({e})")
+
+
+def parse_row_reply(text):
+    """
+    Parse and validate a single-row reply.
+
+    Returns:
+        Tuple of (result, None), or (None, error message) for a malformed reply
+    """
+    try:
+        return validate_result(_load_json(text, "{")), None
+    except ReplyError as e:
+        return None, str(e)
+
+
+def parse_batch_items(text):
+    """
+    Decode a batched reply into its list of answer objects (bare array or {"results": [...]}).
+
+    Returns:
+        Tuple of (items, None), or (None, error message) when the reply is not such a list
+    """
+    try:
+        decoded = _load_json(text, "{" if text and text.lstrip().startswith("{") else "[")
+    except ReplyError as e:
+        return None, str(e)
+    if isinstance(decoded, dict):
+        decoded = decoded.get("results")
+    if not isinstance(decoded, list):
+        return None, "expected a JSON array of answers"
+    return decoded, None
+
+
+class ReplySchema:
+    """A response schema together with the parser that validates replies against it."""
+
+    def __init__(self, name, schema, parse):
+        self.name = name
+        self.schema = schema
+        self.parse = parse
+
+    def response_format(self):
+        """Run ``response_format`` argument requesting this schema as strict structured output."""
+        return {"type": "json_schema",
+                "json_schema": {"name": self.name, "schema": self.schema, "strict": True}}
+
+
+ROW_REPLY = ReplySchema("certificate_verification", ROW_SCHEMA, parse_row_reply)
+BATCH_REPLY = ReplySchema("certificate_verification_batch", BATCH_SCHEMA, parse_batch_items)
+
+
+def repair_prompt(error, reply_schema):
+    """Follow-up message asking the agent to restate its previous answer in the required format."""
+    return (
+        f"Your previous reply could not be used: {error}. Do not search again. Restate the same "
+        f"answer as JSON only, with no other text, matching this schema: "
+        f"{json.dumps(reply_schema.schema, separators=(',', ':'))}"
+    )
+
+
+class ReplyStats:
+    """Counters for replies checked, parse failures and repair outcomes."""
+
+    FIELDS = ("replies", "parse_failures", "repairs", "repaired")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, field, count=1):
+        with self._lock:
+            self._counts[field] += count
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    @staticmethod
+    def summary(counts):
+        """Counts plus parse_failure_rate (failures per reply) and repair_rate (repairs that succeeded)."""
+        summary = dict(counts)
+        summary["parse_failure_rate"] = (round(counts["parse_failures"] / counts["replies"], 4)
+                                         if counts["replies"] else 0.0)
+        summary["repair_rate"] = round(counts["repaired"] / counts["repairs"], 4) if counts["repairs"] else 0.0
+        return summary
+
+
+reply_stats = ReplyStats()
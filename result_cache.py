@@ -0,0 +1,186 @@
+"""
+Persistent on-disk cache for certificate verification results.
+
+Results returned by the agent are stored in a small SQLite database keyed on a
+normalized form of the row dict sent to ``call_agent``, so re-running the same
+catalog does not pay for a full agent run per row again. Keys also carry the
+cache's namespace (the agent backend, endpoint, model and instructions hash),
+so answers from the fake backend or another agent definition are never served
+to a run against the real one.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import config
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# The running entry count is re-read from the database this often, to catch up with other processes' writes
+RECOUNT_EVERY_PUTS = 1000
+
+
+def normalize_value(value):
+    """Normalize a cell value for comparison (whitespace collapsed, case folded)."""
+    if value is None:
+        return ""
+    return " ".join(str(value).split()).casefold()
+
+
+def normalize_row(row_dict):
+    """Return a normalized copy of a row dict, suitable for keying and comparison."""
+    return {normalize_value(k): normalize_value(v) for k, v in row_dict.items()}
+
+
+def row_key(row_dict, namespace=None):
+    """Return a stable hash key for a row dict, optionally scoped to a namespace."""
+    payload = json.dumps(normalize_row(row_dict), sort_keys=True)
+    if namespace:
+        payload = f"{namespace}\n{payload}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Set on results that hold a validated answer; error results built from the row's columns never carry it
+ANSWER_FLAG = "_answer"
+
+
+def agent_answer(result):
+    """Copy of a validated result flagged as a real answer (cacheable and journaled as done)."""
+    return dict(result, **{ANSWER_FLAG: True})
+
+
+def is_agent_answer(result):
+    """True for a real agent answer; errors and parse failures are retried next time."""
+    return isinstance(result, dict) and result.get(ANSWER_FLAG) is True
+
+
+class ResultCache:
+    """SQLite-backed verification cache with per-remark TTL and LRU eviction."""
+
+    def __init__(self, path=None, default_ttl_days=None, remark_ttl_days=None, max_entries=None, namespace=None):
+        self.path = path or config.CACHE_PATH
+        # Entries written under another namespace (backend, endpoint, agent definition) are never read
+        self.namespace = namespace
+        self.default_ttl = (default_ttl_days if default_ttl_days is not None
+                            else config.CACHE_DEFAULT_TTL_DAYS) * SECONDS_PER_DAY
+        ttl_days = remark_ttl_days if remark_ttl_days is not None else config.CACHE_REMARK_TTL_DAYS
+        self.remark_ttls = {normalize_value(k): v * SECONDS_PER_DAY for k, v in ttl_days.items()}
+        self.max_entries = max_entries or config.CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access)")
+        self._conn.commit()
+        # Kept up to date by put/get so eviction does not count the table on every insert
+        self._entries = self._count()
+        self._puts = 0
+
+    def _count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def ttl_for(self, result):
+        """Return the TTL in seconds for a result, based on its remark."""
+        return self.remark_ttls.get(normalize_value(result.get("remark")), self.default_ttl)
+
+    def get(self, row_dict):
+        """Return the cached result for a row, or None on a miss or expired entry."""
+        key = row_key(row_dict, self.namespace)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, expires_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self._entries -= 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, row_dict, result):
+        """Store a result for a row if it is a real agent answer."""
+        if not is_agent_answer(result):
+            return False
+        key = row_key(row_dict, self.namespace)
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, result, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result), now + self.ttl_for(result), now),
+            )
+            self._entries += exists is None
+            self._puts += 1
+            if self._puts % RECOUNT_EVERY_PUTS == 0:
+                self._entries = self._count()
+            self._evict()
+            self._conn.commit()
+        return True
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones above max_entries."""
+        if self._entries <= self.max_entries:
+            return
+        count = self._count()
+        if count <= self.max_entries:
+            self._entries = count
+            return
+        cursor = self._conn.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+        removed = cursor.rowcount
+        overflow = count - removed - self.max_entries
+        if overflow > 0:
+            cursor = self._conn.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            removed += cursor.rowcount
+        self.evictions += removed
+        self._entries = count - removed
+
+    def clear(self):
+        """Remove every cached result."""
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+            self._entries = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,167 @@
+"""
+Tail-latency control for agent runs: per-row deadlines, classified retries and
+cancellation.
+
+Each row attempt runs under a ``RunControl`` bound to the worker thread. The
+run polling loop in agent_api checks it to stop at the row deadline or when a
+hedged duplicate has already won, and ``call_with_retries`` retries transient
+failures with jittered exponential backoff while letting permanent failures
+and throttling (handled by the scheduler) through immediately.
+"""
+
+import random
+import threading
+import time
+
+import config
+from rate_limiter import throttle_retry_after
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+THROTTLED = "throttled"
+CANCELLED = "cancelled"
+
+# Run error codes worth another attempt; anything else from a failed run is permanent
+TRANSIENT_RUN_ERROR_CODES = ("server_error", "internal_error", "timeout", "service_unavailable", "")
+TRANSIENT_HTTP_STATUSES = (408, 500, 502, 503, 504)
+
+_local = threading.local()
+
+
+class RunFailedError(Exception):
+    """An agent run finished with status 'failed' for a reason other than throttling."""
+
+    def __init__(self, run):
+        last_error = getattr(run, "last_error", None)
+        self.code = str(getattr(last_error, "code", "") or "")
+        self.run = run
+        super().__init__(f"Run failed: {self.code} {getattr(last_error, 'message', '') or ''}".strip())
+
+
+class RunDeadlineExceeded(Exception):
+    """The row deadline passed before the agent run finished."""
+
+
+class RunCancelled(Exception):
+    """The run was cancelled because another attempt for the same row already finished."""
+
+
+def classify(exc):
+    """Classify an exception raised by an agent call as transient, permanent, throttled or cancelled."""
+    if isinstance(exc, RunCancelled):
+        return CANCELLED
+    if throttle_retry_after(exc) is not None:
+        return THROTTLED
+    if isinstance(exc, RunDeadlineExceeded):
+        return TRANSIENT
+    if isinstance(exc, RunFailedError):
+        return TRANSIENT if exc.code in TRANSIENT_RUN_ERROR_CODES else PERMANENT
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return TRANSIENT if status in TRANSIENT_HTTP_STATUSES else PERMANENT
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return TRANSIENT
+    # azure.core ServiceRequestError/ServiceResponseError carry no status code
+    if type(exc).__name__ in ("ServiceRequestError", "ServiceResponseError"):
+        return TRANSIENT
+    return PERMANENT
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Full-jitter exponential backoff for the given 1-based retry attempt."""
+    base = config.RETRY_BASE_DELAY_SECONDS if base is None else base
+    cap = config.RETRY_MAX_DELAY_SECONDS if cap is None else cap
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+class RunControl:
+    """Deadline, cancellation flag, retry counter, token usage and web searches for one attempt at a row."""
+
+    def __init__(self, deadline_seconds=None):
+        deadline_seconds = config.ROW_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+        self.deadline_at = time.monotonic() + deadline_seconds if deadline_seconds else None
+        self.cancel_event = threading.Event()
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.grounding_calls = 0
+
+    def record_usage(self, prompt_tokens, completion_tokens):
+        """Add the token usage of one run made under this control."""
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def record_grounding(self, calls):
+        """Add the web-grounding tool calls of one run made under this control."""
+        self.grounding_calls += calls
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without a deadline."""
+        if self.deadline_at is None:
+            return None
+        return self.deadline_at - time.monotonic()
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        """Raise if the attempt has been cancelled or has run past its deadline."""
+        if self.cancelled():
+            raise RunCancelled("Run cancelled")
+        if self.expired():
+            raise RunDeadlineExceeded("Row deadline exceeded")
+
+    def bind(self, fn):
+        """Wrap ``fn`` so agent calls made while it runs use this control."""
+        def wrapper(*args, **kwargs):
+            previous = getattr(_local, "control", None)
+            _local.control = self
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _local.control = previous
+        return wrapper
+
+
+_NO_CONTROL = RunControl(deadline_seconds=0)
+
+
+def current_control():
+    """The RunControl bound to this thread, or a shared one with no deadline."""
+    return getattr(_local, "control", None) or _NO_CONTROL
+
+
+def call_with_retries(fn, *args, max_attempts=None, **kwargs):
+    """
+    Call ``fn``, retrying transient failures with jittered exponential backoff.
+
+    Throttling and cancellation are re-raised immediately (the scheduler
+    re-queues throttled rows); permanent failures are re-raised without retry,
+    as is the last transient failure once attempts or the row deadline run out.
+    """
+    max_attempts = max_attempts or config.RETRY_MAX_ATTEMPTS
+    control = getattr(_local, "control", None)
+    if control is None:
+        # Direct callers get their own deadline for the duration of this call
+        return RunControl().bind(call_with_retries)(fn, *args, max_attempts=max_attempts, **kwargs)
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if classify(e) != TRANSIENT or attempt == max_attempts:
+                raise
+            delay = backoff_delay(attempt)
+            remaining = control.remaining()
+            if remaining is not None and remaining <= delay:
+                raise
+            print(f"Transient agent failure ({e}); retry {attempt} in {delay:.1f}s")
+            control.retries += 1
+            if control.cancel_event.wait(delay):
+                raise RunCancelled("Run cancelled")
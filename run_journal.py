@@ -0,0 +1,165 @@
+"""
+Checkpoint journal and resumable runs.
+
+Every completed row is appended to a per-run JSON-lines journal as soon as its
+agent call finishes, so a crashed worker or a closed browser tab loses at most
+the rows that were still in flight. Resuming a run skips rows already answered
+and re-runs only pending or errored ones.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import config
+from agent_api import process_rows_with_progress
+from result_cache import is_agent_answer
+
+
+def workbook_hash(source):
+    """Return the SHA-256 of a workbook given as a path, bytes or file-like object."""
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        digest.update(source)
+    elif hasattr(source, "read"):
+        source.seek(0)
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+        source.seek(0)
+    else:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_run_id(wb_hash, columns):
+    """Derive a stable run ID from the workbook hash and the columns sent to the agent."""
+    columns_hash = hashlib.sha256("\x1f".join(sorted(map(str, columns))).encode("utf-8")).hexdigest()
+    return f"{wb_hash[:16]}-{columns_hash[:8]}"
+
+
+class RunJournal:
+    """Append-only JSON-lines journal of row results for one run."""
+
+    def __init__(self, run_id, wb_hash, directory=None):
+        self.run_id = run_id
+        self.workbook_hash = wb_hash
+        self.directory = directory or config.JOURNAL_DIR
+        self.path = os.path.join(self.directory, f"{run_id}.jsonl")
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self.path):
+            self._append({"type": "run", "run_id": run_id, "workbook_hash": wb_hash,
+                          "created_at": time.time()})
+
+    def _append(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def record(self, row_number, result):
+        """Append the result of one row, keyed by workbook hash and sheet row number."""
+        self._append({
+            "type": "row",
+            "workbook_hash": self.workbook_hash,
+            "row": row_number,
+            "ok": is_agent_answer(result),
+            "result": result,
+            "ts": time.time(),
+        })
+
+    def load(self):
+        """Return the latest journaled result per row number; truncated trailing lines are ignored."""
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("type") == "row" and record.get("workbook_hash") == self.workbook_hash:
+                    entries[record["row"]] = record
+        return entries
+
+    def completed_results(self):
+        """Return {row_number: result} for rows that already have a real agent answer."""
+        return {row: entry["result"] for row, entry in self.load().items() if entry.get("ok")}
+
+
+def list_runs(directory=None):
+    """Return the run IDs with a journal on disk, most recently updated first."""
+    directory = directory or config.JOURNAL_DIR
+    if not os.path.isdir(directory):
+        return []
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".jsonl")]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    return [os.path.basename(path)[:-len(".jsonl")] for path in paths]
+
+
+def process_rows_resumable(row_dicts, row_numbers, journal, resume=True, progress_callback=None,
+                           stats=None, result_callback=None, **kwargs):
+    """
+    Process rows with every result journaled as it completes.
+
+    Args:
+        row_dicts: List of dictionaries, each representing a row
+        row_numbers: Sheet row number of each entry in row_dicts (the journal key)
+        journal: RunJournal to append results to
+        resume: Skip rows already answered in the journal and re-run only pending or errored ones
+        progress_callback: Function to call with progress updates (completed_count, total_count)
+        stats: Optional dict filled in with batch statistics, including rows_resumed
+        result_callback: Function called with (index, result) for every row, journaled rows first
+        **kwargs: Passed through to process_rows_with_progress
+
+    Returns:
+        List of results in the same order as input rows
+    """
+    done = journal.completed_results() if resume else {}
+    results = [done.get(row_number) for row_number in row_numbers]
+    todo = [i for i, result in enumerate(results) if result is None]
+    resumed = len(row_dicts) - len(todo)
+    if resumed:
+        print(f"Resuming run {journal.run_id}: {resumed} rows already journaled, {len(todo)} to process")
+
+    if result_callback:
+        for i, result in enumerate(results):
+            if result is not None:
+                result_callback(i, result)
+
+    def journal_result(i, result):
+        journal.record(row_numbers[todo[i]], result)
+        if result_callback:
+            result_callback(todo[i], result)
+
+    def report_progress(completed, total):
+        if progress_callback:
+            progress_callback(resumed + completed, len(row_dicts))
+
+    batch_stats = {} if stats is not None else None
+    if todo:
+        fresh = process_rows_with_progress(
+            [row_dicts[i] for i in todo],
+            progress_callback=report_progress,
+            stats=batch_stats,
+            result_callback=journal_result,
+            run_id=journal.run_id,
+            **kwargs,
+        )
+        for i, result in zip(todo, fresh):
+            results[i] = result
+    elif progress_callback:
+        progress_callback(len(row_dicts), len(row_dicts))
+
+    if stats is not None:
+        stats.update(batch_stats)
+        stats["rows_resumed"] = resumed
+        stats["run_id"] = journal.run_id
+    return results
@@ -1,22 +1,48 @@
 
+import io
+import os
+import tempfile
+import time
+import zipfile
 import streamlit as st
-import openpyxl
-from agent_api import process_rows_with_progress
+import config
+import metrics
+from agent_api import BackgroundRun, get_catalog_index, get_result_cache, process_rows_with_progress
+from agent_api_async import process_rows_async_sync
+from excel_io import WorkbookCache, iter_row_dicts, read_headers, sheet_names, write_results
+from input_sources import iter_rows, open_sources, source_kind, write_outputs
+from job_queue import FINAL_STATUSES, JobQueue
+from run_journal import RunJournal, make_run_id, process_rows_resumable, workbook_hash
 
 def main():
+    # Once per server process; Streamlit reruns of this script find them running
+    metrics.start_exporters()
     st.title("Certificate Mapper Agent UI")
     st.write("Upload your Excel file, select columns to send to the agent, and choose columns to update.")
 
-    uploaded_file = st.file_uploader("Upload Excel file", type=["xlsx"])
+    uploaded_files = st.file_uploader(
+        "Upload Excel, CSV or Parquet files", type=["xlsx", "csv", "parquet"], accept_multiple_files=True
+    )
+    uploaded_file = None
+    if len(uploaded_files) == 1 and source_kind(uploaded_files[0].name) == "xlsx":
+        uploaded_file = uploaded_files[0]
+        if len(sheet_names(uploaded_file)) > 1 and st.checkbox("Process several sheets of this workbook"):
+            uploaded_file = None
+    if uploaded_files and uploaded_file is None:
+        # Several files or sheets are verified as one batch and written back file by file
+        show_sources(uploaded_files)
     if uploaded_file:
-        wb = openpyxl.load_workbook(uploaded_file)
-        ws = wb.active
-        rows = list(ws.iter_rows(values_only=True))
-        if not rows:
+        # Streamlit re-executes this script on every widget change; parse each upload only once
+        wb_hash = upload_hash(uploaded_file)
+        parsed = workbook_cache().get(wb_hash, uploaded_file)
+        headers = parsed.headers if parsed else read_headers(uploaded_file)
+        if not headers:
             st.error("No rows found in the uploaded file.")
             return
-        headers = rows[0]
         st.write("Columns in your file:", headers)
+        if parsed:
+            st.caption(f"{len(parsed.rows)} data rows. Column types: "
+                       + ", ".join(f"{h} ({t})" for h, t in parsed.column_types.items()))
         columns_to_send = st.multiselect(
             "Select columns to send to agent:", 
             headers, 
@@ -44,60 +70,393 @@ def main():
         start_row = st.number_input("Start row (inclusive)", min_value=2, value=2, step=1)
         end_row = st.number_input("End row (inclusive)", min_value=start_row, value=start_row, step=1)
         row_numbers = ",".join(str(i) for i in range(start_row, end_row + 1))
-        if st.button("Run Agent on Selected Rows"):
+        use_async = st.checkbox(
+            "Use async engine (many rows in flight on one event loop)", value=False
+        )
+        if use_async:
+            st.caption("The async engine runs one row per agent run in sheet order, without a journal, "
+                       "so batching, provider grouping, resume and the job queue are not available.")
+        batch_size = st.number_input(
+            "Rows per agent run (batched prompts)", min_value=1, max_value=50,
+            value=config.BATCH_SIZE, step=1, disabled=use_async
+        )
+        affinity = st.checkbox(
+            "Group rows by certifier/URL and look each provider up once",
+            value=config.SCHEDULING_MODE == "affinity", disabled=use_async
+        )
+        schedule = "affinity" if affinity else "sheet"
+        run_id = make_run_id(wb_hash, columns_to_send)
+        resume = st.checkbox(
+            "Resume previous run (skip rows already answered for this workbook)", value=True,
+            disabled=use_async
+        )
+        st.caption(f"Run ID: {run_id}")
+        show_metrics = st.checkbox("Record per-stage timing metrics", value=config.METRICS_ENABLED)
+        metrics.set_enabled(show_metrics)
+        use_queue = st.checkbox(
+            "Submit to the background job queue (processed by job_worker.py workers)",
+            value=config.UI_USE_JOB_QUEUE, disabled=use_async
+        )
+        priority = st.number_input("Job priority (higher runs first)", value=0, step=1, disabled=not use_queue)
+        column_map = {new_cert_header: "newCertificateName", remark_header: "remark"}
+        job = st.session_state.get("job")
+        running = job is not None and not job["run"].done
+        if st.button("Run Agent on Selected Rows", disabled=running):
             try:
                 row_nums = [int(x.strip()) for x in row_numbers.split(",") if x.strip().isdigit()]
                 st.write(f"Rows to update: {row_nums}")
                 
-                # Prepare all row data for parallel processing
+                # Only the selected rows and columns, served from the parsed sheet when cached
                 rows_to_process = []
                 row_indices = []
-                
-                for idx in row_nums:
-                    if idx < 2 or idx > len(rows):
-                        st.warning(f"Row {idx} is out of range.")
-                        continue
-                    row = rows[idx-1]
-                    row_dict = {header: value for header, value in zip(headers, row) if header in columns_to_send}
+                source_rows = (parsed.iter_row_dicts(columns_to_send, min(row_nums), max(row_nums)) if parsed
+                               else iter_row_dicts(uploaded_file, columns_to_send, min(row_nums), max(row_nums)))
+                for idx, row_dict in source_rows:
                     rows_to_process.append(row_dict)
                     row_indices.append(idx)
-                
-                if rows_to_process:
-                    st.write(f"Processing {len(rows_to_process)} rows in parallel...")
-                    
-                    # Add progress bar
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    def update_progress(completed, total):
-                        progress = completed / total
-                        progress_bar.progress(progress)
-                        status_text.text(f"Processing: {completed}/{total} rows completed")
-                    
-                    # Process all rows in parallel with progress tracking
-                    results = process_rows_with_progress(
-                        rows_to_process, 
-                        max_workers=3,  # Adjust based on your rate limits
-                        progress_callback=update_progress
+                if len(row_indices) < len(row_nums):
+                    st.warning(f"Rows after {row_indices[-1] if row_indices else 1} are out of range.")
+
+                # The run continues in the background across reruns; each rerun re-attaches to it
+                if use_queue and not use_async:
+                    # Workers run it outside this process; the job ID in the URL survives page refreshes
+                    job_id = job_queue().submit(
+                        uploaded_file, uploaded_file.name, list(zip(row_indices, rows_to_process)), column_map,
+                        priority=int(priority),
+                        options={"max_workers": config.MAX_WORKERS, "batch_size": batch_size,
+                                 "schedule": schedule},
+                    )
+                    st.query_params["job"] = job_id
+                    run = None
+                elif use_async:
+                    run = BackgroundRun(
+                        process_rows_async_sync,
+                        rows_to_process,
+                        row_indices,
+                        max_concurrency=config.ASYNC_MAX_CONCURRENCY,
                     )
-                    
-                    # Update Excel file with results
-                    for idx, result in zip(row_indices, results):
-                        st.write(f"Row {idx} result: {result}")
-                        ws.cell(row=idx, column=headers.index(new_cert_header) + 1, value=result.get("newCertificateName"))
-                        ws.cell(row=idx, column=headers.index(remark_header) + 1, value=result.get("remark"))
-                    
-                    progress_bar.progress(1.0)
-                    status_text.text("✅ All rows processed successfully!")
-                    
-                # Save updated file
-                output_path = "updated_" + uploaded_file.name
-                wb.save(output_path)
-                st.success(f"Updated file saved as {output_path}")
-                with open(output_path, "rb") as f:
-                    st.download_button("Download updated file", f, file_name=output_path)
+                else:
+                    # Journal each row as it completes so an interrupted run can be resumed
+                    journal = RunJournal(run_id, wb_hash)
+                    run = BackgroundRun(
+                        process_rows_resumable,
+                        rows_to_process,
+                        row_indices,
+                        row_indices,
+                        journal,
+                        resume=resume,
+                        max_workers=config.MAX_WORKERS,  # Upper bound; concurrency adapts to throttling
+                        batch_size=batch_size,
+                        schedule=schedule
+                    )
+                if run is not None:
+                    st.session_state["job"] = {"run": run, "run_id": run_id, "workbook_hash": wb_hash,
+                                               "column_map": column_map, "output_path": None}
             except Exception as e:
                 st.error(f"Error: {e}")
 
+        job = st.session_state.get("job")
+        if job and not job.get("sources") and job["workbook_hash"] == wb_hash:
+            show_job(job, show_metrics, uploaded_file)
+
+    if st.query_params.get("job"):
+        show_queued_job(st.query_params["job"])
+
+
+def show_sources(uploaded_files):
+    """Select sheets and columns of several uploads, run them as one batch and offer the updated files."""
+    sheets = {}
+    for i, uploaded in enumerate(uploaded_files):
+        if source_kind(uploaded.name) == "xlsx":
+            names = sheet_names(uploaded)
+            sheets[uploaded.name] = st.multiselect(f"Sheets of {uploaded.name}:", names, default=names,
+                                                   key=f"sheets-{i}-{uploaded.name}")
+    try:
+        sources = open_sources(uploaded_files, sheets)
+        headers = list(dict.fromkeys(h for source in sources for h in source.headers() if h is not None))
+    except (RuntimeError, ValueError) as e:
+        st.error(str(e))
+        return
+    if not headers:
+        st.error("No rows found in the uploaded files.")
+        return
+    st.write("Tables:", [source.label for source in sources])
+    st.write("Columns across your files:", headers)
+    columns_to_send = st.multiselect(
+        "Select columns to send to agent:",
+        headers,
+        default=[h for h in ("URL", "Certifier", "Certification Name") if h in headers]
+    )
+    new_cert_header = st.text_input("New certificate name column (added where missing):",
+                                    "NEW CERTIFICATE NAME BY AGENT")
+    remark_header = st.text_input("Remark column (added where missing):", "AGENT REMARKS")
+    batch_size = st.number_input(
+        "Rows per agent run (batched prompts)", min_value=1, max_value=50,
+        value=config.BATCH_SIZE, step=1, key="sources-batch-size"
+    )
+    affinity = st.checkbox(
+        "Group rows by certifier/URL and look each provider up once",
+        value=config.SCHEDULING_MODE == "affinity", key="sources-affinity"
+    )
+    show_metrics = st.checkbox("Record per-stage timing metrics", value=config.METRICS_ENABLED,
+                               key="sources-metrics")
+    metrics.set_enabled(show_metrics)
+    uploads_hash = "+".join(upload_hash(uploaded) for uploaded in uploaded_files)
+    job = st.session_state.get("job")
+    running = job is not None and not job["run"].done
+    if st.button("Run Agent on All Rows", disabled=running):
+        try:
+            provenances, rows_to_process = [], []
+            for provenance, row_dict in iter_rows(sources, columns_to_send):
+                provenances.append(provenance)
+                rows_to_process.append(row_dict)
+            # One batch across every table, so duplicates are verified once whichever file they are in
+            run = BackgroundRun(
+                process_rows_with_progress,
+                rows_to_process,
+                provenances,
+                max_workers=config.MAX_WORKERS,
+                batch_size=batch_size,
+                schedule="affinity" if affinity else "sheet"
+            )
+            st.session_state["job"] = {"run": run, "run_id": make_run_id(uploads_hash, columns_to_send),
+                                       "workbook_hash": uploads_hash, "sources": sources,
+                                       "column_map": {new_cert_header: "newCertificateName",
+                                                      remark_header: "remark"},
+                                       "output_path": None}
+        except Exception as e:
+            st.error(f"Error: {e}")
+
+    job = st.session_state.get("job")
+    if job and job.get("sources") and job["workbook_hash"] == uploads_hash:
+        show_job(job, show_metrics)
+
+
+def job_queue():
+    """The job queue shared with the workers, opened once per Streamlit session."""
+    if "job_queue" not in st.session_state:
+        st.session_state["job_queue"] = JobQueue()
+    return st.session_state["job_queue"]
+
+
+def show_queued_job(job_id):
+    """Poll a queued job until it finishes, with a cancel button, then offer its output."""
+    queue = job_queue()
+    job = queue.job(job_id)
+    if job is None:
+        st.warning(f"Job {job_id} not found.")
+        return
+    st.subheader(f"Job {job_id}: {job['name']}")
+    if job["status"] not in FINAL_STATUSES and st.button("Cancel job"):
+        queue.cancel(job_id)
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    live_table = st.empty()
+    while True:
+        job = queue.job(job_id)
+        progress_bar.progress(job["completed"] / max(job["total"], 1))
+        status_text.text(f"Job {job['status']}: {job['completed']}/{job['total']} rows completed")
+        if job["status"] in FINAL_STATUSES:
+            break
+        latest = queue.results(job_id, latest=config.UI_PAGE_SIZE)
+        live_table.dataframe(result_table(latest, latest))
+        time.sleep(config.UI_REFRESH_SECONDS)
+    live_table.empty()
+
+    if job["status"] == "failed":
+        st.error(f"Job failed: {job['error']}")
+    elif job["status"] == "cancelled":
+        st.warning(f"Job cancelled after {job['completed']} of {job['total']} rows.")
+    if job["stats"].get("total_tokens"):
+        st.caption(f"Tokens: {job['stats']['prompt_tokens']} prompt, {job['stats']['completion_tokens']} "
+                   f"completion (estimated cost {round(job['stats']['cost'], 6)})")
+    show_results(queue.results(job_id), key=f"job-{job_id}")
+    if job["output_path"]:
+        with open(job["output_path"], "rb") as f:
+            st.download_button("Download updated file", f, file_name="updated_" + job["name"],
+                               key=f"download-{job_id}")
+
+
+def upload_hash(uploaded_file):
+    """Content hash of an upload, computed once per uploaded file."""
+    file_id = getattr(uploaded_file, "file_id", None)
+    if file_id is None:
+        return workbook_hash(uploaded_file)
+    hashes = st.session_state.setdefault("upload_hashes", {})
+    if file_id not in hashes:
+        hashes[file_id] = workbook_hash(uploaded_file)
+    return hashes[file_id]
+
+
+def workbook_cache():
+    """This browser session's cache of parsed uploads."""
+    if "workbook_cache" not in st.session_state:
+        st.session_state["workbook_cache"] = WorkbookCache()
+    return st.session_state["workbook_cache"]
+
+
+def show_job(job, show_metrics, uploaded_file=None):
+    """Follow a background run until it finishes, then write and offer the updated workbook or files."""
+    run = job["run"]
+    if run.total:
+        st.write(f"Processing {run.total} rows in parallel...")
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    live_table = st.empty()
+    download_slot = st.empty()
+    metrics_panel = st.empty()
+
+    # Redraw once per UI_REFRESH_SECONDS until the run is done; a widget change
+    # interrupts this loop, not the run, and the rerun picks it up again
+    last_partial = time.monotonic()
+    partial_downloads = 0
+    while not run.done:
+        results_by_row = run.results()
+        progress_bar.progress(len(results_by_row) / max(run.total, 1))
+        status_text.text(f"Processing: {len(results_by_row)}/{run.total} rows completed")
+        latest = list(results_by_row)[-config.UI_PAGE_SIZE:]
+        live_table.dataframe(result_table(results_by_row, reversed(latest)))
+        if show_metrics:
+            metrics_panel.table(metrics.summary_rows())
+        if time.monotonic() - last_partial >= config.UI_PARTIAL_DOWNLOAD_SECONDS:
+            last_partial = time.monotonic()
+            partial_downloads += 1
+            data, file_name = partial_output(job, uploaded_file, results_by_row)
+            download_slot.download_button(
+                f"Download partial results ({len(results_by_row)}/{run.total} rows)",
+                data,
+                file_name=file_name,
+                key=f"partial-{job['run_id']}-{partial_downloads}",
+            )
+        time.sleep(config.UI_REFRESH_SECONDS)
+    live_table.empty()
+    download_slot.empty()
+    if show_metrics:
+        metrics_panel.table(metrics.summary_rows())
+    if run.error is not None:
+        status_text.empty()
+        st.error(f"Error: {run.error}")
+        return
+
+    batch_stats = run.stats
+    run_id = job["run_id"]
+    if batch_stats.get("rows_resumed"):
+        st.info(f"Resumed run {run_id}: {batch_stats['rows_resumed']} rows reused from the journal.")
+    if batch_stats.get("throttled"):
+        st.warning(
+            f"Agent service throttled {batch_stats['throttled']} requests; "
+            f"{batch_stats['throttled_requeues']} rows were re-queued. "
+            f"Final concurrency: {batch_stats['concurrency_limit']}."
+        )
+    if batch_stats.get("agent_calls_saved"):
+        st.info(
+            f"{batch_stats['agent_calls_saved']} duplicate rows reused another row's result "
+            f"({batch_stats['agent_calls']} agent calls for {batch_stats['rows']} rows)."
+        )
+    if batch_stats.get("schedule") == "affinity" and batch_stats.get("provider_groups"):
+        st.info(
+            f"{batch_stats['provider_groups']} provider groups: {batch_stats['provider_contexts_built']} "
+            f"provider summaries built, {batch_stats['grounding_calls']} web searches for "
+            f"{batch_stats['agent_calls']} agent calls."
+        )
+    if batch_stats.get("token_budget_reached"):
+        st.warning(f"Token budget reached after {batch_stats['total_tokens']} tokens.")
+    if batch_stats.get("total_tokens"):
+        st.caption(
+            f"Tokens: {batch_stats['prompt_tokens']} prompt, {batch_stats['completion_tokens']} completion "
+            f"(estimated cost {batch_stats['cost']})"
+        )
+    progress_bar.progress(1.0)
+    status_text.text("✅ All rows processed successfully!")
+
+    cache = get_result_cache()
+    if cache is not None:
+        stats = cache.stats()
+        st.caption(
+            f"Result cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['entries']} entries stored"
+        )
+    catalog = get_catalog_index()
+    if catalog is not None:
+        stats = catalog.stats()
+        st.caption(
+            f"Catalog index: {stats['exact'] + stats['fuzzy']} rows answered locally "
+            f"({stats['exact']} exact, {stats['fuzzy']} fuzzy), "
+            f"{stats['ambiguous']} ambiguous and {stats['stale']} stale sent to the agent"
+        )
+
+    results_by_row = run.results()
+    if job["output_path"] is None:
+        # Stream the updated file to disk with results merged by row number, once per run
+        if job.get("sources"):
+            output_path = write_sources(job["sources"], results_by_row, job["column_map"], ".", "updated_")
+        else:
+            output_path = "updated_" + uploaded_file.name
+            write_results(uploaded_file, output_path, results_by_row, job["column_map"])
+        job["output_path"] = output_path
+    st.success(f"Updated file saved as {job['output_path']}")
+    show_results(results_by_row)
+    with open(job["output_path"], "rb") as f:
+        st.download_button("Download updated file", f, file_name=os.path.basename(job["output_path"]))
+
+
+def result_table(results_by_row, row_numbers):
+    """Table rows (one dict per sheet row, without bookkeeping keys) for the given row numbers."""
+    # Multi-file runs key their results by provenance (file, sheet, row) rather than row number
+    return [{"Row": row_number if isinstance(row_number, int) else str(row_number),
+             **{k: v for k, v in results_by_row[row_number].items() if not k.startswith("_")}}
+            for row_number in row_numbers]
+
+
+def write_sources(sources, results, column_map, output_dir, prefix):
+    """
+    Write the updated copy of every uploaded file, zipping them together when there are several.
+
+    Returns:
+        Path of the single output file, or of the zip archive holding all of them
+    """
+    output_paths = write_outputs(sources, results, column_map, output_dir, prefix)
+    if len(output_paths) == 1:
+        return output_paths[0]
+    archive_path = os.path.join(output_dir, prefix + "files.zip")
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for output_path in output_paths:
+            archive.write(output_path, os.path.basename(output_path))
+    return archive_path
+
+
+def partial_output(job, uploaded_file, results_by_row):
+    """The results so far merged into the uploads, as (bytes, file name) for a download button."""
+    if not job.get("sources"):
+        return workbook_bytes(uploaded_file, results_by_row, job["column_map"]), "partial_" + uploaded_file.name
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_path = write_sources(job["sources"], results_by_row, job["column_map"], output_dir, "partial_")
+        with open(output_path, "rb") as f:
+            return f.read(), os.path.basename(output_path)
+
+
+def workbook_bytes(uploaded_file, results_by_row, column_map):
+    """The uploaded workbook with the results so far merged in, as bytes for a download button."""
+    buffer = io.BytesIO()
+    write_results(uploaded_file, buffer, results_by_row, column_map)
+    return buffer.getvalue()
+
+
+def show_results(results_by_row, key="results"):
+    """Paginated table of a finished run's results, in sheet row order."""
+    if not results_by_row:
+        return
+    row_numbers = sorted(results_by_row)
+    page_size = st.selectbox("Results per page", sorted({config.UI_PAGE_SIZE, 100, 500, 1000}),
+                             key=f"{key}-page-size")
+    pages = (len(row_numbers) + page_size - 1) // page_size
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1,
+                           key=f"{key}-page")
+    start = (page - 1) * page_size
+    st.dataframe(result_table(results_by_row, row_numbers[start:start + page_size]))
+    st.caption(f"Rows {row_numbers[start]}-{row_numbers[min(start + page_size, len(row_numbers)) - 1]} "
+               f"of {len(row_numbers)} results")
+
+
 if __name__ == "__main__":
     main()
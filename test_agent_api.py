@@ -0,0 +1,272 @@
+"""
+Tests for row scheduling and verification in agent_api.py, on the fake backend.
+"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import agent_api
+import config
+from agent_registry import AgentRegistry
+from fake_backend import FakeProjectClient
+from result_cache import is_agent_answer
+from retry_policy import RunControl
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "CATALOG_ENABLED", False)
+    monkeypatch.setattr(agent_api, "_agent_registry", AgentRegistry(path=""))
+    client = FakeProjectClient(latency=0)
+    agent_api.use_backend(client)
+    yield client
+    agent_api.use_backend(None)
+
+
+def rows(count, certifier="Example"):
+    return [{"URL": f"https://example.com/{i}", "Certifier": certifier, "Certification Name": f"Cert {i}"}
+            for i in range(count)]
+
+
+# Deduplication
+
+def test_duplicates_group_after_normalization():
+    row_dicts = rows(3) + [{"URL": " https://EXAMPLE.com/1", "Certifier": "example ",
+                            "Certification Name": "cert  1"}]
+    assert list(agent_api.group_duplicate_rows(row_dicts).values()) == [[0], [1, 3], [2]]
+
+
+def test_sheet_units_follow_the_sheet_in_batches():
+    row_dicts = rows(5)
+    groups = list(agent_api.group_duplicate_rows(row_dicts).values())
+    units = [unit for unit, _, _ in agent_api.plan_units(row_dicts, groups, 2, "sheet")]
+    assert units == [[[0], [1]], [[2], [3]], [[4]]]
+
+
+def test_duplicates_are_verified_once_and_fanned_out(fake):
+    row_dicts = rows(3) * 3
+    stats = {}
+    results = agent_api.process_rows_with_progress(row_dicts, max_workers=4, stats=stats)
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(3)] * 3
+    assert all(is_agent_answer(r) for r in results)
+    assert (stats["agent_calls"], stats["agent_calls_saved"]) == (3, 6)
+    assert fake.calls["messages.create"] == 3
+    # Every row gets its own copy of the shared result
+    results[0]["remark"] = "changed"
+    assert results[3]["remark"] != "changed"
+
+
+def test_every_duplicate_is_reported_to_the_callbacks(fake):
+    completed, progress = [], []
+    agent_api.process_rows_with_progress(rows(2) * 2, max_workers=2,
+                                         result_callback=lambda i, result: completed.append(i),
+                                         progress_callback=lambda done, total: progress.append((done, total)))
+    assert sorted(completed) == [0, 1, 2, 3]
+    assert progress[-1] == (4, 4)
+
+
+# Batched prompts
+
+def test_batch_reply_rows_are_matched_by_id():
+    reply = ('[{"id": 2, "newCertificateName": "C", "remark": "Certificate exists."},'
+             ' {"id": 0, "newCertificateName": "A", "remark": "Certificate exists."},'
+             ' {"id": 0, "newCertificateName": "A2", "remark": "Certificate exists."},'
+             ' {"id": 7, "newCertificateName": "X", "remark": "Certificate exists."},'
+             ' {"id": "one", "newCertificateName": "B", "remark": "Certificate exists."}]')
+    results = agent_api.parse_batch_reply(reply, 3)
+    assert [r and r["newCertificateName"] for r in results] == ["A", None, "C"]
+    assert agent_api.parse_batch_reply("Sorry, no JSON today", 3) == [None] * 3
+
+
+def record_batches(monkeypatch, drop_first=()):
+    """Record the size of every batch run; the first run leaves out the rows at ``drop_first``."""
+    sizes = []
+    original = agent_api.call_agent_batch
+
+    def call_agent_batch(row_dicts, context=None):
+        answers = original(row_dicts, context)
+        if not sizes:
+            answers = [None if i in drop_first else answer for i, answer in enumerate(answers)]
+        sizes.append(len(row_dicts))
+        return answers
+    monkeypatch.setattr(agent_api, "call_agent_batch", call_agent_batch)
+    return sizes
+
+
+def test_one_run_per_batch_in_row_order(fake, monkeypatch):
+    sizes = record_batches(monkeypatch)
+    results = agent_api.verify_rows_batched(rows(5))
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(5)]
+    assert all(is_agent_answer(r) for r in results)
+    assert sizes == [5]
+    assert fake.calls["messages.create"] == 1
+
+
+def test_missing_rows_are_split_and_keep_their_order(fake, monkeypatch):
+    sizes = record_batches(monkeypatch, drop_first={1, 2, 3, 4})
+    results = agent_api.verify_rows_batched(rows(5))
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(5)]
+    assert sizes == [5, 2, 2]
+
+
+def test_single_missing_row_uses_the_one_row_path(fake, monkeypatch):
+    sizes = record_batches(monkeypatch, drop_first={3})
+    results = agent_api.verify_rows_batched(rows(4))
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(4)]
+    assert sizes == [4]
+    assert fake.calls["messages.create"] == 2
+
+
+def test_expired_deadline_marks_rows_timed_out_without_splitting(fake, monkeypatch):
+    sizes = record_batches(monkeypatch, drop_first={0, 1, 2, 3})
+    control = RunControl(deadline_seconds=0.01)
+    time.sleep(0.02)
+    results = control.bind(agent_api.verify_rows_batched)(rows(4))
+    assert all(r["Certification Name"] == "Run timed out" for r in results)
+    assert sizes == []
+    assert fake.calls["messages.create"] == 1
+
+
+# Run completion
+
+class PollOnlyRuns:
+    """The fake backend's runs operations without runs.stream, like an older SDK."""
+
+    def __init__(self, runs):
+        self._runs = runs
+
+    def __getattr__(self, name):
+        if name == "stream":
+            raise AttributeError(name)
+        return getattr(self._runs, name)
+
+
+@pytest.fixture
+def fast_polls(monkeypatch):
+    monkeypatch.setattr(config, "RUN_POLL_INITIAL_SECONDS", 0.001)
+    monkeypatch.setattr(config, "RUN_POLL_INTERVAL_SECONDS", 0.005)
+
+
+def test_streamed_runs_need_no_polls_or_message_lists(fake, monkeypatch):
+    monkeypatch.setattr(config, "RUN_COMPLETION_MODE", "stream")
+    stats = {}
+    results = agent_api.process_rows_with_progress(rows(3), max_workers=2, stats=stats)
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(3)]
+    assert fake.calls["runs.stream"] == 3
+    assert fake.calls["runs.get"] == fake.calls["messages.list"] == fake.calls["run_steps.list"] == 0
+    assert stats["grounding_calls"] == 3
+
+
+def test_streaming_falls_back_to_polling_when_the_backend_lacks_it(fake, fast_polls, monkeypatch):
+    monkeypatch.setattr(config, "RUN_COMPLETION_MODE", "stream")
+    fake.agents.runs = PollOnlyRuns(fake.agents.runs)
+    stats = {}
+    results = agent_api.process_rows_with_progress(rows(3), max_workers=2, stats=stats)
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(3)]
+    assert agent_api._streaming_unavailable
+    assert fake.calls["runs.stream"] == 0
+    assert fake.calls["runs.create"] == fake.calls["messages.list"] == 3
+    assert stats["grounding_calls"] == 3
+
+
+def test_poll_mode_never_streams(fake, fast_polls, monkeypatch):
+    monkeypatch.setattr(config, "RUN_COMPLETION_MODE", "poll")
+    results = agent_api.process_rows_with_progress(rows(2), max_workers=2)
+    assert all(is_agent_answer(r) for r in results)
+    assert fake.calls["runs.stream"] == 0 and fake.calls["runs.create"] == 2
+
+
+def test_run_step_events_do_not_replace_the_run():
+    step = SimpleNamespace(status="completed", type="tool_calls")
+    run = SimpleNamespace(status="in_progress")
+    assert agent_api.read_run_event("thread.run.step.completed", step) == (None, None)
+    assert agent_api.read_run_event("thread.run.in_progress", run) == (run, None)
+    message = SimpleNamespace(role="assistant", content=[SimpleNamespace(text=SimpleNamespace(value="{}"))])
+    assert agent_api.read_run_event("thread.message.completed", message) == (None, "{}")
+
+
+# Incremental results
+
+def test_results_are_yielded_as_rows_complete(fake):
+    fake.state.latency = lambda: 0.01
+    yielded = []
+    for i, result in agent_api.iter_rows_with_progress(rows(6), max_workers=2):
+        yielded.append((i, result["newCertificateName"], time.monotonic()))
+    assert sorted((i, name) for i, name, _ in yielded) == [(i, f"Cert {i}") for i in range(6)]
+    # The first rows arrive while the rest are still running
+    assert yielded[-1][2] - yielded[0][2] > 0.01
+
+
+def test_rows_completed_before_a_failure_are_yielded_first():
+    def process(row_dicts, result_callback):
+        result_callback(1, {"newCertificateName": "B"})
+        raise RuntimeError("Backend went away")
+    results = agent_api.iter_results(process, rows(2))
+    assert next(results) == (1, {"newCertificateName": "B"})
+    with pytest.raises(RuntimeError, match="went away"):
+        next(results)
+
+
+def test_background_run_keys_results_by_sheet_row(fake):
+    run = agent_api.BackgroundRun(agent_api.process_rows_with_progress, rows(3), [5, 6, 7], max_workers=2)
+    assert run.wait(timeout=5)
+    assert run.error is None and run.completed == run.total == 3
+    assert {row: result["newCertificateName"] for row, result in run.results().items()} == {
+        5: "Cert 0", 6: "Cert 1", 7: "Cert 2"}
+    assert run.stats["rows"] == 3
+
+
+def test_background_run_records_the_error():
+    def process(row_dicts, result_callback, stats):
+        raise RuntimeError("Backend went away")
+    run = agent_api.BackgroundRun(process, rows(1), [2])
+    assert run.wait(timeout=5)
+    assert str(run.error) == "Backend went away" and run.results() == {}
+
+
+# Prompts and token usage
+
+def test_prompt_sends_only_the_instruction_fields_compacted(monkeypatch):
+    monkeypatch.setattr(config, "PROMPT_MAX_VALUE_CHARS", 20)
+    row = {"URL": "https://ex.com/1", "Certifier": " Example\n Inc ", "Certification Name": "A" * 30,
+           "Internal notes": "Not for the agent"}
+    assert agent_api.format_row(row) == ("URL: https://ex.com/1, Certifier: Example Inc, "
+                                         "Certification Name: " + "A" * 19 + "…")
+    assert agent_api.format_row({"Title": "Cert"}) == "Title: Cert"
+
+
+def test_token_cost_uses_the_configured_prices(monkeypatch):
+    monkeypatch.setattr(config, "PROMPT_TOKEN_PRICE_PER_1K", 0.5)
+    monkeypatch.setattr(config, "COMPLETION_TOKEN_PRICE_PER_1K", 2.0)
+    assert agent_api.token_cost(2000, 500) == 2.0
+    assert agent_api.run_usage(SimpleNamespace(usage=None)) == (0, 0)
+
+
+def test_batch_usage_is_shared_over_its_rows(fake):
+    stats = {}
+    results = agent_api.process_rows_with_progress(rows(2), max_workers=1, batch_size=2, stats=stats)
+    assert fake.calls["messages.create"] == 1
+    assert results[0]["_prompt_tokens"] == results[1]["_prompt_tokens"] == stats["prompt_tokens"] / 2
+    assert results[0]["_completion_tokens"] == stats["completion_tokens"] / 2
+    assert stats["total_tokens"] == stats["prompt_tokens"] + stats["completion_tokens"] > 0
+
+
+def test_spent_token_budget_stops_the_rows_not_yet_started(fake, monkeypatch):
+    monkeypatch.setattr(config, "TOKEN_BUDGET_ACTION", "stop")
+    stats = {}
+    results = agent_api.process_rows_with_progress(rows(4), max_workers=1, token_budget=1, stats=stats)
+    assert is_agent_answer(results[0])
+    assert all(r["Certification Name"] == "Error: Token budget of 1 tokens reached" for r in results[1:])
+    assert fake.calls["messages.create"] == 1
+    assert stats["token_budget_reached"]
+
+
+def test_spent_token_budget_slows_the_batch_to_one_run(fake, monkeypatch):
+    monkeypatch.setattr(config, "TOKEN_BUDGET_ACTION", "slow")
+    stats = {}
+    results = agent_api.process_rows_with_progress(rows(4), max_workers=4, token_budget=1, stats=stats)
+    assert all(is_agent_answer(r) for r in results)
+    assert stats["token_budget_reached"] and stats["concurrency_limit"] == 1
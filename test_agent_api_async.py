@@ -0,0 +1,120 @@
+"""
+Tests for the asyncio execution engine (agent_api_async.py) on the fake async backend.
+"""
+
+import asyncio
+
+import pytest
+
+import agent_api
+import agent_api_async
+import config
+from agent_registry import AgentRegistry
+from fake_backend import FakeAsyncProjectClient
+from result_cache import ResultCache, is_agent_answer
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "CATALOG_ENABLED", False)
+    monkeypatch.setattr(agent_api, "_agent_registry", AgentRegistry(path=""))
+
+
+def rows(count):
+    return [{"URL": f"https://example.com/{i}", "Certifier": "Example", "Certification Name": f"Cert {i}"}
+            for i in range(count)]
+
+
+def run(row_dicts, client, **kwargs):
+    return asyncio.run(agent_api_async.process_rows_async(row_dicts, client=client, **kwargs))
+
+
+def test_rows_are_answered_in_order_and_threads_deleted():
+    client = FakeAsyncProjectClient(latency=0)
+    stats = {}
+    results = run(rows(6), client, stats=stats)
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(6)]
+    assert all(is_agent_answer(r) for r in results)
+    assert client.calls["threads.create"] == client.calls["threads.delete"] == 6
+    assert stats["rows"] == 6 and stats["total_tokens"] > 0
+
+
+def test_rows_in_flight_never_exceed_max_concurrency(monkeypatch):
+    in_flight, peak = [0], [0]
+    call_agent_async = agent_api_async.call_agent_async
+
+    async def counted(*args, **kwargs):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        try:
+            return await call_agent_async(*args, **kwargs)
+        finally:
+            in_flight[0] -= 1
+    monkeypatch.setattr(agent_api_async, "call_agent_async", counted)
+    results = run(rows(12), FakeAsyncProjectClient(latency=0.02), max_concurrency=3)
+    assert all(is_agent_answer(r) for r in results)
+    assert peak[0] == 3
+
+
+def test_duplicates_are_verified_once_and_fanned_out():
+    client = FakeAsyncProjectClient(latency=0)
+    stats = {}
+    completed = []
+    results = run(rows(3) * 3, client, stats=stats, result_callback=lambda i, result: completed.append(i))
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(3)] * 3
+    assert client.calls["threads.create"] == 3
+    assert (stats["agent_calls"], stats["agent_calls_saved"]) == (3, 6)
+    assert sorted(completed) == list(range(9))
+    results[0]["remark"] = "changed"
+    assert results[3]["remark"] != "changed"
+
+
+def test_failed_runs_become_error_rows():
+    results = run(rows(3), FakeAsyncProjectClient(latency=0, failure_rate=1.0))
+    assert all(r["Certification Name"] == "Run failed" for r in results)
+    assert not any(is_agent_answer(r) for r in results)
+
+
+def test_exhausted_throttle_retries_become_error_rows(monkeypatch):
+    monkeypatch.setattr(config, "THROTTLE_MAX_REQUEUES", 0)
+    client = FakeAsyncProjectClient(latency=0, throttle_rate=1.0)
+    results = run(rows(2), client)
+    assert all(r["Certification Name"].startswith("Error: Run throttled") for r in results)
+    assert client.calls["threads.create"] == client.calls["threads.delete"] == 2
+
+
+def test_token_budget_skips_rows_once_spent(monkeypatch):
+    monkeypatch.setattr(config, "TOKEN_BUDGET_ACTION", "stop")
+    stats = {}
+    results = run(rows(4), FakeAsyncProjectClient(latency=0), max_concurrency=1, token_budget=1, stats=stats)
+    assert is_agent_answer(results[0])
+    assert all("Token budget" in r["Certification Name"] for r in results[1:])
+    assert stats["token_budget_reached"]
+
+
+def test_call_agent_async_uses_the_result_cache(tmp_path, monkeypatch):
+    cache = ResultCache(path=str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(agent_api_async, "get_result_cache", lambda: cache)
+    client = FakeAsyncProjectClient(latency=0)
+
+    async def verify_twice():
+        agent = await agent_api_async.resolve_agent_async(client)
+        first = await agent_api_async.call_agent_async(rows(1)[0], client, agent.id)
+        second = await agent_api_async.call_agent_async(rows(1)[0], client, agent.id)
+        return first, second
+    first, second = asyncio.run(verify_twice())
+    assert first == second and is_agent_answer(first)
+    assert client.calls["threads.create"] == 1
+    cache.close()
+
+
+def test_sync_wrapper_builds_the_configured_fake_client(monkeypatch):
+    monkeypatch.setattr(config, "AGENT_BACKEND", "fake")
+    monkeypatch.setattr(config, "FAKE_LATENCY_MODEL", "constant")
+    monkeypatch.setattr(config, "FAKE_LATENCY_SECONDS", 0)
+    progress = []
+    results = agent_api_async.process_rows_async_sync(
+        rows(4), progress_callback=lambda done, total: progress.append((done, total)))
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(4)]
+    assert progress[-1] == (4, 4)
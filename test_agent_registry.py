@@ -0,0 +1,129 @@
+"""
+Tests for the agent registry (agent_registry.py) and agent reuse and cleanup in agent_api.py.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import agent_api
+import config
+from agent_registry import AgentRegistry, definition_key, matches_definition
+from fake_backend import FakeProjectClient
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return AgentRegistry(path=str(tmp_path / "agents.json"))
+
+
+@pytest.fixture
+def fake(registry, monkeypatch):
+    monkeypatch.setattr(config, "AGENT_BACKEND", "fake")
+    monkeypatch.setattr(agent_api, "_agent_registry", registry)
+    client = FakeProjectClient(latency=0)
+    agent_api.use_backend(client)
+    yield client
+    agent_api.use_backend(None)
+
+
+def test_entries_round_trip(registry):
+    registry.save("a", "asst_1")
+    registry.save("b", "asst_2")
+    registry.save("c", "asst_2")
+    assert AgentRegistry(path=registry.path).lookup("a") == "asst_1"
+    assert registry.agent_ids() == {"asst_1", "asst_2"}
+    registry.forget(agent_id="asst_2")
+    assert registry.agent_ids() == {"asst_1"}
+    registry.forget("a")
+    assert registry.lookup("a") is None
+
+
+def test_unreadable_or_disabled_registry_is_empty(registry):
+    with open(registry.path, "w", encoding="utf-8") as f:
+        f.write("{not json")
+    assert registry.load() == {}
+    disabled = AgentRegistry(path="")
+    disabled.save("a", "asst_1")
+    assert disabled.lookup("a") is None and not disabled.enabled
+
+
+def test_definition_key_changes_with_the_instructions():
+    assert definition_key("https://x", "mapper", "gpt", "v1") != definition_key("https://x", "mapper", "gpt", "v2")
+    agent = type("Agent", (), {"name": "mapper", "model": "gpt", "metadata": {}, "instructions": "v1"})()
+    assert matches_definition(agent, "mapper", "gpt", "v1")
+    assert not matches_definition(agent, "mapper", "gpt", "v2")
+
+
+def test_lock_serializes_holders(registry):
+    inside, overlaps = [0], [0]
+
+    def hold():
+        with registry.locked():
+            inside[0] += 1
+            overlaps[0] = max(overlaps[0], inside[0])
+            time.sleep(0.01)
+            inside[0] -= 1
+    threads = [threading.Thread(target=hold) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlaps[0] == 1
+
+
+def test_async_lock_keeps_the_event_loop_running(registry):
+    async def main():
+        ticks = []
+
+        async def tick():
+            for _ in range(3):
+                ticks.append(1)
+                await asyncio.sleep(0.005)
+        with registry.locked():
+            # Another holder has the lock; the waiting coroutine must not block the loop
+            waiter = asyncio.create_task(acquire())
+            await tick()
+            assert not waiter.done()
+        await waiter
+        return ticks
+
+    async def acquire():
+        async with registry.locked_async():
+            pass
+    assert len(asyncio.run(main())) == 3
+
+
+def test_registered_agent_is_reused_across_processes(fake):
+    first = agent_api.get_agent()
+    assert fake.calls["create_agent"] == 1
+    agent_api.use_backend(fake)
+    assert agent_api.get_agent().id == first.id
+    assert fake.calls["create_agent"] == 1 and fake.calls["get_agent"] == 1
+
+
+def test_stale_registry_entry_is_resolved_again(fake, registry):
+    registry.save(agent_api.agent_definition_key(agent_api.load_instructions()), "asst_gone")
+    agent = agent_api.get_agent()
+    assert agent.id != "asst_gone"
+    assert registry.agent_ids() == {agent.id}
+
+
+def test_cleanup_keeps_the_agent_in_use_registered_and_recent_agents(fake, registry):
+    in_use = agent_api.get_agent()
+    old = time.time() - 48 * 3600
+    orphan = fake.state.new_agent(agent_api.AGENT_NAME)
+    registered = fake.state.new_agent(agent_api.AGENT_NAME)
+    other = fake.state.new_agent("someone-elses-agent")
+    for agent in (orphan, registered, other, in_use):
+        agent.created_at = old
+    recent = fake.state.new_agent(agent_api.AGENT_NAME)
+    registry.save("earlier-definition", registered.id)
+
+    assert agent_api.cleanup_orphaned_agents(min_age_hours=24, dry_run=True) == [orphan.id]
+    assert fake.calls["delete_agent"] == 0
+    assert agent_api.cleanup_orphaned_agents(min_age_hours=24) == [orphan.id]
+    remaining = {agent.id for agent in fake.state.list_agents()}
+    assert remaining == {in_use.id, registered.id, other.id, recent.id}
@@ -0,0 +1,100 @@
+"""
+Tests for the agent thread pool (agent_threads.py).
+"""
+
+import time
+
+import pytest
+
+import agent_api
+import config
+from agent_registry import AgentRegistry
+from agent_threads import REUSED_THREAD_TRUNCATION, AgentThreadPool
+from fake_backend import FakeProjectClient
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def client():
+    return FakeProjectClient(latency=0)
+
+
+def test_threads_are_reused_up_to_max_runs(client):
+    pool = AgentThreadPool(lambda: client, max_runs=2, prefetch=0)
+    first = pool.acquire()
+    pool.release(first, reusable=True)
+    assert pool.acquire() == first
+    pool.release(first, reusable=True)
+    second = pool.acquire()
+    assert second != first
+    pool.release(second, reusable=True)
+    pool.close()
+    assert pool.stats()["threads_created"] == 2 and pool.stats()["threads_reused"] == 1
+    assert client.calls["threads.delete"] == 2 and not client.state.threads
+
+
+def test_threads_of_failed_runs_are_retired(client):
+    pool = AgentThreadPool(lambda: client, max_runs=5, prefetch=0)
+    first = pool.acquire()
+    pool.release(first, reusable=False)
+    second = pool.acquire()
+    assert second != first
+    pool.release(second, reusable=True)
+    pool.close()
+    assert client.calls["threads.delete"] == 2
+
+
+def test_reused_threads_truncate_to_the_newest_message(client):
+    assert AgentThreadPool(lambda: client, max_runs=3).run_options == {"truncation_strategy": REUSED_THREAD_TRUNCATION}
+    assert AgentThreadPool(lambda: client, max_runs=1).run_options == {}
+
+
+def test_prefetch_never_exceeds_the_runs_waiting(client):
+    pool = AgentThreadPool(lambda: client, max_runs=1, prefetch=3)
+    pool.set_waiting(0)
+    pool.release(pool.acquire(), reusable=True)
+    time.sleep(0.05)
+    assert pool.stats()["threads_created"] == 1
+    pool.set_waiting(2)
+    wait_until(lambda: pool.stats()["threads_created"] == 3)
+    time.sleep(0.05)
+    assert pool.stats()["threads_created"] == 3
+    pool.release(pool.acquire(), reusable=True)
+    assert pool.stats()["threads_prefetched"] == 1
+    pool.close()
+    # Every thread the pool created is gone, including the prefetched one never used
+    assert client.calls["threads.delete"] == 3 and not client.state.threads
+
+
+def test_closed_pool_refuses_new_runs(client):
+    pool = AgentThreadPool(lambda: client, prefetch=0)
+    pool.close()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+
+def test_batch_reuses_threads_and_deletes_them_at_the_end(monkeypatch):
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "CATALOG_ENABLED", False)
+    monkeypatch.setattr(config, "THREAD_MAX_RUNS", 4)
+    monkeypatch.setattr(agent_api, "_agent_registry", AgentRegistry(path=""))
+    client = FakeProjectClient(latency=0.005)
+    agent_api.use_backend(client)
+    try:
+        row_dicts = [{"URL": f"https://example.com/{i}", "Certifier": "Example", "Certification Name": f"Cert {i}"}
+                     for i in range(8)]
+        stats = {}
+        results = agent_api.process_rows_with_progress(row_dicts, max_workers=2, stats=stats)
+    finally:
+        agent_api.use_backend(None)
+    # Reused threads only answer their newest row
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(8)]
+    assert stats["threads_reused"] > 0
+    assert client.calls["threads.create"] < 8
+    assert client.calls["threads.create"] == client.calls["threads.delete"]
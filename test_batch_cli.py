@@ -0,0 +1,83 @@
+"""
+Tests for shard partitioning and result merging in the headless batch runner (batch_cli.py).
+"""
+
+import argparse
+from collections import Counter
+
+import openpyxl
+import pytest
+
+import batch_cli
+
+HEADERS = ["URL", "Certifier", "Certification Name", "NEW CERTIFICATE NAME BY AGENT", "AGENT REMARKS"]
+
+
+def rows(count, certifier="Example"):
+    return [{"URL": f"https://example.com/{i}", "Certifier": certifier, "Certification Name": f"Cert {i}"}
+            for i in range(count)]
+
+
+def answer(name):
+    return {"newCertificateName": name, "remark": "Certificate exists.", "_answer": True}
+
+
+def test_parse_shard():
+    assert batch_cli.parse_shard("2/4") == (2, 4)
+    for value in ("0/4", "5/4", "1/0", "two/4", "1"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            batch_cli.parse_shard(value)
+
+
+def test_partitions_are_deterministic_and_keep_duplicates_together():
+    row_dicts = rows(50)
+    assert [batch_cli.partition_of(r, 4) for r in row_dicts] == [batch_cli.partition_of(r, 4) for r in row_dicts]
+    duplicate = {"URL": " https://EXAMPLE.com/7", "Certifier": "example", "Certification Name": "cert 7"}
+    assert batch_cli.partition_of(duplicate, 4) == batch_cli.partition_of(row_dicts[7], 4)
+
+
+def test_partition_levels_split_a_shard_evenly():
+    row_dicts = rows(2000)
+    shard = [r for r in row_dicts if batch_cli.partition_of(r, 2) == 0]
+    sizes = Counter(batch_cli.partition_of(r, 4, level=1) for r in shard)
+    assert len(sizes) == 4
+    assert min(sizes.values()) > len(shard) / 4 * 0.7
+
+
+def test_provider_partitions_keep_a_provider_together():
+    row_dicts = rows(20, "Alpha") + rows(20, "Beta")
+    alpha = {batch_cli.partition_of(r, 8, by_provider=True) for r in row_dicts[:20]}
+    beta = {batch_cli.partition_of(r, 8, by_provider=True) for r in row_dicts[20:]}
+    assert len(alpha) == len(beta) == 1
+
+
+def test_shard_results_round_trip_and_later_files_win(tmp_path):
+    args = argparse.Namespace(workbook="data.xlsx", shard=(1, 2))
+    first, second = tmp_path / "shard1.json", tmp_path / "shard2.json"
+    batch_cli.save_results(str(first), {2: answer("A"), 3: answer("B")}, args)
+    batch_cli.save_results(str(second), {3: answer("B2"), 4: answer("C")}, args)
+    merged = batch_cli.load_results([str(first), str(second)])
+    assert {row: result["newCertificateName"] for row, result in merged.items()} == {2: "A", 3: "B2", 4: "C"}
+
+
+def test_merge_writes_the_shards_into_the_workbook(tmp_path):
+    workbook = tmp_path / "data.xlsx"
+    wb = openpyxl.Workbook()
+    wb.active.append(HEADERS)
+    for row_dict in rows(3):
+        wb.active.append(list(row_dict.values()) + [None, None])
+    wb.save(workbook)
+    args = argparse.Namespace(workbook=str(workbook), shard=(1, 2))
+    batch_cli.save_results(str(tmp_path / "shard1.json"), {2: answer("A"), 4: answer("C")}, args)
+    args.shard = (2, 2)
+    batch_cli.save_results(str(tmp_path / "shard2.json"), {3: answer("B")}, args)
+
+    output = tmp_path / "updated.xlsx"
+    assert batch_cli.main(["merge", str(workbook), str(tmp_path / "shard1.json"), str(tmp_path / "shard2.json"),
+                           "--output", str(output)]) == 0
+    ws = openpyxl.load_workbook(output).active
+    assert [row[3] for row in ws.iter_rows(min_row=2, values_only=True)] == ["A", "B", "C"]
+
+
+def test_run_needs_an_output(tmp_path):
+    assert batch_cli.main(["run", str(tmp_path / "data.xlsx")]) == 2
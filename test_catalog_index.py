@@ -0,0 +1,89 @@
+"""
+Tests for catalog lookups (catalog_index.py).
+"""
+
+import time
+
+from catalog_index import EXISTS, RENAMED, SLIGHT_DIFFERENCE, CatalogIndex
+from result_cache import is_agent_answer
+
+NAME = "Azure Administrator Associate AZ-104"
+
+
+def make_index(**kwargs):
+    index = CatalogIndex(max_age_days=kwargs.pop("max_age_days", 0), **kwargs)
+    index.add("Microsoft", NAME, NAME, EXISTS, url="https://learn.microsoft.com/certs")
+    index.add("Microsoft", "Azure Fundamentals AZ-900", "Azure Fundamentals AZ-900", EXISTS)
+    return index
+
+
+def row(name, certifier="Microsoft", url="https://learn.microsoft.com/x"):
+    return {"URL": url, "Certifier": certifier, "Certification Name": name}
+
+
+def test_exact_match_is_answered_locally():
+    result = make_index().resolve(row(" azure administrator associate az-104 "))
+    assert is_agent_answer(result)
+    assert result["newCertificateName"] == NAME
+    assert result["remark"] == EXISTS
+    assert result["_catalog"] == 1.0
+
+
+def test_fuzzy_match_at_or_above_min_score():
+    index = make_index(min_score=0.9)
+    result = index.resolve(row("Azure Administrator Asociate AZ-104"))
+    assert result["newCertificateName"] == NAME
+    assert result["remark"] == SLIGHT_DIFFERENCE
+    assert 0.9 <= result["_catalog"] < 1.0
+    assert index.stats()["fuzzy"] == 1
+
+
+def test_fuzzy_match_below_min_score_goes_to_the_agent():
+    index = make_index(min_score=0.99)
+    assert index.resolve(row("Azure Administrator Asociate AZ-104")) is None
+    assert index.stats()["miss"] == 1
+
+
+def test_other_exam_code_is_ambiguous():
+    index = make_index(min_score=0.9)
+    assert index.resolve(row("Azure Administrator Associate AZ-204")) is None
+    assert index.resolve(row("Azure Administrator Associate AZ-104 II")) is None
+    assert index.stats()["ambiguous"] == 2
+    assert index.stats()["fuzzy"] == 0
+
+
+def test_other_certifier_or_host_is_not_answered():
+    index = make_index()
+    assert index.resolve(row(NAME, certifier="Amazon")) is None
+    assert index.resolve(row(NAME, url="https://example.com/az-104")) is None
+
+
+def test_stale_entries_are_reverified():
+    index = CatalogIndex(max_age_days=1)
+    index.add("Microsoft", NAME, NAME, EXISTS, seen_at=time.time() - 2 * 86400)
+    assert index.resolve(row(NAME)) is None
+    assert index.stats()["stale"] == 1
+
+
+def test_renames_index_the_new_name():
+    index = CatalogIndex(max_age_days=0)
+    index.add_result("Microsoft", "Azure Admin AZ-104", None,
+                     {"newCertificateName": NAME, "remark": RENAMED})
+    assert index.resolve(row("Azure Admin AZ-104"))["remark"] == RENAMED
+    assert index.resolve(row(NAME))["remark"] == EXISTS
+
+
+def test_fuzzy_lookup_finds_the_entry_among_many_sharing_common_words():
+    index = CatalogIndex(max_age_days=0, min_score=0.9)
+    for n in range(100, 400):
+        index.add("Microsoft", f"Azure Data Engineer Associate DP-{n}", f"Azure Data Engineer Associate DP-{n}", EXISTS)
+    result = index.resolve(row("Azure Data Enginer Associate DP-203"))
+    assert result["newCertificateName"] == "Azure Data Engineer Associate DP-203"
+
+
+def test_entries_sharing_under_half_the_tokens_are_not_scored():
+    index = CatalogIndex(max_age_days=0, min_score=0.5)
+    index.add("Microsoft", "Power Platform Fundamentals", "Power Platform Fundamentals", EXISTS)
+    assert index.lookup("Microsoft", "Power Platform Fundamentals")[0] == "exact"
+    assert index.lookup("Microsoft", "Power Plattform Fundamental")[0] == "miss"
+    assert index.lookup("Microsoft", "Power Platform Fundamental")[0] == "fuzzy"
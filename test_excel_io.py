@@ -0,0 +1,66 @@
+"""
+Tests for writing results back into workbooks (excel_io.py).
+"""
+
+import openpyxl
+
+from excel_io import write_results, write_workbook_results
+
+HEADERS = ["URL", "Certifier", "Certification Name", "NEW CERTIFICATE NAME BY AGENT", "AGENT REMARKS"]
+COLUMN_MAP = {"NEW CERTIFICATE NAME BY AGENT": "newCertificateName", "AGENT REMARKS": "remark"}
+
+
+def make_workbook(path, active="Q2"):
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for title in ("Q1", "Q2", "Notes"):
+        ws = wb.create_sheet(title)
+        if title == "Notes":
+            ws.append(["Reviewed by", "Alex"])
+            continue
+        ws.append(HEADERS)
+        for i in range(3):
+            ws.append([f"https://example.com/{i}", "Example", f"{title} cert {i}", None, None])
+    wb.active = wb.sheetnames.index(active)
+    wb.save(path)
+    return path
+
+
+def values(ws):
+    return [list(row) for row in ws.iter_rows(values_only=True)]
+
+
+def test_write_results_keeps_every_sheet(tmp_path):
+    source = make_workbook(tmp_path / "in.xlsx")
+    output = tmp_path / "out.xlsx"
+    write_results(source, output, {3: {"newCertificateName": "New", "remark": "Certificate has been renamed."}},
+                  COLUMN_MAP, "Q1")
+    before, after = openpyxl.load_workbook(source), openpyxl.load_workbook(output)
+    assert after.sheetnames == ["Q1", "Q2", "Notes"]
+    assert values(after["Q1"])[2][3:] == ["New", "Certificate has been renamed."]
+    assert values(after["Q1"])[1] == values(before["Q1"])[1]
+    assert values(after["Q2"]) == values(before["Q2"])
+    assert values(after["Notes"]) == values(before["Notes"])
+
+
+def test_write_results_defaults_to_the_active_sheet(tmp_path):
+    source = make_workbook(tmp_path / "in.xlsx", active="Q2")
+    output = tmp_path / "out.xlsx"
+    write_results(source, output, {2: {"newCertificateName": "Q2 cert 0", "remark": "Certificate exists."}},
+                  COLUMN_MAP)
+    after = openpyxl.load_workbook(output)
+    assert after.active.title == "Q2"
+    assert values(after["Q2"])[1][3:] == ["Q2 cert 0", "Certificate exists."]
+    assert values(after["Q1"])[1][3:] == [None, None]
+
+
+def test_write_workbook_results_merges_several_sheets(tmp_path):
+    source = make_workbook(tmp_path / "in.xlsx")
+    output = tmp_path / "out.xlsx"
+    write_workbook_results(source, output, {
+        "Q1": {4: {"newCertificateName": "A", "remark": "Certificate exists."}},
+        "Q2": {2: {"newCertificateName": "B", "remark": "Certificate exists."}},
+    }, COLUMN_MAP)
+    after = openpyxl.load_workbook(output)
+    assert values(after["Q1"])[3][3] == "A"
+    assert values(after["Q2"])[1][3] == "B"
@@ -0,0 +1,101 @@
+"""
+Tests for multi-file input and output (input_sources.py).
+"""
+
+import csv
+
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import config
+from input_sources import Provenance, iter_rows, open_sources, source_kind, write_outputs
+
+COLUMNS = ["URL", "Certifier", "Certification Name"]
+COLUMN_MAP = {"NEW CERTIFICATE NAME BY AGENT": "newCertificateName", "AGENT REMARKS": "remark"}
+
+
+def answer(name):
+    return {"newCertificateName": name, "remark": "Certificate exists."}
+
+
+def write_csv(path, delimiter=","):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(COLUMNS + ["Notes"])
+        writer.writerow(["https://example.com/a", "Example", "Cert A", "keep"])
+        writer.writerow(["", "", "", "empty row"])
+        writer.writerow(["https://example.com/b", "Example", "Cert B", ""])
+    return path
+
+
+def write_parquet(path, count=3):
+    schema = pa.schema([("URL", pa.string()), ("Certifier", pa.string()), ("Certification Name", pa.string()),
+                        ("Score", pa.int64())])
+    columns = [[f"https://example.com/{i}" for i in range(count)], ["Example"] * count,
+               [f"Cert {i}" for i in range(count)], list(range(count))]
+    pq.write_table(pa.table(columns, schema=schema), path)
+    return path
+
+
+def write_workbook(path):
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for title in ("Q1", "Q2"):
+        ws = wb.create_sheet(title)
+        ws.append(COLUMNS)
+        ws.append(["https://example.com/x", "Example", f"{title} cert"])
+    wb.save(path)
+    return path
+
+
+def test_source_kind():
+    assert source_kind("Data.CSV") == "csv"
+    with pytest.raises(ValueError):
+        source_kind("data.json")
+
+
+def test_rows_of_every_file_and_sheet_in_one_stream(tmp_path):
+    sources = open_sources([str(write_workbook(tmp_path / "book.xlsx")), str(write_csv(tmp_path / "a.csv", ";")),
+                            str(write_parquet(tmp_path / "c.parquet"))])
+    assert [source.label for source in sources] == ["book.xlsx [Q1]", "book.xlsx [Q2]", "a.csv", "c.parquet"]
+    rows = list(iter_rows(sources, COLUMNS))
+    assert [str(provenance) for provenance, _ in rows][:4] == [
+        "book.xlsx [Q1] row 2", "book.xlsx [Q2] row 2", "a.csv row 2", "a.csv row 4"]
+    # Only the selected columns are read, whatever the delimiter
+    assert rows[2][1] == {"URL": "https://example.com/a", "Certifier": "Example", "Certification Name": "Cert A"}
+    assert len(rows) == 7
+
+
+def test_sheets_can_be_selected_and_same_named_files_kept_apart(tmp_path):
+    (tmp_path / "one").mkdir()
+    (tmp_path / "two").mkdir()
+    sources = open_sources([str(write_workbook(tmp_path / "one" / "book.xlsx")),
+                            str(write_workbook(tmp_path / "two" / "book.xlsx"))], sheets=["Q2"])
+    assert [source.label for source in sources] == ["book.xlsx [Q2]", "book_2.xlsx [Q2]"]
+
+
+def test_results_are_written_back_in_each_format(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "INPUT_CHUNK_ROWS", 2)
+    sources = open_sources([str(write_csv(tmp_path / "a.csv", ";")), str(write_parquet(tmp_path / "c.parquet"))])
+    results = {Provenance("a.csv", "", 4): answer("B"), Provenance("c.parquet", "", 4): answer("Two")}
+    csv_path, parquet_path = write_outputs(sources, results, COLUMN_MAP, str(tmp_path / "out"))
+
+    with open(csv_path, encoding="utf-8", newline="") as f:
+        written = list(csv.reader(f, delimiter=";"))
+    assert written[0] == COLUMNS + ["Notes"] + list(COLUMN_MAP)
+    assert written[1] == ["https://example.com/a", "Example", "Cert A", "keep"]
+    assert written[3][-2:] == ["B", "Certificate exists."]
+
+    table = pq.read_table(parquet_path)
+    assert table.column("NEW CERTIFICATE NAME BY AGENT").to_pylist() == [None, None, "Two"]
+    assert table.column("Score").to_pylist() == [0, 1, 2]
+
+
+def test_parquet_without_rows_keeps_its_columns(tmp_path):
+    sources = open_sources([str(write_parquet(tmp_path / "empty.parquet", count=0))])
+    (output_path,) = write_outputs(sources, {}, COLUMN_MAP, str(tmp_path))
+    schema = pq.read_schema(output_path)
+    assert schema.names == ["URL", "Certifier", "Certification Name", "Score"] + list(COLUMN_MAP)
+    assert schema.field("AGENT REMARKS").type == pa.string()
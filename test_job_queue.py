@@ -0,0 +1,117 @@
+"""
+Tests for job and chunk state transitions in the job queue (job_queue.py).
+"""
+
+import time
+
+import pytest
+
+import config
+from job_queue import ACTIVE_STATUSES, FINAL_STATUSES, JobCancelled, JobQueue
+
+COLUMN_MAP = {"AGENT REMARKS": "remark"}
+RESULT = {"newCertificateName": "Cert", "remark": "Certificate exists."}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(path=str(tmp_path / "jobs.sqlite3"), job_dir=str(tmp_path / "jobs"), chunk_rows=2,
+                     lease_seconds=60)
+    yield queue
+    queue.close()
+
+
+def rows(count):
+    return [(i + 2, {"Certification Name": f"Cert {i}"}) for i in range(count)]
+
+
+def submit(queue, count=3, **kwargs):
+    return queue.submit(b"workbook", "in.xlsx", rows(count), COLUMN_MAP, **kwargs)
+
+
+def finish_chunk(queue, job, worker="w1"):
+    queue.record_results(job["job_id"], {n: RESULT for n, _ in queue.pending_rows(job["job_id"], job["chunk"])})
+    return queue.complete_chunk(job["job_id"], job["chunk"], worker)
+
+
+def test_job_runs_through_writing_to_done(queue):
+    job_id = submit(queue)
+    assert queue.job(job_id)["status"] == "queued"
+    first = queue.claim("w1")
+    assert (first["job_id"], first["chunk"], queue.job(job_id)["status"]) == (job_id, 0, "running")
+    assert not finish_chunk(queue, first)
+    second = queue.claim("w1")
+    assert second["chunk"] == 1
+    assert finish_chunk(queue, second)
+    assert queue.job(job_id)["status"] == "writing"
+    assert queue.claim("w2") is None
+    queue.finish_job(job_id, "out.xlsx")
+    job = queue.job(job_id)
+    assert (job["status"], job["output_path"], job["completed"]) == ("done", "out.xlsx", 3)
+    assert sorted(queue.results(job_id)) == [2, 3, 4]
+
+
+def test_job_without_rows_is_done(queue):
+    assert queue.job(submit(queue, count=0))["status"] == "done"
+
+
+def test_writing_is_active_and_can_be_cancelled(queue):
+    job_id = submit(queue, count=1)
+    assert finish_chunk(queue, queue.claim("w1"))
+    assert "writing" in ACTIVE_STATUSES and "writing" not in FINAL_STATUSES
+    assert queue.cancel(job_id)
+    queue.finish_job(job_id, "out.xlsx")
+    assert queue.job(job_id)["status"] == "cancelled"
+
+
+def test_interrupted_write_back_is_handed_out_again(queue):
+    queue.lease_seconds = 0.05
+    job_id = submit(queue, count=1)
+    assert finish_chunk(queue, queue.claim("dead"), "dead")
+    time.sleep(0.1)
+    job = queue.claim("w2")
+    assert (job["job_id"], job["chunk"]) == (job_id, 0)
+    assert queue.pending_rows(job_id, 0) == []
+    assert queue.complete_chunk(job_id, 0, "w2")
+    queue.finish_job(job_id, "out.xlsx")
+    assert queue.job(job_id)["status"] == "done"
+
+
+def test_cancel_stops_heartbeats_and_claims(queue):
+    job_id = submit(queue)
+    job = queue.claim("w1")
+    queue.heartbeat(job_id, job["chunk"], "w1")
+    assert queue.cancel(job_id)
+    with pytest.raises(JobCancelled):
+        queue.heartbeat(job_id, job["chunk"], "w1")
+    assert queue.claim("w2") is None
+    assert not queue.cancel(job_id)
+
+
+def test_expired_lease_goes_to_another_worker(queue):
+    queue.lease_seconds = 0.05
+    job_id = submit(queue, count=1)
+    queue.claim("dead")
+    time.sleep(0.1)
+    assert queue.claim("w2")["job_id"] == job_id
+    with pytest.raises(JobCancelled):
+        queue.heartbeat(job_id, 0, "dead")
+
+
+def test_failed_chunk_is_retried_then_fails_the_job(queue, monkeypatch):
+    monkeypatch.setattr(config, "JOB_MAX_ATTEMPTS", 2)
+    job_id = submit(queue, count=1)
+    queue.fail_chunk(job_id, queue.claim("w1")["chunk"], "w1", "boom")
+    assert queue.job(job_id)["status"] == "running"
+    queue.fail_chunk(job_id, queue.claim("w1")["chunk"], "w1", "boom")
+    job = queue.job(job_id)
+    assert (job["status"], job["error"]) == ("failed", "boom")
+    assert queue.claim("w1") is None
+
+
+def test_claims_follow_priority_then_round_robin(queue):
+    low_a = submit(queue, count=4)
+    low_b = submit(queue, count=4)
+    high = submit(queue, count=1, priority=5)
+    claimed = [queue.claim("w1")["job_id"] for _ in range(5)]
+    assert claimed == [high, low_a, low_b, low_a, low_b]
@@ -0,0 +1,132 @@
+"""
+Tests for certifier-affinity scheduling and the shared provider context (provider_context.py).
+"""
+
+import threading
+import time
+
+import pytest
+
+import agent_api
+import config
+from agent_registry import AgentRegistry
+from fake_backend import FakeProjectClient
+from provider_context import (
+    PROVIDER_CONTEXT_HEADER,
+    ProviderContextCache,
+    interleave,
+    provider_key,
+    with_context,
+)
+from result_cache import is_agent_answer
+
+
+def rows(count, certifier, host="example.com"):
+    return [{"URL": f"https://{host}/{certifier}/{i}", "Certifier": certifier,
+             "Certification Name": f"{certifier} cert {i}"} for i in range(count)]
+
+
+def plan(row_dicts, batch_size=1, min_group_rows=3):
+    groups = list(agent_api.group_duplicate_rows(row_dicts).values())
+    return agent_api.plan_units(row_dicts, groups, batch_size, "affinity", min_group_rows)
+
+
+def test_provider_key_is_certifier_and_host():
+    assert provider_key({"URL": "https://www.Example.com/a", "Certifier": " ACME  Inc. "}) == "acme inc|example.com"
+    assert provider_key({"certifier": "Acme"}) == "acme|"
+    assert provider_key({"Certification Name": "Cert"}) == ""
+
+
+def test_interleave_round_robins_over_buckets():
+    assert interleave([[1, 2, 3], [], ["a", "b"], ["x"]]) == [1, "a", "x", 2, "b", 3]
+
+
+def test_affinity_units_group_providers_and_interleave_them_largest_first():
+    row_dicts = rows(2, "beta") + rows(4, "alpha") + rows(1, "gamma")
+    planned = plan(row_dicts, batch_size=2)
+    assert [key.split("|")[0] for _, key, _ in planned] == ["alpha", "beta", "gamma", "alpha"]
+    assert [unit for unit, _, _ in planned] == [[[2], [3]], [[0], [1]], [[6]], [[4], [5]]]
+    # Only alpha has enough rows spread over several runs to share a summary
+    assert [context for _, _, context in planned] == ["alpha|example.com", None, None, "alpha|example.com"]
+
+
+def test_with_context_prefixes_the_summary():
+    assert with_context("row", None) == "row"
+    assert with_context("row", "A\nB").startswith(PROVIDER_CONTEXT_HEADER)
+    assert with_context("row", "A\nB").endswith("A\nB\n\nrow")
+
+
+# Provider context cache
+
+def test_one_build_per_provider_while_others_wait():
+    cache = ProviderContextCache(ttl_seconds=60, max_chars=0)
+    builds = []
+
+    def build():
+        builds.append(1)
+        time.sleep(0.05)
+        return "listing"
+    summaries = []
+    threads = [threading.Thread(target=lambda: summaries.append(cache.get("acme|", build))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert summaries == ["listing"] * 4 and len(builds) == 1
+    assert cache.stats()["provider_contexts_built"] == 1 and cache.stats()["provider_context_hits"] == 3
+
+
+def test_failed_builds_are_remembered_until_they_expire():
+    cache = ProviderContextCache(ttl_seconds=0.02, max_chars=0)
+    assert cache.get("acme|", lambda: None) is None
+    assert cache.get("acme|", lambda: "listing") is None
+    time.sleep(0.03)
+    assert cache.get("acme|", lambda: "listing") == "listing"
+    assert cache.stats()["provider_context_failures"] == 1
+
+
+def test_build_exceptions_are_not_cached():
+    cache = ProviderContextCache(ttl_seconds=60, max_chars=0)
+
+    def throttled():
+        raise RuntimeError("Run throttled")
+    with pytest.raises(RuntimeError):
+        cache.get("acme|", throttled)
+    assert cache.get("acme|", lambda: "listing") == "listing"
+
+
+def test_long_summaries_are_cut_at_a_line_end():
+    cache = ProviderContextCache(ttl_seconds=60, max_chars=12)
+    assert cache.get("acme|", lambda: "Cert one\nCert two\nCert three") == "Cert one"
+
+
+# Affinity scheduling on the fake backend
+
+@pytest.fixture
+def fake(monkeypatch):
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "CATALOG_ENABLED", False)
+    monkeypatch.setattr(config, "PROVIDER_MIN_GROUP_ROWS", 3)
+    monkeypatch.setattr(agent_api, "_agent_registry", AgentRegistry(path=""))
+    monkeypatch.setattr(agent_api, "_provider_contexts", ProviderContextCache(ttl_seconds=60))
+    client = FakeProjectClient(latency=0)
+    agent_api.use_backend(client)
+    yield client
+    agent_api.use_backend(None)
+
+
+def test_affinity_searches_once_per_provider(fake):
+    row_dicts = rows(4, "alpha") + rows(4, "beta")
+    stats = {}
+    results = agent_api.process_rows_with_progress(row_dicts, max_workers=2, schedule="affinity", stats=stats)
+    assert [r["newCertificateName"] for r in results] == [r["Certification Name"] for r in row_dicts]
+    assert all(is_agent_answer(r) for r in results)
+    assert stats["provider_contexts_built"] == 2 and stats["provider_groups"] == 2
+    # One summary run per provider searches the web; the rows answer from it
+    assert stats["grounding_calls"] == 2
+
+
+def test_sheet_order_searches_for_every_row(fake):
+    stats = {}
+    agent_api.process_rows_with_progress(rows(4, "alpha"), max_workers=2, schedule="sheet", stats=stats)
+    assert stats["grounding_calls"] == 4 and stats["provider_contexts_built"] == 0
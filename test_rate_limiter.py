@@ -0,0 +1,147 @@
+"""
+Tests for throttling classification and the adaptive concurrency limiter (rate_limiter.py).
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import config
+from rate_limiter import (
+    AdaptiveConcurrencyLimiter,
+    ThrottledError,
+    TokenBucket,
+    parse_retry_after,
+    run_throttle_error,
+    throttle_retry_after,
+)
+from retry_policy import PERMANENT, THROTTLED, RunFailedError, classify
+
+
+class HttpError(Exception):
+    """Stand-in for azure.core HttpResponseError: status code, parsed error body and response headers."""
+
+    def __init__(self, message, status_code=None, code=None, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error = SimpleNamespace(code=code) if code else None
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+def failed_run(code, message=""):
+    return SimpleNamespace(status="failed", last_error=SimpleNamespace(code=code, message=message))
+
+
+# Classification
+
+def test_status_429_is_throttling_with_retry_after_header():
+    assert throttle_retry_after(HttpError("Too Many Requests", 429, headers={"Retry-After": "7"})) == 7.0
+    assert throttle_retry_after(HttpError("Too Many Requests", 429, headers={"retry-after-ms": "1500"})) == 1.5
+    assert throttle_retry_after(HttpError("Rate limited, try again in 3 seconds", 429)) == 3.0
+    assert throttle_retry_after(HttpError("Too Many Requests", 429)) == 0.0
+
+
+def test_throttling_error_codes_without_status():
+    assert throttle_retry_after(HttpError("Requests exceeded", code="429")) == 0.0
+    assert throttle_retry_after(HttpError("Slow down", code="RateLimitExceeded")) == 0.0
+    assert throttle_retry_after(ThrottledError("Run throttled", retry_after=2)) == 2
+
+
+def test_messages_mentioning_429_or_quota_are_not_throttling():
+    assert throttle_retry_after(ValueError("Row 429 has no URL")) is None
+    assert throttle_retry_after(ValueError("Could not fetch https://example.com/cert/429")) is None
+    assert throttle_retry_after(HttpError("Quota details unavailable", 500)) is None
+
+
+def test_exhausted_quota_fails_fast():
+    quota = HttpError("You exceeded your current quota", 429, code="insufficient_quota")
+    assert throttle_retry_after(quota) is None
+    assert classify(quota) == PERMANENT
+    assert run_throttle_error(failed_run("insufficient_quota", "Quota exhausted")) is None
+    assert classify(RunFailedError(failed_run("insufficient_quota"))) == PERMANENT
+
+
+def test_failed_runs_are_classified_by_error_code():
+    throttled = run_throttle_error(failed_run("rate_limit_exceeded", "Try again in 4 seconds."))
+    assert isinstance(throttled, ThrottledError) and throttled.retry_after == 4.0
+    assert classify(throttled) == THROTTLED
+    assert run_throttle_error(failed_run("server_error", "rate limit of 429 rows per sheet")) is None
+    assert run_throttle_error(SimpleNamespace(status="completed", last_error=None)) is None
+
+
+def test_parse_retry_after_units():
+    assert parse_retry_after("Please retry after 250 ms") == 0.25
+    assert parse_retry_after("try again in 2 seconds") == 2.0
+    assert parse_retry_after("no hint") is None
+
+
+# AIMD window
+
+def test_limit_grows_additively_and_halves_on_throttling(monkeypatch):
+    monkeypatch.setattr(config, "THROTTLE_DEFAULT_BACKOFF_SECONDS", 30)
+    limiter = AdaptiveConcurrencyLimiter(max_limit=8, initial_limit=2, requests_per_minute=0, tokens_per_minute=0)
+    for _ in range(4):
+        assert limiter.try_acquire()
+        limiter.release_success()
+    assert limiter.current_limit == 3
+    assert limiter.try_acquire()
+    limiter.release_throttled()
+    assert limiter.current_limit == 1
+    assert 29 < limiter.wait_time() <= 30
+    assert not limiter.try_acquire()
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_in_flight_never_exceeds_the_limit():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=4, initial_limit=2, requests_per_minute=0, tokens_per_minute=0)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release_error()
+    assert limiter.current_limit == 2
+    assert limiter.try_acquire()
+    assert limiter.stats()["peak_in_flight"] == 2
+
+
+def test_limit_stays_within_bounds():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=2, initial_limit=2, requests_per_minute=0, tokens_per_minute=0)
+    for _ in range(10):
+        limiter.try_acquire()
+        limiter.release_success()
+    assert limiter.current_limit == 2
+    limiter.cap(1)
+    assert limiter.current_limit == 1
+    for _ in range(3):
+        limiter.try_acquire()
+        limiter.release_throttled(0.001)
+    assert limiter.current_limit == 1
+
+
+# Token buckets
+
+def test_token_bucket_refills_continuously():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 1.0) == 0.0
+    # Requests larger than the bucket wait for a full bucket, not forever
+    assert bucket.wait_time(600, now + 1.0) == pytest.approx(59.0)
+
+
+def test_requests_per_minute_budget_blocks_new_requests():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=10, initial_limit=10, requests_per_minute=2, tokens_per_minute=0)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    assert 0 < limiter.wait_time() <= 30
+
+
+def test_tokens_per_minute_budget_uses_reported_usage():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=10, initial_limit=10, requests_per_minute=0,
+                                         tokens_per_minute=1000, tokens_per_request=400)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    # The two runs used 100 tokens each, not the 400 estimated
+    limiter.record_tokens(100)
+    limiter.record_tokens(100)
+    assert limiter.try_acquire()
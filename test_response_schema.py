@@ -0,0 +1,98 @@
+"""
+Tests for reply validation and repair (response_schema.py) on the fake backend.
+"""
+
+import json
+
+import pytest
+
+import agent_api
+import config
+from agent_registry import AgentRegistry
+from fake_backend import FakeProjectClient
+from response_schema import BATCH_REPLY, REMARKS, ROW_REPLY, ReplyStats, repair_prompt
+from result_cache import is_agent_answer
+
+
+def test_row_reply_is_normalized():
+    result, error = ROW_REPLY.parse('```json\n{"newCertificateName": null, "remark": "certificate  EXISTS"}\n```')
+    assert error is None
+    assert result == {"newCertificateName": "", "remark": "Certificate exists."}
+    result, _ = ROW_REPLY.parse('Here you go: {"newCertificateName": "A", "remark": "Certificate has been renamed"}')
+    assert result["remark"] == "Certificate has been renamed."
+
+
+@pytest.mark.parametrize("reply, problem", [
+    ("I could not format that as JSON, sorry.", "no JSON"),
+    ('{"newCertificateName": "A", "remark": "Looks fine"}', "allowed remarks"),
+    ('{"newCertificateName": 7, "remark": "Certificate exists."}', "must be a string"),
+    ('{"newCertificateName": "A", "remark": }', "not valid JSON"),
+])
+def test_malformed_row_replies_name_the_problem(reply, problem):
+    result, error = ROW_REPLY.parse(reply)
+    assert result is None and problem in error
+
+
+def test_batch_reply_accepts_a_bare_array_or_wrapped_results():
+    items = [{"id": 0, "newCertificateName": "A", "remark": REMARKS[0]}]
+    assert BATCH_REPLY.parse(json.dumps(items)) == (items, None)
+    assert BATCH_REPLY.parse(json.dumps({"results": items})) == (items, None)
+    assert BATCH_REPLY.parse('{"answer": 1}') == (None, "expected a JSON array of answers")
+
+
+def test_response_format_and_repair_prompt_carry_the_schema():
+    response_format = ROW_REPLY.response_format()
+    assert response_format["json_schema"]["strict"] is True
+    assert response_format["json_schema"]["schema"]["required"] == ["newCertificateName", "remark"]
+    prompt = repair_prompt("reply contains no JSON", ROW_REPLY)
+    assert "reply contains no JSON" in prompt and "Do not search again" in prompt
+    assert json.dumps(ROW_REPLY.schema, separators=(",", ":")) in prompt
+
+
+def test_reply_stats_summary():
+    stats = ReplyStats()
+    stats.record("replies", 4)
+    stats.record("parse_failures")
+    stats.record("repairs")
+    assert ReplyStats.summary(stats.snapshot())["parse_failure_rate"] == 0.25
+    assert ReplyStats.summary(stats.snapshot())["repair_rate"] == 0.0
+
+
+@pytest.fixture
+def malformed_once(monkeypatch):
+    """Fake backend whose first reply is malformed and every later reply valid."""
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "CATALOG_ENABLED", False)
+    monkeypatch.setattr(agent_api, "_agent_registry", AgentRegistry(path=""))
+    client = FakeProjectClient(latency=0, malformed_rate=1.0)
+    complete = client.state.complete
+
+    def complete_once(run):
+        run = complete(run)
+        client.state.malformed_rate = 0.0
+        return run
+    client.state.complete = complete_once
+    agent_api.use_backend(client)
+    yield client
+    agent_api.use_backend(None)
+
+
+ROW = {"URL": "https://example.com/1", "Certifier": "Example", "Certification Name": "Cert 1"}
+
+
+def test_malformed_reply_is_repaired_without_searching_again(malformed_once):
+    stats = {}
+    results = agent_api.process_rows_with_progress([ROW], max_workers=1, stats=stats)
+    assert is_agent_answer(results[0]) and results[0]["newCertificateName"] == "Cert 1"
+    assert (stats["parse_failures"], stats["repairs"], stats["repaired"]) == (1, 1, 1)
+    # The repair run answers from the thread, without another web search
+    assert stats["grounding_calls"] == 1
+
+
+def test_unrepaired_reply_is_a_parse_error(malformed_once, monkeypatch):
+    monkeypatch.setattr(config, "REPLY_REPAIR_ATTEMPTS", 0)
+    stats = {}
+    results = agent_api.process_rows_with_progress([ROW], max_workers=1, stats=stats)
+    assert {k: v for k, v in results[0].items() if not k.startswith("_")} == {column: "Parse error" for column in ROW}
+    assert not is_agent_answer(results[0])
+    assert (stats["parse_failures"], stats["repairs"]) == (1, 0)
@@ -0,0 +1,87 @@
+"""
+Tests for the verification result cache (result_cache.py).
+"""
+
+from result_cache import ResultCache, agent_answer, is_agent_answer, row_key
+
+ROW = {"URL": "https://learn.microsoft.com", "Certifier": "Microsoft", "Certification Name": "AZ-104"}
+
+
+def test_row_key_ignores_whitespace_and_case():
+    messy = {" url ": "https://learn.microsoft.com ", "CERTIFIER": "microsoft",
+             "Certification  Name": " az-104"}
+    assert row_key(messy) == row_key(ROW)
+
+
+def test_row_key_ignores_column_order():
+    assert row_key(dict(reversed(list(ROW.items())))) == row_key(ROW)
+
+
+def test_row_key_differs_per_value_and_namespace():
+    assert row_key(dict(ROW, **{"Certification Name": "AZ-204"})) != row_key(ROW)
+    assert row_key(ROW, "fake|agent") != row_key(ROW)
+    assert row_key(ROW, "fake|agent") != row_key(ROW, "azure|agent")
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "cache.sqlite3"))
+    assert cache.get(ROW) is None
+    result = agent_answer({"newCertificateName": "AZ-104", "remark": "Certificate exists."})
+    assert cache.put(ROW, result)
+    assert cache.get({k.upper(): v.upper() for k, v in ROW.items()}) == result
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_cache_stores_only_agent_answers(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "cache.sqlite3"))
+    error = {col: "Error: boom" for col in ROW}
+    assert not is_agent_answer(error)
+    assert not cache.put(ROW, error)
+    assert not cache.put(ROW, {"newCertificateName": "AZ-104", "remark": "Certificate exists."})
+    assert cache.get(ROW) is None
+    cache.close()
+
+
+def test_cache_namespaces_are_separate(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    fake = ResultCache(path=path, namespace="fake|agent")
+    fake.put(ROW, agent_answer({"newCertificateName": "AZ-104", "remark": "Certificate exists."}))
+    fake.close()
+    real = ResultCache(path=path, namespace="azure|agent")
+    assert real.get(ROW) is None
+    real.close()
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "cache.sqlite3"), default_ttl_days=0, remark_ttl_days={})
+    cache.put(ROW, agent_answer({"newCertificateName": "AZ-104", "remark": "Certificate exists."}))
+    assert cache.get(ROW) is None
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "cache.sqlite3"), max_entries=3)
+    rows = [dict(ROW, **{"Certification Name": f"AZ-{i}"}) for i in range(5)]
+    for row in rows:
+        cache.put(row, agent_answer({"newCertificateName": row["Certification Name"], "remark": "Certificate exists."}))
+    assert cache.stats()["entries"] == 3
+    assert cache.evictions == 2
+    assert cache.get(rows[0]) is None
+    assert cache.get(rows[4]) is not None
+    cache.put(rows[4], agent_answer({"newCertificateName": "AZ-4", "remark": "Certificate exists."}))
+    assert cache.stats()["entries"] == 3
+    cache.close()
+
+
+def test_entry_count_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResultCache(path=path, max_entries=2)
+    for i in range(2):
+        cache.put(dict(ROW, **{"Certification Name": f"AZ-{i}"}),
+                  agent_answer({"newCertificateName": "x", "remark": "Certificate exists."}))
+    cache.close()
+    cache = ResultCache(path=path, max_entries=2)
+    cache.put(ROW, agent_answer({"newCertificateName": "AZ-104", "remark": "Certificate exists."}))
+    assert cache.stats()["entries"] == 2
+    cache.close()
@@ -0,0 +1,160 @@
+"""
+Tests for retry classification, deadlines and hedged runs (retry_policy.py).
+"""
+
+import itertools
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import agent_api
+import config
+from agent_registry import AgentRegistry
+from fake_backend import FakeProjectClient
+from rate_limiter import ThrottledError
+from result_cache import is_agent_answer
+from retry_policy import (
+    CANCELLED,
+    PERMANENT,
+    THROTTLED,
+    TRANSIENT,
+    RunCancelled,
+    RunControl,
+    RunDeadlineExceeded,
+    RunFailedError,
+    call_with_retries,
+    classify,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(config, "RETRY_BASE_DELAY_SECONDS", 0.001)
+    monkeypatch.setattr(config, "RETRY_MAX_DELAY_SECONDS", 0.001)
+    monkeypatch.setattr(config, "RETRY_MAX_ATTEMPTS", 3)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def failed_run(code):
+    return SimpleNamespace(status="failed", last_error=SimpleNamespace(code=code, message="failed"))
+
+
+def flaky(*errors):
+    """Function raising ``errors`` in turn, then returning 'ok'; ``calls`` counts the attempts."""
+    remaining = list(errors)
+
+    def fn():
+        fn.calls += 1
+        if remaining:
+            raise remaining.pop(0)
+        return "ok"
+    fn.calls = 0
+    return fn
+
+
+# Classification
+
+def test_classify():
+    assert classify(RunCancelled()) == CANCELLED
+    assert classify(ThrottledError("Run throttled")) == THROTTLED
+    assert classify(StatusError(429)) == THROTTLED
+    assert classify(RunDeadlineExceeded()) == TRANSIENT
+    assert classify(RunFailedError(failed_run("server_error"))) == TRANSIENT
+    assert classify(RunFailedError(failed_run("invalid_prompt"))) == PERMANENT
+    assert classify(StatusError(503)) == TRANSIENT
+    assert classify(StatusError(400)) == PERMANENT
+    assert classify(ConnectionResetError()) == TRANSIENT
+    assert classify(ValueError("bad row")) == PERMANENT
+
+
+# Retries
+
+def test_transient_failures_are_retried():
+    fn = flaky(StatusError(503), ConnectionResetError())
+    control = RunControl(deadline_seconds=0)
+    assert control.bind(call_with_retries)(fn) == "ok"
+    assert fn.calls == 3 and control.retries == 2
+
+
+def test_last_transient_failure_is_raised():
+    fn = flaky(*[StatusError(503)] * 3)
+    with pytest.raises(StatusError):
+        call_with_retries(fn)
+    assert fn.calls == 3
+
+
+@pytest.mark.parametrize("error", [ValueError("bad row"), ThrottledError("Run throttled"), RunCancelled()])
+def test_permanent_throttled_and_cancelled_failures_are_not_retried(error):
+    fn = flaky(error)
+    with pytest.raises(type(error)):
+        call_with_retries(fn)
+    assert fn.calls == 1
+
+
+def test_no_retry_past_the_deadline(monkeypatch):
+    monkeypatch.setattr(config, "RETRY_BASE_DELAY_SECONDS", 5)
+    monkeypatch.setattr(config, "RETRY_MAX_DELAY_SECONDS", 5)
+    monkeypatch.setattr("retry_policy.random.uniform", lambda low, high: high)
+    fn = flaky(StatusError(503))
+    with pytest.raises(StatusError):
+        RunControl(deadline_seconds=1).bind(call_with_retries)(fn)
+    assert fn.calls == 1
+
+
+def test_cancellation_interrupts_the_backoff(monkeypatch):
+    monkeypatch.setattr(config, "RETRY_BASE_DELAY_SECONDS", 5)
+    monkeypatch.setattr(config, "RETRY_MAX_DELAY_SECONDS", 5)
+    control = RunControl(deadline_seconds=0)
+    control.cancel()
+    with pytest.raises(RunCancelled):
+        control.bind(call_with_retries)(flaky(StatusError(503)))
+
+
+def test_control_check():
+    control = RunControl(deadline_seconds=0.01)
+    control.check()
+    time.sleep(0.02)
+    with pytest.raises(RunDeadlineExceeded):
+        control.check()
+    control.cancel()
+    with pytest.raises(RunCancelled):
+        control.check()
+
+
+# Hedging
+
+def test_straggler_is_hedged_and_the_duplicate_wins(monkeypatch):
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "CATALOG_ENABLED", False)
+    monkeypatch.setattr(agent_api, "_agent_registry", AgentRegistry(path=""))
+    monkeypatch.setattr(config, "RUN_COMPLETION_MODE", "poll")
+    monkeypatch.setattr(config, "RUN_POLL_INITIAL_SECONDS", 0.005)
+    monkeypatch.setattr(config, "RUN_POLL_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(config, "HEDGE_MIN_SAMPLES", 4)
+    monkeypatch.setattr(config, "HEDGE_PERCENTILE", 90)
+    monkeypatch.setattr(config, "HEDGE_MAX_FRACTION", 0.5)
+    # The sixth run started is a straggler
+    runs = itertools.count(1)
+    client = FakeProjectClient(latency=lambda: 5.0 if next(runs) == 6 else 0.01)
+    agent_api.use_backend(client)
+    try:
+        row_dicts = [{"URL": f"https://example.com/{i}", "Certifier": "Example", "Certification Name": f"Cert {i}"}
+                     for i in range(8)]
+        stats = {}
+        started = time.monotonic()
+        results = agent_api.process_rows_with_progress(row_dicts, max_workers=2, hedge=True, stats=stats)
+        elapsed = time.monotonic() - started
+    finally:
+        agent_api.use_backend(None)
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(8)]
+    assert all(is_agent_answer(r) for r in results)
+    assert (stats["hedges_launched"], stats["hedges_won"]) == (1, 1)
+    assert sum(r["_hedged"] for r in results) == 1
+    assert client.calls["runs.cancel"] == 1
+    assert elapsed < 5
@@ -0,0 +1,83 @@
+"""
+Tests for the checkpoint journal and resumable runs (run_journal.py).
+"""
+
+import pytest
+
+import agent_api
+import config
+from agent_registry import AgentRegistry
+from fake_backend import FakeProjectClient
+from result_cache import is_agent_answer
+from run_journal import RunJournal, list_runs, make_run_id, process_rows_resumable, workbook_hash
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "CATALOG_ENABLED", False)
+    monkeypatch.setattr(agent_api, "_agent_registry", AgentRegistry(path=""))
+    client = FakeProjectClient(latency=0)
+    agent_api.use_backend(client)
+    yield client
+    agent_api.use_backend(None)
+
+
+def rows(count):
+    return [{"URL": f"https://example.com/{i}", "Certifier": "Example", "Certification Name": f"Cert {i}"}
+            for i in range(count)]
+
+
+def test_run_id_is_stable_for_the_same_workbook_and_columns(tmp_path):
+    path = tmp_path / "book.xlsx"
+    path.write_bytes(b"workbook")
+    wb_hash = workbook_hash(str(path))
+    assert wb_hash == workbook_hash(b"workbook")
+    assert make_run_id(wb_hash, ["URL", "Certifier"]) == make_run_id(wb_hash, ["Certifier", "URL"])
+    assert make_run_id(wb_hash, ["URL"]) != make_run_id(wb_hash, ["URL", "Certifier"])
+
+
+def test_load_keeps_the_latest_entry_and_skips_torn_lines(tmp_path):
+    journal = RunJournal("run", "hash", directory=str(tmp_path))
+    journal.record(2, {"Certification Name": "Run failed"})
+    journal.record(2, agent_api.agent_answer({"newCertificateName": "Cert", "remark": "Certificate exists."}))
+    journal.record(3, {"Certification Name": "Run failed"})
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"type": "row", "row": 4, "ok": tr')
+    assert set(journal.load()) == {2, 3}
+    assert list(journal.completed_results()) == [2]
+    # A journal for another workbook with the same run ID ignores these rows
+    assert RunJournal("run", "other", directory=str(tmp_path)).load() == {}
+    assert list_runs(str(tmp_path)) == ["run"]
+
+
+def test_resume_reruns_only_pending_and_errored_rows(fake, tmp_path):
+    journal = RunJournal("run", "hash", directory=str(tmp_path))
+    row_dicts = rows(4)
+    row_numbers = [2, 3, 4, 5]
+    journal.record(2, agent_api.agent_answer({"newCertificateName": "Journaled", "remark": "Certificate exists."}))
+    journal.record(3, {"Certification Name": "Run failed"})
+
+    stats, completed, progress = {}, [], []
+    results = process_rows_resumable(row_dicts, row_numbers, journal, stats=stats, max_workers=2,
+                                     result_callback=lambda i, result: completed.append(i),
+                                     progress_callback=lambda done, total: progress.append((done, total)))
+    assert [r["newCertificateName"] for r in results] == ["Journaled", "Cert 1", "Cert 2", "Cert 3"]
+    assert fake.calls["messages.create"] == 3
+    assert stats["rows_resumed"] == 1 and stats["run_id"] == "run"
+    assert sorted(completed) == [0, 1, 2, 3]
+    assert progress[-1] == (4, 4)
+    assert sorted(journal.completed_results()) == row_numbers
+
+    # A second resume has nothing left to do
+    again = process_rows_resumable(row_dicts, row_numbers, journal, max_workers=2)
+    assert all(is_agent_answer(r) for r in again)
+    assert fake.calls["messages.create"] == 3
+
+
+def test_resume_false_reruns_every_row(fake, tmp_path):
+    journal = RunJournal("run", "hash", directory=str(tmp_path))
+    journal.record(2, agent_api.agent_answer({"newCertificateName": "Journaled", "remark": "Certificate exists."}))
+    results = process_rows_resumable(rows(1), [2], journal, resume=False, max_workers=1)
+    assert results[0]["newCertificateName"] == "Cert 0"
+    assert fake.calls["messages.create"] == 1
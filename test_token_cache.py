@@ -0,0 +1,164 @@
+"""
+Tests for the shared token cache (token_cache.py) and connection reuse over the HTTP stand-in.
+"""
+
+import asyncio
+import os
+import stat
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import agent_api
+import config
+import token_cache
+from agent_registry import AgentRegistry
+from agent_stand_in import serve
+from result_cache import is_agent_answer
+from token_cache import AsyncCachedCredential, CachedCredential, TokenCache
+
+
+def wait_until(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class Fetcher:
+    """fetch() callable issuing numbered tokens valid for ``lifetime`` seconds, each expiring after the last."""
+
+    def __init__(self, lifetime=3600):
+        self.lifetime = lifetime
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f"token-{self.calls}", int(time.time() + self.lifetime) + self.calls
+
+
+class Credential:
+    """Wrapped sync credential counting its sign-ins."""
+
+    def __init__(self, lifetime=3600):
+        self.fetch = Fetcher(lifetime)
+        self.claims = []
+
+    def get_token(self, *scopes, claims=None, **kwargs):
+        self.claims.append(claims)
+        return SimpleNamespace(**dict(zip(("token", "expires_on"), self.fetch())))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "tokens.json")
+
+
+def test_tokens_are_fetched_once_and_shared_through_the_file(path):
+    fetch = Fetcher()
+    cache = TokenCache(path=path, refresh_ahead_seconds=0)
+    assert cache.get("key", fetch)[0] == cache.get("key", fetch)[0] == "token-1"
+    # A later process loads the token instead of signing in
+    other = TokenCache(path=path, refresh_ahead_seconds=0)
+    assert other.get("key", fetch)[0] == "token-1"
+    assert fetch.calls == 1
+    assert (cache.stats()["token_memory_hits"], other.stats()["token_disk_hits"]) == (1, 1)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_tokens_near_expiry_are_not_handed_out(path):
+    fetch = Fetcher(lifetime=10)
+    cache = TokenCache(path=path, refresh_ahead_seconds=0)
+    cache.get("key", fetch)
+    assert cache.get("key", fetch)[0] == "token-2"
+
+
+def test_tokens_are_renewed_in_the_background_before_they_expire(path):
+    fetch = Fetcher(lifetime=31)
+    cache = TokenCache(path=path, refresh_ahead_seconds=3600)
+    assert cache.get("key", fetch)[0] == "token-1"
+    fetch.lifetime = 3600
+    # Short-lived tokens are renewed halfway through their usable life, here after a second
+    wait_until(lambda: cache.stats()["token_background_refreshes"] == 1)
+    assert cache.lookup("key")[0] == "token-2"
+    assert fetch.calls == 2
+    cache.clear()
+
+
+def test_failed_background_renewal_keeps_the_current_token(path):
+    fetch = Fetcher()
+    cache = TokenCache(path=path, refresh_ahead_seconds=3600)
+    cache.get("key", fetch)
+
+    def failing():
+        raise RuntimeError("Sign-in service unavailable")
+    cache._schedule_refresh("other", failing, (None, time.time() + 31))
+    wait_until(lambda: cache.stats()["token_refresh_failures"] == 1)
+    assert cache.lookup("key")[0] == "token-1"
+    cache.clear()
+
+
+def test_claims_challenges_always_sign_in(path):
+    credential = Credential()
+    cached = CachedCredential(credential, "tenant|client", TokenCache(path=path, refresh_ahead_seconds=0))
+    assert cached.get_token("scope").token == cached.get_token("scope").token == "token-1"
+    assert cached.get_token("scope", claims='{"access_token": {}}').token == "token-2"
+    assert cached.get_token("scope").token == "token-2"
+    assert credential.claims == [None, '{"access_token": {}}']
+
+
+def test_async_credential_renews_a_due_token_in_the_background(path):
+    class AsyncCredential:
+        def __init__(self):
+            self.fetch = Fetcher(lifetime=60)
+
+        async def get_token(self, *scopes, **kwargs):
+            return SimpleNamespace(**dict(zip(("token", "expires_on"), self.fetch())))
+
+        async def close(self):
+            pass
+
+    async def main():
+        credential = AsyncCredential()
+        cached = AsyncCachedCredential(credential, "tenant|client", TokenCache(path=path, refresh_ahead_seconds=120))
+        first = await cached.get_token("scope")
+        # Inside the refresh window: the current token is returned while a new one is fetched
+        second = await cached.get_token("scope")
+        await cached._refresh_task
+        third = await cached.get_token("scope")
+        await cached.close()
+        return first.token, second.token, third.token, credential.fetch.calls
+    assert asyncio.run(main()) == ("token-1", "token-1", "token-2", 2)
+
+
+# Connection reuse over the HTTP stand-in
+
+def test_batch_signs_in_once_and_reuses_connections(path, monkeypatch):
+    server = serve()
+    monkeypatch.setattr(config, "AGENT_BACKEND", "http")
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "CATALOG_ENABLED", False)
+    monkeypatch.setattr(config, "RUN_COMPLETION_MODE", "poll")
+    monkeypatch.setattr(config, "RUN_POLL_INITIAL_SECONDS", 0.01)
+    monkeypatch.setattr(config, "RUN_POLL_INTERVAL_SECONDS", 0.02)
+    monkeypatch.setattr(agent_api, "project_endpoint", server.endpoint)
+    monkeypatch.setattr(agent_api, "_agent_registry", AgentRegistry(path=""))
+    monkeypatch.setattr(token_cache, "_token_cache", TokenCache(path=path, refresh_ahead_seconds=0))
+    agent_api.use_backend(None)
+    try:
+        row_dicts = [{"URL": f"https://example.com/{i}", "Certifier": "Example", "Certification Name": f"Cert {i}"}
+                     for i in range(12)]
+        stats = {}
+        results = agent_api.process_rows_with_progress(row_dicts, max_workers=3, stats=stats)
+    finally:
+        agent_api.use_backend(None)
+        server.shutdown()
+    assert [r["newCertificateName"] for r in results] == [f"Cert {i}" for i in range(12)]
+    assert all(is_agent_answer(r) for r in results)
+    assert server.stats()["tokens_issued"] == stats["token_fetches"] == 1
+    # Every request past the first few found an open connection in the pool
+    assert stats["http_connections_opened"] <= stats["http_pool_size"]
+    assert stats["http_connections_reused"] > stats["http_connections_opened"]
+    # The sign-in goes over its own connection
+    assert server.stats()["connections"] == stats["http_connections_opened"] + 1
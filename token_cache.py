@@ -0,0 +1,362 @@
+"""
+Access tokens shared by the threads and processes of the mapper.
+
+``ClientSecretCredential`` keeps its tokens in process memory only, so every
+new process (batch_cli partitions, job workers, Streamlit sessions) signs in
+again before its first agent call, and a token close to expiry is renewed on
+whichever request finds it stale. ``CachedCredential`` wraps a credential
+with a ``TokenCache``: tokens are kept in memory and in a small JSON file
+(config.TOKEN_CACHE_PATH, readable by its owner only) that later processes
+load instead of signing in, and a background timer renews each token
+config.TOKEN_REFRESH_AHEAD_SECONDS before it expires while requests keep
+using the current one. A lock file makes processes that start together wait
+for one sign-in instead of each requesting a token.
+
+Time spent signing in is recorded as the "auth.get_token" metrics stage.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import config
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process locks only
+    fcntl = None
+
+# Tokens this close to expiry are never handed out (clock skew between machines)
+EXPIRY_SKEW_SECONDS = 30
+
+
+class TokenCache:
+    """Tokens by key as (token, expires_on) pairs, in memory and in a JSON file shared by every process."""
+
+    def __init__(self, path=None, refresh_ahead_seconds=None):
+        self.path = config.TOKEN_CACHE_PATH if path is None else path
+        self.refresh_ahead_seconds = (config.TOKEN_REFRESH_AHEAD_SECONDS if refresh_ahead_seconds is None
+                                      else refresh_ahead_seconds)
+        self._tokens = {}
+        self._timers = {}
+        self._refreshing = set()
+        self._key_locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.fetches = 0
+        self.background_refreshes = 0
+        self.failures = 0
+        self.fetch_seconds = 0.0
+
+    @property
+    def persistent(self):
+        return bool(self.path)
+
+    def usable(self, entry):
+        return entry is not None and entry[1] - time.time() > EXPIRY_SKEW_SECONDS
+
+    def due(self, entry):
+        """True once a token is within the refresh-ahead window of its expiry."""
+        return entry[1] - time.time() <= self.refresh_ahead_seconds
+
+    def _load(self):
+        if not self.persistent or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _save(self, key, entry):
+        if not self.persistent:
+            return
+        entries = {k: v for k, v in self._load().items()
+                   if isinstance(v, dict) and v.get("expires_on", 0) > time.time()}
+        entries[key] = {"token": entry[0], "expires_on": entry[1]}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        # Bearer tokens: create the file readable by its owner only
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    @contextlib.contextmanager
+    def _file_locked(self):
+        """Hold the cache file lock, across processes where the platform supports it."""
+        if not self.persistent or fcntl is None:
+            yield
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def lookup(self, key):
+        """
+        A usable token for ``key`` from memory, else from the cache file.
+
+        Returns:
+            Tuple of (token, expires_on), or None
+        """
+        with self._lock:
+            entry = self._tokens.get(key)
+            if self.usable(entry):
+                self.memory_hits += 1
+                return entry
+        stored = self._load().get(key)
+        if isinstance(stored, dict):
+            entry = (stored.get("token"), stored.get("expires_on", 0))
+            if entry[0] and self.usable(entry):
+                with self._lock:
+                    self.disk_hits += 1
+                    self._tokens[key] = entry
+                return entry
+        return None
+
+    def _remember(self, key, entry):
+        with self._lock:
+            current = self._tokens.get(key)
+            if current is None or current[1] < entry[1]:
+                self._tokens[key] = entry
+        self._save(key, entry)
+        return entry
+
+    def store(self, key, token, expires_on):
+        """Keep a newly issued token in memory and in the cache file."""
+        with self._file_locked():
+            return self._remember(key, (token, expires_on))
+
+    def _fetch(self, key, fetch):
+        """Sign in through ``fetch()``; the caller holds the file lock."""
+        started = time.perf_counter()
+        with metrics.span("auth.get_token"):
+            token, expires_on = fetch()
+        with self._lock:
+            self.fetches += 1
+            self.fetch_seconds += time.perf_counter() - started
+        return self._remember(key, (token, expires_on))
+
+    def get(self, key, fetch):
+        """
+        Token for ``key``, calling ``fetch()`` only when no usable one is cached.
+
+        Args:
+            key: Cache key naming the identity and scopes
+            fetch: Callable returning a new (token, expires_on) pair
+
+        Returns:
+            Tuple of (token, expires_on)
+        """
+        entry = self.lookup(key)
+        if entry is None:
+            # One sign-in per key: other threads, and other processes through the file lock, wait for it
+            with self._key_locks[key], self._file_locked():
+                entry = self.lookup(key)
+                if entry is None:
+                    entry = self._fetch(key, fetch)
+        self._schedule_refresh(key, fetch, entry)
+        return entry
+
+    def _schedule_refresh(self, key, fetch, entry):
+        if not self.refresh_ahead_seconds:
+            return
+        with self._lock:
+            timer = self._timers.get(key)
+            if key in self._refreshing or (timer is not None and timer.expires_on == entry[1]):
+                return
+            if timer is not None:
+                timer.cancel()
+            remaining = entry[1] - time.time()
+            # Tokens living shorter than the refresh window are renewed halfway through their usable life
+            timer = threading.Timer(max(remaining - self.refresh_ahead_seconds, (remaining - EXPIRY_SKEW_SECONDS) / 2),
+                                    self._refresh, args=(key, fetch, entry[1]))
+            timer.name = "token-refresh"
+            timer.daemon = True
+            timer.expires_on = entry[1]
+            self._timers[key] = timer
+            timer.start()
+
+    def _refresh(self, key, fetch, expires_on):
+        with self._lock:
+            self._refreshing.add(key)
+            self._timers.pop(key, None)
+        try:
+            with self._key_locks[key], self._file_locked():
+                # Another process may have renewed the token since this refresh was scheduled
+                entry = self.lookup(key)
+                if entry is None or entry[1] <= expires_on:
+                    entry = self._fetch(key, fetch)
+                    with self._lock:
+                        self.background_refreshes += 1
+        except Exception as e:
+            # Callers keep the current token; their next get() schedules another attempt
+            print(f"Background token refresh failed: {e}")
+            with self._lock:
+                self.failures += 1
+            return
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+        self._schedule_refresh(key, fetch, entry)
+
+    def clear(self):
+        """Forget the in-memory tokens and stop pending refreshes (the cache file is kept)."""
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            self._tokens.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "token_memory_hits": self.memory_hits,
+                "token_disk_hits": self.disk_hits,
+                "token_fetches": self.fetches,
+                "token_background_refreshes": self.background_refreshes,
+                "token_refresh_failures": self.failures,
+                "token_fetch_seconds": round(self.fetch_seconds, 3),
+            }
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    """The token cache shared by every credential of this process."""
+    global _token_cache
+    with _token_cache_lock:
+        if _token_cache is None:
+            _token_cache = TokenCache()
+            metrics.register_counters("auth", _token_cache.stats)
+        return _token_cache
+
+
+def _cache_key(identity, scopes, tenant_id=None, enable_cae=False):
+    return "|".join([identity, tenant_id or "", "cae" if enable_cae else ""] + sorted(scopes))
+
+
+class CachedCredential:
+    """
+    Sync TokenCredential serving tokens from a TokenCache.
+
+    Tokens are fetched from the wrapped credential only when none is cached
+    or one is due for renewal. Requests carrying a claims challenge always
+    reach the wrapped credential.
+    """
+
+    def __init__(self, credential, identity, cache=None):
+        """
+        Args:
+            credential: Wrapped credential (e.g. azure.identity.ClientSecretCredential)
+            identity: Name of the principal, part of every cache key (e.g. "<tenant>|<client ID>")
+            cache: TokenCache to use; the process-wide one when omitted
+        """
+        self.credential = credential
+        self.identity = identity
+        self.cache = cache or get_token_cache()
+
+    def get_token(self, *scopes, claims=None, tenant_id=None, enable_cae=False, **kwargs):
+        from azure.core.credentials import AccessToken
+
+        def fetch():
+            token = self.credential.get_token(*scopes, claims=claims, tenant_id=tenant_id, enable_cae=enable_cae,
+                                              **kwargs)
+            return token.token, token.expires_on
+
+        key = _cache_key(self.identity, scopes, tenant_id, enable_cae)
+        if claims:
+            return AccessToken(*self.cache.store(key, *fetch()))
+        return AccessToken(*self.cache.get(key, fetch))
+
+    def close(self):
+        close = getattr(self.credential, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncCachedCredential:
+    """
+    Async counterpart of CachedCredential over the same TokenCache.
+
+    The wrapped credential is async, so renewal ahead of expiry runs as a task
+    on the caller's event loop, started by the first request inside the
+    refresh window, rather than on a timer thread.
+    """
+
+    def __init__(self, credential, identity, cache=None):
+        self.credential = credential
+        self.identity = identity
+        self.cache = cache or get_token_cache()
+        self._fetch_lock = None
+        self._refresh_task = None
+
+    async def _fetch(self, key, scopes, **kwargs):
+        started = time.perf_counter()
+        with metrics.span("auth.get_token"):
+            token = await self.credential.get_token(*scopes, **kwargs)
+        with self.cache._lock:
+            self.cache.fetches += 1
+            self.cache.fetch_seconds += time.perf_counter() - started
+        return self.cache.store(key, token.token, token.expires_on)
+
+    async def _refresh(self, key, scopes, **kwargs):
+        try:
+            await self._fetch(key, scopes, **kwargs)
+            with self.cache._lock:
+                self.cache.background_refreshes += 1
+        except Exception as e:
+            print(f"Background token refresh failed: {e}")
+            with self.cache._lock:
+                self.cache.failures += 1
+
+    async def get_token(self, *scopes, claims=None, tenant_id=None, enable_cae=False, **kwargs):
+        from azure.core.credentials import AccessToken
+
+        kwargs.update(tenant_id=tenant_id, enable_cae=enable_cae)
+        key = _cache_key(self.identity, scopes, tenant_id, enable_cae)
+        if claims:
+            return AccessToken(*await self._fetch(key, scopes, claims=claims, **kwargs))
+        entry = self.cache.lookup(key)
+        if entry is None:
+            if self._fetch_lock is None:
+                self._fetch_lock = asyncio.Lock()
+            async with self._fetch_lock:
+                entry = self.cache.lookup(key) or await self._fetch(key, scopes, **kwargs)
+        elif self.cache.due(entry) and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.ensure_future(self._refresh(key, scopes, **kwargs))
+        return AccessToken(*entry)
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        await self.credential.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()